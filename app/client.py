@@ -0,0 +1,19 @@
+import httpx
+import openai
+
+from app.config import API_KEY, BASE_URL, FOLDER_ID, LLM_MAX_CONNECTIONS, LLM_KEEPALIVE_SECONDS
+
+# Один клиент на процесс: httpx держит пул keep-alive соединений,
+# поэтому TLS-рукопожатие платится один раз, а не на каждое сообщение
+client = openai.OpenAI(
+    api_key=API_KEY,
+    base_url=BASE_URL,
+    project=FOLDER_ID,
+    http_client=openai.DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        ),
+    ),
+)
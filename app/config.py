@@ -10,4 +10,37 @@ VALIDATION_MODEL = (
 
 SQL_GEN_MODEL = 'gpt://b1gnqq9henvclgrbisso/yandexgpt/rc'
 
+# Читать ответ генератора SQL потоком и обрывать его после конца запроса
+SQL_GEN_STREAM = True
+
 MAX_VALIDATION_TOKENS = 200
+
+# Сколько сообщений пайплайн (валидация, LLM, DuckDB, графики) обрабатывает одновременно
+BOT_WORKERS = 8
+
+# Пул HTTP соединений общего OpenAI клиента (app/client.py)
+LLM_MAX_CONNECTIONS = 20
+LLM_KEEPALIVE_SECONDS = 60
+
+# Защита выполнения сгенерированного SQL (data/guard.py)
+QUERY_TIMEOUT_SECONDS = 15
+QUERY_MAX_ROWS = 10_000
+QUERY_MAX_PLAN_ROWS = 50_000_000
+
+# Кэш "вопрос -> SQL" (app/sql_cache.py)
+SQL_CACHE_PATH = "data/sql_cache.json"
+SQL_CACHE_SIZE = 5000
+SQL_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Поиск перефразированных вопросов (app/semantic_cache.py)
+SEMANTIC_CACHE_THRESHOLD = 0.9
+SEMANTIC_CACHE_SIZE = 100_000
+
+# Подсказки генератору SQL со значениями из базы для терминов вопроса (app/entity_resolution.py)
+ENTITY_HINTS = True
+
+# Каскад валидации (app/validation/cascade.py): LLM валидатор вызывается только
+# для запросов с P(domain) в [CASCADE_REJECT_BELOW, CASCADE_ACCEPT_ABOVE).
+# Пороги подбираются командой python -m app.validation.cascade calibrate
+CASCADE_ACCEPT_ABOVE = 0.98
+CASCADE_REJECT_BELOW = 0.0
@@ -0,0 +1,343 @@
+"""
+Словарь значений из базы: термины вопроса -> канонические значения колонок.
+
+Генератору мало попросить "исправлять опечатки и сленг": он угадывает значение
+("Мск", "Spb", "Джава"), фильтр ничего не находит, и пользователь переспрашивает.
+Здесь то же делается локально по реальным значениям снапшота:
+
+    python -m app.entity_resolution "вакансии джава в мск" "зарплаты в питере"
+
+Найденные значения уходят в сообщение генератору подсказкой (hints()).
+"""
+import argparse
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import duckdb
+
+from app.sql_validator import edit_distance
+from data.db import data_version
+
+# Колонки, значения которых попадают в словарь
+COLUMNS = [
+    ('Vacancies', 'city'),
+    ('DisplayLocation', 'city'),
+    ('Skills', 'skill'),
+    ('Vacancies', 'position'),
+    ('Vacancies', 'company_name'),
+    ('Vacancies', 'specialization'),
+]
+
+# Свободный текст: найденное значение — лишь один из вариантов названия должности или
+# компании, поэтому подсказка — шаблон ILIKE, а не точное равенство
+PATTERN_COLUMNS = {('Vacancies', 'position'), ('Vacancies', 'company_name')}
+
+# Сленг и сокращения -> нормализованное значение. Подсказка появляется, только если
+# такое значение действительно есть в базе, поэтому лишние записи ничего не ломают.
+ALIASES = {
+    'мск': 'москва',
+    'спб': 'санкт петербург',
+    'питер': 'санкт петербург',
+    'петербург': 'санкт петербург',
+    'екб': 'екатеринбург',
+    'екат': 'екатеринбург',
+    'нск': 'новосибирск',
+    'новосиб': 'новосибирск',
+    'нн': 'нижний новгород',
+    'джава': 'java',
+    'ява': 'java',
+    'питон': 'python',
+    'пайтон': 'python',
+    'голанг': 'go',
+    'golang': 'go',
+    'джаваскрипт': 'javascript',
+    'js': 'javascript',
+    'тайпскрипт': 'typescript',
+    'ts': 'typescript',
+    'котлин': 'kotlin',
+    'свифт': 'swift',
+    'раст': 'rust',
+    'пхп': 'php',
+    'плюсы': 'c++',
+    'сишарп': 'c#',
+    'шарп': 'c#',
+    'постгрес': 'postgresql',
+    'postgres': 'postgresql',
+    'кубер': 'kubernetes',
+    'k8s': 'kubernetes',
+    'докер': 'docker',
+    'кафка': 'kafka',
+    'реакт': 'react',
+    'вью': 'vue',
+    'ангуляр': 'angular',
+    'джанго': 'django',
+    'спринг': 'spring',
+    'эскуэль': 'sql',
+    'линукс': 'linux',
+    'гит': 'git',
+    'фронтенд': 'frontend',
+    'фронт': 'frontend',
+    'бэкенд': 'backend',
+    'бекенд': 'backend',
+    'бэк': 'backend',
+    'девопс': 'devops',
+    'тестировщик': 'qa',
+    'тестирование': 'qa',
+    'мобилка': 'mobile',
+}
+
+# Частые слова вопросов: сами по себе не бывают значением фильтра, а нечётко совпасть
+# с названием какой-нибудь компании или должности могут
+STOP_WORDS = {
+    'в', 'во', 'и', 'или', 'на', 'по', 'с', 'со', 'для', 'без', 'из', 'от', 'до', 'за', 'не', 'как',
+    'где', 'все', 'что', 'какие', 'какой', 'какая', 'сколько', 'топ', 'top', 'самые', 'больше', 'меньше',
+    'вакансия', 'вакансии', 'вакансий', 'вакансиям', 'зарплата', 'зарплаты', 'зарплат', 'зарплатой',
+    'средняя', 'средний', 'средние', 'медианная', 'медиана', 'количество', 'число', 'город', 'города',
+    'городам', 'городах', 'навык', 'навыки', 'навыков', 'навыкам', 'компания', 'компании', 'компаний',
+    'должность', 'должности', 'специализация', 'специализации', 'уровень', 'уровни', 'опыт', 'работа',
+    'удаленка', 'удаленно', 'график', 'графики', 'покажи', 'найди', 'сравни', 'динамика', 'месяц', 'год',
+}
+
+# Слова и названия вроде c++ / c# / 1с — тот же разбор, что у полнотекстового индекса (data/search.py)
+_TOKEN = re.compile(r"[a-zа-я0-9]+[+#]*")
+
+# Самое длинное значение-фраза, которое ищется в вопросе целиком
+MAX_SPAN = 4
+
+# Нечёткое совпадение — только для терминов от этой длины; короткие (мск, go) — точно или через ALIASES
+MIN_FUZZY_LEN = 4
+
+
+def _key(text: str) -> str:
+    """Нормализованная форма значения или фразы вопроса: нижний регистр, ё -> е, слова через пробел."""
+    return ' '.join(_TOKEN.findall(text.lower().replace('ё', 'е')))
+
+
+def _trigrams(key: str) -> List[str]:
+    padded = f" {key} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _max_edits(key: str) -> int:
+    return min(3, 1 + len(key) // 8)
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _filter(table: str, column: str, value: str) -> str:
+    if (table, column) in PATTERN_COLUMNS:
+        return f"{table}.{column} ILIKE {_quote('%' + value + '%')}"
+    return f"{table}.{column} = {_quote(value)}"
+
+
+class EntityResolver:
+    """
+    Словарь distinct-значений COLUMNS с точным, алиасным и нечётким поиском.
+
+    Ключ словаря — нормализованное значение (_key), для каждой колонки хранится
+    самое частое написание ("Python" и "python" в Skills -> одно значение).
+    Фразы вопроса длиной до MAX_SPAN слов ищутся от длинных к коротким:
+    сначала точное совпадение ключа или алиаса, затем нечёткое — кандидаты по
+    общим символьным 3-граммам (инвертированный индекс, как в SemanticSQLCache),
+    проверка расстоянием Дамерау-Левенштейна (1 правка до 8 символов, 2 до 16,
+    дальше 3), так что "москве", "казани", "pyhton" находят свои значения.
+    Постинги разбиты по длине ключа: кандидат длиннее или короче термина больше
+    чем на число правок не подходит, и такие списки не просматриваются вовсе.
+    """
+
+    def __init__(self, values: Dict[Tuple[str, str], List[Tuple[str, int]]], aliases: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            values: {(таблица, колонка): [(значение, число строк)]}
+            aliases: Алиас -> нормализованное значение (по умолчанию ALIASES)
+        """
+        # ключ -> {(таблица, колонка): (значение, число строк)}
+        self._entries: Dict[str, Dict[Tuple[str, str], Tuple[str, int]]] = {}
+        for column, rows in values.items():
+            for value, count in rows:
+                key = _key(value)
+                if not key or len(key.split()) > MAX_SPAN:
+                    continue
+                best = self._entries.setdefault(key, {}).get(column)
+                if best is None or count > best[1]:
+                    self._entries[key][column] = (value, count)
+
+        # алиасы, чьи значения есть в базе, ищутся так же, как сами значения
+        self._targets: Dict[str, str] = {key: key for key in self._entries}
+        for alias, target in (ALIASES if aliases is None else aliases).items():
+            alias, target = _key(alias), _key(target)
+            if target in self._entries and alias not in self._entries:
+                self._targets[alias] = target
+
+        self._keys = list(self._targets)
+        # (3-грамма, длина ключа) -> номера ключей
+        self._postings: Dict[Tuple[str, int], List[int]] = {}
+        for i, key in enumerate(self._keys):
+            if len(key) >= MIN_FUZZY_LEN - 1:
+                for gram in set(_trigrams(key)):
+                    self._postings.setdefault((gram, len(key)), []).append(i)
+
+        self._lock = threading.Lock()
+        self._stats = {"questions": 0, "resolved": 0, "alias": 0, "fuzzy": 0}
+
+    @classmethod
+    def from_db(cls, con, aliases: Optional[Dict[str, str]] = None) -> 'EntityResolver':
+        """Собирает словарь по distinct-значениям COLUMNS; отсутствующие в базе колонки пропускаются."""
+        existing = set(con.execute(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_catalog = current_database() AND table_schema = 'main'"
+        ).fetchall())
+        values = {}
+        for table, column in COLUMNS:
+            if (table, column) not in existing:
+                continue
+            values[(table, column)] = con.execute(
+                f'SELECT CAST("{column}" AS VARCHAR), COUNT(*) FROM "{table}" '
+                f'WHERE "{column}" IS NOT NULL GROUP BY 1'
+            ).fetchall()
+        return cls(values, aliases)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, term: str) -> Optional[Tuple[str, int]]:
+        """(ключ словаря, число правок) для термина или None; при равенстве правок — самое частое значение."""
+        key = _key(term)
+        if key in self._targets:
+            return self._targets[key], 0
+        if len(key) < MIN_FUZZY_LEN:
+            return None
+
+        max_edits = _max_edits(key)
+        grams = set(_trigrams(key))
+        # каждая правка портит не больше четырёх 3-грамм (перестановка соседних букв)
+        need = max(1, len(grams) - 4 * max_edits)
+        shared = Counter()
+        for length in range(len(key) - max_edits, len(key) + max_edits + 1):
+            for gram in grams:
+                shared.update(self._postings.get((gram, length), ()))
+
+        best = None
+        for i, common in shared.items():
+            if common < need:
+                continue
+            candidate = self._keys[i]
+            distance = edit_distance(key, candidate)
+            if distance > max_edits:
+                continue
+            target = self._targets[candidate]
+            rank = (distance, -self._frequency(target), target)
+            if best is None or rank < best[0]:
+                best = (rank, target, distance)
+        return (best[1], best[2]) if best else None
+
+    def resolve(self, question: str) -> List[Dict]:
+        """
+        Термины вопроса, найденные в словаре.
+
+        Returns:
+            [{"term", "value", "columns": [(таблица, колонка, значение)], "distance", "alias"}]
+            в порядке появления в вопросе
+        """
+        tokens = _TOKEN.findall(question.lower().replace('ё', 'е'))
+        used = [False] * len(tokens)
+        found = []
+        for span in range(min(MAX_SPAN, len(tokens)), 0, -1):
+            for start in range(len(tokens) - span + 1):
+                if any(used[start:start + span]):
+                    continue
+                words = tokens[start:start + span]
+                if words[0] in STOP_WORDS or words[-1] in STOP_WORDS:
+                    continue
+                if span == 1 and (len(words[0]) < 2 or words[0].isdigit()):
+                    continue
+                term = ' '.join(words)
+                match = self.lookup(term)
+                if match is None:
+                    continue
+                target, distance = match
+                columns = sorted((table, column, value) for (table, column), (value, _) in self._entries[target].items())
+                found.append({
+                    "start": start,
+                    "term": term,
+                    "value": columns[0][2],
+                    "columns": columns,
+                    "distance": distance,
+                    "alias": term != target and distance == 0,
+                })
+                used[start:start + span] = [True] * span
+
+        found.sort(key=lambda r: r.pop("start"))
+        with self._lock:
+            self._stats["questions"] += 1
+            self._stats["resolved"] += len(found)
+            self._stats["alias"] += sum(r["alias"] for r in found)
+            self._stats["fuzzy"] += sum(r["distance"] > 0 for r in found)
+        return found
+
+    def values(self, question: str) -> FrozenSet[str]:
+        """Канонические значения терминов вопроса — "мск" и "москве" дают одно и то же."""
+        return frozenset(r["value"] for r in self.resolve(question))
+
+    def hints(self, question: str) -> Optional[str]:
+        """Подсказка генератору SQL со значениями для терминов вопроса или None, если ничего не нашлось."""
+        lines = []
+        for r in self.resolve(question):
+            filters = ', '.join(_filter(table, column, value) for table, column, value in r["columns"])
+            lines.append(f'- "{r["term"]}": {filters}')
+        if not lines:
+            return None
+        return "Значения из базы для терминов вопроса (в фильтрах по ним используй именно эти условия):\n" + "\n".join(lines)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, values=len(self._entries), aliases=len(self._targets) - len(self._entries))
+
+    def _frequency(self, key: str) -> int:
+        return sum(count for _, count in self._entries[key].values())
+
+
+_resolver_lock = threading.Lock()
+_resolver: Optional[Tuple[Optional[str], EntityResolver]] = None
+
+
+def get_entity_resolver(con) -> EntityResolver:
+    """
+    Общий на процесс словарь, привязанный к data_version: после пересборки снапшота
+    или apply_delta он собирается заново при первом обращении.
+    """
+    global _resolver
+    try:
+        version = data_version(con)
+    except duckdb.Error:
+        # соединение без метаданных снапшота — словарь собирается один раз
+        version = None
+    with _resolver_lock:
+        if _resolver is None or _resolver[0] != version:
+            _resolver = (version, EntityResolver.from_db(con))
+        return _resolver[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Resolve question terms to database values")
+    parser.add_argument("questions", nargs="+")
+    parser.add_argument("--db", default="data/vacancies.snapshot.duckdb", help="DuckDB snapshot")
+    args = parser.parse_args()
+
+    con = duckdb.connect(args.db, read_only=True)
+    start = time.perf_counter()
+    resolver = EntityResolver.from_db(con)
+    print(f"dictionary: {len(resolver)} values, built in {(time.perf_counter() - start) * 1000:.0f} ms")
+    for question in args.questions:
+        start = time.perf_counter()
+        hints = resolver.hints(question)
+        print(f"\n{question}  ({(time.perf_counter() - start) * 1000:.2f} ms)\n{hints or '-'}")
+
+
+if __name__ == "__main__":
+    main()
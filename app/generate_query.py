@@ -1,24 +1,122 @@
+import hashlib
+import re
+import threading
+import time
+import duckdb
 import openai
-from typing import Optional, Tuple
+from functools import lru_cache
+from typing import Callable, FrozenSet, Optional, Tuple
 import yaml
-from app.config import API_KEY, FOLDER_ID, SQL_GEN_MODEL
+from app.client import client
+from app.config import (
+    ENTITY_HINTS,
+    QUERY_MAX_PLAN_ROWS,
+    QUERY_MAX_ROWS,
+    QUERY_TIMEOUT_SECONDS,
+    SQL_GEN_MODEL,
+    SQL_GEN_STREAM,
+)
 
+from app.entity_resolution import get_entity_resolver
 from app.generate_sql_prompts import Prompts
+from app.schema_selection import SchemaSelector, estimate_tokens
+from app.semantic_cache import SemanticSQLCache, get_semantic_cache
+from app.sql_cache import SQLCache, get_sql_cache
+from app.sql_validator import SQLValidator, WriteQueryError
 from data.db import execute_query
+from data.guard import QueryGuard, QueryGuardError
+
+
+# error_message generate_sql_with_retry, если генерацию отменили через cancel_event
+CANCELLED = "Генерация SQL отменена"
+
+# Ошибки DuckDB, означающие, что урезанной схемы не хватило
+_SCHEMA_ERROR = re.compile(
+    r"Referenced column|not found in FROM clause|Table with name .* does not exist|does not have a column",
+    re.IGNORECASE,
+)
+
+
+def _with_hints(user_query: str, hints: Optional[str]) -> str:
+    return f"{user_query}\n\n{hints}" if hints else user_query
+
+
+def _statement_end(sql: str) -> int:
+    """
+    Позиция первой ';' или ``` вне строк и комментариев, -1 если её (пока) нет.
+
+    Незакрытая строка или комментарий — тоже -1: в потоке их хвост ещё не пришёл.
+    """
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if c in "'\"":
+            j = sql.find(c, i + 1)
+            while j != -1 and sql.startswith(c, j + 1):
+                j = sql.find(c, j + 2)  # удвоенная кавычка внутри строки
+            if j == -1:
+                return -1
+            i = j + 1
+        elif sql.startswith("--", i):
+            j = sql.find("\n", i)
+            if j == -1:
+                return -1
+            i = j + 1
+        elif sql.startswith("/*", i):
+            j = sql.find("*/", i + 2)
+            if j == -1:
+                return -1
+            i = j + 2
+        elif c == ";" or sql.startswith("```", i):
+            return i
+        else:
+            i += 1
+    return -1
+
+
+def extract_sql(text: str) -> Tuple[str, bool]:
+    """
+    Достаёт SQL из ответа модели: убирает markdown ограждение и обрезает всё после
+    конца первого оператора (';' или закрывающее ```), в том числе пояснения модели.
+
+    Returns:
+        (sql, complete): complete=True, если конец оператора уже встретился, —
+        для потоковой генерации это сигнал, что остаток ответа можно не читать
+    """
+    body = text.lstrip()
+    if body.startswith("```sql"):
+        body = body[6:]
+    elif body.startswith("```"):
+        body = body[3:]
+
+    end = _statement_end(body)
+    if end == -1:
+        return body.strip(), False
+    return body[:end].strip(), True
 
 
 class TextToSQLGenerator:
     """Генератор SQL запросов из текстовых описаний с использованием LLM."""
     
-    def __init__(self, client: openai.OpenAI, schema_yaml_path: str, model: str = "gpt-4o"):
+    def __init__(
+        self,
+        client: openai.OpenAI,
+        schema_yaml_path: str,
+        model: str = "gpt-4o",
+        prune_schema: bool = True,
+        stream: bool = False
+    ):
         """
         Args:
             client: Авторизованный клиент OpenAI
             schema_yaml_path: Путь к YAML файлу со схемой БД
             model: Модель для использования (gpt-4o, gpt-4o-mini, o1-preview)
+            prune_schema: Отправлять в промпт только релевантные вопросу таблицы и колонки
+            stream: Читать ответ потоком и обрывать его сразу после конца SQL
         """
         self.client = client
         self.model = model
+        self.stream = stream
         
         # Загружаем схему из YAML
         with open(schema_yaml_path, 'r', encoding='utf-8') as f:
@@ -26,6 +124,18 @@ class TextToSQLGenerator:
         
         # Формируем системный промпт
         self.system_prompt = self._build_system_prompt()
+        # Хэш схемы и шаблона промпта — часть ключа кэша SQL
+        self.schema_hash = hashlib.sha256(self.system_prompt.encode('utf-8')).hexdigest()[:16]
+
+        self.selector = SchemaSelector(self.schema) if prune_schema else None
+        self.sql_validator = SQLValidator(self.schema)
+        self._full_prompt_tokens = estimate_tokens(self.system_prompt)
+        # Накопительная статистика экономии токенов промпта
+        self.prompt_stats = {"requests": 0, "full_tokens": 0, "sent_tokens": 0, "fallbacks": 0}
+        # Потоковая генерация: сколько ответов оборвано досрочно и суммарное время до готового SQL
+        self.stream_stats = {"requests": 0, "early_stops": 0, "time_to_sql_s": 0.0}
+        # генератор общий на процесс и вызывается из пула бота: счётчики обновляются под локом
+        self._stats_lock = threading.Lock()
     
     def _build_system_prompt(self) -> str:
         """Создает системный промпт с описанием схемы БД."""
@@ -33,25 +143,92 @@ class TextToSQLGenerator:
         
         return Prompts.init_system.format(schema_yaml=schema_yaml)
 
+    def _system_prompt_for(self, user_query: str, verbose: bool = False) -> str:
+        """Системный промпт только с релевантной вопросу частью схемы."""
+        if self.selector is None:
+            return self.system_prompt
+
+        schema_text = self.selector.render(self.selector.select(user_query))
+        prompt = Prompts.init_system.format(schema_yaml=schema_text)
+
+        tokens = estimate_tokens(prompt)
+        with self._stats_lock:
+            self.prompt_stats["requests"] += 1
+            self.prompt_stats["full_tokens"] += self._full_prompt_tokens
+            self.prompt_stats["sent_tokens"] += tokens
+        if verbose:
+            print(f"✂️ Схема урезана: ~{tokens} токенов вместо ~{self._full_prompt_tokens}")
+
+        return prompt
+
     def _create_error_feedback(self, sql_query: str, error_message: str, attempt: int) -> str:
         """Создает feedback сообщение для LLM с описанием ошибки."""
         return Prompts.feedback_loop.format(sql_query=sql_query, error_message=error_message, attempt=attempt)
 
 
     def _clean_sql_output(self, sql: str) -> str:
-        """Удаляет markdown форматирование из SQL."""
-        if sql.startswith("```sql"):
-            sql = sql[6:]
-        elif sql.startswith("```"):
-            sql = sql[3:]
-        
-        if sql.endswith("```"):
-            sql = sql[:-3]
-        
-        return sql.strip()
+        """Удаляет markdown форматирование и пояснения после SQL."""
+        return extract_sql(sql)[0]
+
+    def _complete(
+        self,
+        messages: list,
+        temperature: float,
+        max_tokens: int,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Optional[str]:
+        """
+        Запрос к модели, возвращает очищенный SQL (None, если отменено через cancel_event).
+
+        В потоковом режиме чанки накапливаются, пока extract_sql не увидит конец
+        оператора; после этого поток закрывается и модель не дописывает пояснения.
+        Результат совпадает с непотоковым режимом: оба проходят через extract_sql.
+        """
+        if not self.stream:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            return self._clean_sql_output(response.choices[0].message.content.strip())
+
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        parts = []
+        complete = False
+        try:
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                parts.append(chunk.choices[0].delta.content)
+                sql_query, complete = extract_sql("".join(parts))
+                if complete:
+                    break
+        finally:
+            stream.close()
+
+        if not complete:
+            sql_query = extract_sql("".join(parts))[0]
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.stream_stats["requests"] += 1
+            self.stream_stats["early_stops"] += int(complete)
+            self.stream_stats["time_to_sql_s"] += elapsed
+        return sql_query
     
 
-    def generate_sql(self, user_query: str, temperature: float = 0.1, max_tokens: int = 1000) -> str:
+    def generate_sql(
+        self, user_query: str, temperature: float = 0.1, max_tokens: int = 1000, hints: Optional[str] = None
+    ) -> str:
         """
         Генерирует SQL запрос на основе текстового описания.
         
@@ -59,26 +236,18 @@ class TextToSQLGenerator:
             user_query: Текстовый запрос пользователя
             temperature: Температура генерации (0.0-1.0). Низкая для детерминированности
             max_tokens: Максимальное количество токенов в ответе
+            hints: Значения из базы для терминов вопроса (app.entity_resolution)
             
         Returns:
             Строка с SQL запросом
         """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            
-            sql_query = response.choices[0].message.content.strip()
-            
-            sql_query = self._clean_sql_output(sql_query)
-            
-            return sql_query
+            user_message = _with_hints(user_query, hints)
+            messages = [
+                {"role": "system", "content": self._system_prompt_for(user_message)},
+                {"role": "user", "content": user_message}
+            ]
+            return self._complete(messages, temperature, max_tokens)
             
         except Exception as e:
             raise Exception(f"Ошибка при генерации SQL: {str(e)}")
@@ -90,15 +259,20 @@ class TextToSQLGenerator:
         max_retries: int = 3,
         temperature: float = 0.1,
         max_tokens: int = 1000,
-        verbose: bool = False
-    ) -> Tuple[Optional[str], Optional[str], int]:
+        verbose: bool = False,
+        cancel_event: Optional[threading.Event] = None,
+        guard: Optional[QueryGuard] = None,
+        feedback: Optional[Tuple[str, str]] = None,
+        hints: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
         """
         Генерирует SQL с автоматической коррекцией ошибок через feedback loop.
         
         Этот метод реализует Evaluator-Optimizer Pattern:
         1. Генерирует SQL запрос
-        2. Валидирует его через EXPLAIN в DuckDB
-        3. Если есть ошибка - передает ее обратно в LLM для исправления
+        2. Валидирует его локально (SQLValidator: запрет записи, автозамена
+           почти совпадающих имён таблиц и колонок) и через EXPLAIN в DuckDB
+        3. Если ошибку не удалось исправить локально - передает ее обратно в LLM
         4. Повторяет до max_retries раз
         
         Args:
@@ -108,20 +282,34 @@ class TextToSQLGenerator:
             temperature: Температура генерации
             max_tokens: Максимальное количество токенов
             verbose: Выводить логи процесса исправления
+            cancel_event: Если событие установлено, генерация прерывается перед
+                следующим обращением к API и результат не возвращается
+            guard: Защита выполнения; план запроса проверяется вместе с EXPLAIN,
+                и взрывной план уходит в LLM как ошибка валидации
+            feedback: (SQL, ошибка) предыдущей неудачной попытки выполнения —
+                генерация начинается сразу с просьбы исправить этот запрос
+            hints: Значения из базы для терминов вопроса (app.entity_resolution) —
+                дописываются к вопросу, чтобы модель не угадывала названия городов и навыков
             
         Returns:
-            Кортеж (sql_query, error_message, attempts_count):
+            Кортеж (sql_query, error_message):
             - sql_query: Финальный SQL запрос или None если не удалось
-            - error_message: Сообщение об ошибке или None если успех
-            - attempts_count: Количество затраченных попыток
+            - error_message: Сообщение об ошибке (CANCELLED при отмене) или None если успех
         """
-        # История диалога для контекста
+        # История диалога для контекста; по подсказкам отбираются и колонки схемы
+        user_message = _with_hints(user_query, hints)
         messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": user_query}
+            {"role": "system", "content": self._system_prompt_for(user_message, verbose=verbose)},
+            {"role": "user", "content": user_message}
         ]
+        if feedback is not None:
+            messages.append({"role": "assistant", "content": feedback[0]})
+            messages.append({"role": "user", "content": self._create_error_feedback(feedback[0], feedback[1], 0)})
         
         for attempt in range(1, max_retries + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                return None, CANCELLED
+
             try:
                 if verbose:
                     print(f"\n{'='*60}")
@@ -129,38 +317,46 @@ class TextToSQLGenerator:
                     print(f"{'='*60}")
                 
                 # Генерируем SQL через API
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
+                sql_query = self._complete(messages, temperature, max_tokens, cancel_event)
                 
-                sql_query = response.choices[0].message.content.strip()
-                sql_query = self._clean_sql_output(sql_query)
+                if sql_query is None or (cancel_event is not None and cancel_event.is_set()):
+                    return None, CANCELLED
                 
                 if verbose:
                     print(f"\nСгенерированный SQL:\n{sql_query}\n")
                 
+                # Запись в базу не чиним и не отправляем в LLM — сразу отказ
+                try:
+                    sql_query, error_message, repairs = self.sql_validator.validate(sql_query, duckdb_connection)
+                except WriteQueryError as e:
+                    if verbose:
+                        print(f"⛔ {e}")
+                    return None, str(e)
+
+                if verbose and repairs:
+                    print(f"🔧 Локально исправлены имена: {', '.join(repairs)}")
+
+                if error_message is None and guard is not None:
+                    try:
+                        guard.check_plan(duckdb_connection, sql_query)
+                    except QueryGuardError as e:
+                        error_message = str(e)
+
                 # Добавляем ответ LLM в историю
                 messages.append({
                     "role": "assistant",
                     "content": sql_query
                 })
                 
-                # Валидация через EXPLAIN
-                try:
-                    duckdb_connection.execute(f"EXPLAIN {sql_query}")
-                    
+                # Валидация через EXPLAIN (внутри sql_validator.validate)
+                if error_message is None:
                     if verbose:
                         print("✅ SQL валидация успешна!")
                     
                     # Успех! Возвращаем результат
                     return sql_query, None
                     
-                except Exception as db_error:
-                    error_message = str(db_error)
-                    
+                else:
                     if verbose:
                         print(f"❌ Ошибка валидации: {error_message}")
                     
@@ -170,6 +366,14 @@ class TextToSQLGenerator:
                             print(f"\n⚠️ Достигнут лимит попыток ({max_retries})")
                         return sql_query, f"SQL ошибка после {max_retries} попыток: {error_message}"
                     
+                    # Урезанной схемы не хватило — дальше работаем с полной
+                    if _SCHEMA_ERROR.search(error_message) and messages[0]["content"] != self.system_prompt:
+                        messages[0]["content"] = self.system_prompt
+                        with self._stats_lock:
+                            self.prompt_stats["fallbacks"] += 1
+                        if verbose:
+                            print("📚 Возвращаю полную схему в системный промпт")
+
                     # Формируем feedback для LLM
                     feedback_message = self._create_error_feedback( sql_query, error_message, attempt)
                     
@@ -189,33 +393,177 @@ class TextToSQLGenerator:
         # Этот код не должен выполниться, но на всякий случай
         return None, "Неожиданная ошибка в цикле retry"
 
-def text2df(
-    text_request: str,
-    db_con
-): 
+
+@lru_cache(maxsize=1)
+def get_generator() -> TextToSQLGenerator:
     """
-    Принимает текстовый пользовательский запрос и возвращает DataFrame с необходимыми данными.
-    
-    :param text_request - str: Свалидированный текстовый пользовательский запрос
-    :param db_con: Коннектор к DuckDB
+    Общий на процесс генератор: схема читается и системный промпт собирается один раз,
+    а запросы идут через общий пул соединений из app.client.
     """
+    return TextToSQLGenerator(
+        client=client,
+        schema_yaml_path='data/schema.yaml',
+        model=SQL_GEN_MODEL,
+        stream=SQL_GEN_STREAM
+    )
 
 
-    client = openai.OpenAI(
-        api_key=API_KEY,
-        base_url="https://llm.api.cloud.yandex.net/v1",
-        project=FOLDER_ID
+@lru_cache(maxsize=1)
+def get_query_guard() -> QueryGuard:
+    """Общая на процесс защита выполнения SQL с настройками из app.config."""
+    return QueryGuard(
+        timeout_seconds=QUERY_TIMEOUT_SECONDS,
+        max_rows=QUERY_MAX_ROWS,
+        max_plan_rows=QUERY_MAX_PLAN_ROWS,
     )
 
-    generator = TextToSQLGenerator(
-        client=client,
-        schema_yaml_path='data/schema.yaml',
-        model=SQL_GEN_MODEL
-    )
 
-    sql_query, error = generator.generate_sql_with_retry(text_request, db_con, verbose=True)
+def entity_hints(text_request: str, db_con, verbose: bool = False) -> Optional[str]:
+    """
+    Подсказка генератору: канонические значения городов, навыков, должностей,
+    компаний и специализаций для терминов вопроса ("мск" -> 'Москва').
+
+    Подсказки необязательны: без словаря (ENTITY_HINTS выключен, база без нужных
+    таблиц) генерация идёт по одному вопросу.
+    """
+    if not ENTITY_HINTS:
+        return None
+    try:
+        hints = get_entity_resolver(db_con).hints(text_request)
+    except duckdb.Error as e:
+        if verbose:
+            print(f"⚠️ Словарь значений недоступен: {e}")
+        return None
+    if verbose and hints:
+        print(f"🔎 {hints}")
+    return hints
+
+
+def question_entities(db_con) -> Optional[Callable[[str], FrozenSet[str]]]:
+    """
+    Вопрос -> значения из базы, по которым он фильтрует: перефраз из индекса похожих
+    вопросов подходит, только если они совпадают ("в москве" vs "java в москве").
+
+    Без словаря (база без нужных таблиц) сравниваются только числа и отрицания.
+    """
+    try:
+        return get_entity_resolver(db_con).values
+    except duckdb.Error:
+        return None
+
+
+def find_or_generate_sql(
+    text_request: str,
+    db_con,
+    generator: TextToSQLGenerator,
+    sql_cache: SQLCache,
+    semantic_cache: SemanticSQLCache,
+    cancel_event: Optional[threading.Event] = None,
+    verbose: bool = True
+) -> Tuple[str, str]:
+    """
+    SQL для вопроса: точный кэш, затем похожий вопрос, затем LLM.
+
+    Кэши не пополняются — это делает remember_sql, когда ответ точно уйдёт пользователю.
+
+    Returns:
+        (sql, source): source — "exact", "semantic" или "llm"
+    """
+    cache_key = sql_cache.make_key(text_request, generator.schema_hash, generator.model)
+    sql_query = sql_cache.get(cache_key)
+    if sql_query is not None:
+        return sql_query, "exact"
+
+    # перефразированный ранее отвеченный вопрос — переиспользуем его SQL без LLM
+    sql_query = semantic_cache.get(text_request, entities=question_entities(db_con))
+    if sql_query is not None:
+        return sql_query, "semantic"
+
+    sql_query, error = generator.generate_sql_with_retry(
+        text_request, db_con, verbose=verbose, cancel_event=cancel_event, guard=get_query_guard(),
+        hints=entity_hints(text_request, db_con, verbose=verbose)
+    )
     if error is not None:
         raise RuntimeError(error)
+    return sql_query, "llm"
+
+
+def remember_sql(
+    text_request: str,
+    sql_query: str,
+    source: str,
+    generator: TextToSQLGenerator,
+    sql_cache: SQLCache,
+    semantic_cache: SemanticSQLCache
+) -> None:
+    """Сохраняет найденный SQL в точный кэш, а сгенерированный LLM — ещё и в индекс похожих вопросов."""
+    if source == "exact":
+        return
+    if source == "llm":
+        semantic_cache.add(text_request, sql_query)
+    sql_cache.put(sql_cache.make_key(text_request, generator.schema_hash, generator.model), sql_query)
+
+
+def execute_with_feedback(
+    text_request: str,
+    sql_query: str,
+    source: str,
+    db_con,
+    generator: TextToSQLGenerator,
+    sql_cache: SQLCache,
+    semantic_cache: SemanticSQLCache,
+    guard: Optional[QueryGuard] = None
+):
+    """
+    Выполняет SQL под защитой guard и запоминает его в кэшах.
+
+    Если защита остановила запрос (таймаут, взрывной план), ошибка уходит в LLM
+    как feedback и выполняется исправленный запрос; в кэш попадает только тот SQL,
+    который выполнился.
+
+    Returns:
+        (df, sql): результат и фактически выполненный SQL
+    """
+    guard = guard or get_query_guard()
+    try:
+        df = execute_query(db_con, sql_query, guard=guard)
+    except QueryGuardError as e:
+        sql_query, error = generator.generate_sql_with_retry(
+            text_request, db_con, verbose=True, guard=guard, feedback=(sql_query, str(e)),
+            hints=entity_hints(text_request, db_con)
+        )
+        if error is not None:
+            raise RuntimeError(error)
+        source = "llm"
+        df = execute_query(db_con, sql_query, guard=guard)
+
+    remember_sql(text_request, sql_query, source, generator, sql_cache, semantic_cache)
+    return df, sql_query
+
+
+def text2df(
+    text_request: str,
+    db_con,
+    generator: Optional[TextToSQLGenerator] = None,
+    sql_cache: Optional[SQLCache] = None,
+    semantic_cache: Optional[SemanticSQLCache] = None
+): 
+    """
+    Принимает текстовый пользовательский запрос и возвращает DataFrame с необходимыми данными.
+    
+    :param text_request - str: Свалидированный текстовый пользовательский запрос
+    :param db_con: Коннектор к DuckDB
+    :param generator: Генератор SQL (по умолчанию общий get_generator(), в тестах можно подменить)
+    :param sql_cache: Кэш вопрос -> SQL (по умолчанию общий get_sql_cache())
+    :param semantic_cache: Индекс похожих вопросов (по умолчанию общий get_semantic_cache())
+    """
+    if generator is None:
+        generator = get_generator()
+    if sql_cache is None:
+        sql_cache = get_sql_cache()
+    if semantic_cache is None:
+        semantic_cache = get_semantic_cache()
 
-    df = execute_query(db_con, sql_query)
+    sql_query, source = find_or_generate_sql(text_request, db_con, generator, sql_cache, semantic_cache)
+    df, _ = execute_with_feedback(text_request, sql_query, source, db_con, generator, sql_cache, semantic_cache)
     return df
@@ -23,6 +23,16 @@ class Prompts:
 11. разговорный сленг в названиях вакансий, городов, должностей и тому подобное переведи в формальный читаемый вид при использовании фильтров
 12. язык текста переводи согласно схемы данных
 13. ошибки в словах самостоятельно исправляй 
+14. **Витрины**: если вопрос — только количество вакансий или средняя/медианная зарплата в разрезе города, уровня, специализации, компании или навыка без других фильтров, бери готовые значения из соответствующей таблицы rollup_by_* вместо GROUP BY по Vacancies
+15. **Поиск по тексту**: ключевые слова и навыки в position, description, stack_description и short_description ищи не через ILIKE, а через полнотекстовый индекс:
+   - фильтр (встречаются все слова): `WHERE vacancy_id IN (SELECT vacancy_id FROM match_vacancies('python django'))`
+   - "найди вакансии" с ранжированием: `FROM search_vacancies('python django') s JOIN Vacancies v USING (vacancy_id) ORDER BY s.score DESC LIMIT 20` (колонки vacancy_id, score, matched_terms, query_terms; BM25, достаточно любого слова)
+   - поиск не зависит от регистра и окончаний слов; слова пиши так, как они пишутся в тексте вакансий
+16. **Несколько навыков**: для вакансий с набором навыков (точные названия из Skills) вместо подзапроса к Skills на каждый навык используй индекс навыков:
+   - `WHERE vacancy_id IN (SELECT vacancy_id FROM vacancies_with_skills(['python', 'kafka']))` — все навыки; дополнительно `any_of := ['go', 'rust']` (хотя бы один) и `none_of := ['php']` (без них)
+   - "какие навыки чаще всего идут вместе с Go": `SELECT skill, vacancies_count FROM skill_cooccurrence('go') LIMIT 10`
+   - регистр и лишние пробелы в названиях навыков не важны; для поиска по части названия (ILIKE '%sql%') используй Skills
+17. **Значения из базы**: если после вопроса идёт блок "Значения из базы для терминов вопроса", термины из него уже сопоставлены с реальными значениями колонок (сленг, сокращения и опечатки исправлены) — фильтруй по ним именно так, как указано: точное сравнение (= или IN) для города, навыка и специализации, ILIKE с указанным шаблоном для должности и компании — вместо собственных догадок; термины вне блока обрабатывай по пунктам 11–13
 
 
 ## Исправление ошибок
@@ -76,7 +86,7 @@ SELECT
     AVG((salary_display_from + salary_display_to) / 2) AS avg_salary,
     COUNT(DISTINCT vacancy_id) AS uniq_vacanies
 FROM Vacancies
-WHERE vacancy_id IN (SELECT vacancy_id FROM moscow_vacancies)
+WHERE vacancy_id IN (SELECT vacancy_id FROM sql_vacancies)
 GROUP BY 
     position
 ORDER BY uniq_vacanies DESC
@@ -0,0 +1,164 @@
+"""
+Спекулятивный пайплайн: LLM валидация и генерация SQL запускаются одновременно.
+
+Сначала синхронно работают локальные жёсткие правила (pre_llm_validate: PII,
+prompt injection, токсичность) — отклонённый ими вопрос не уходит ни в один LLM.
+Дальше последовательно задержка ответа ~ валидация + генерация; здесь ~ max из двух.
+Если валидация отклоняет запрос, генерация отменяется (cancel_event проверяется
+перед каждым обращением к API и на каждом чанке потокового ответа), а её результат отбрасывается: кэши SQL
+пополняются и запрос к DuckDB выполняется только после принятия вопроса.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+from app.config import BOT_WORKERS
+from app.generate_query import (
+    TextToSQLGenerator,
+    execute_with_feedback,
+    find_or_generate_sql,
+    get_generator,
+)
+from app.semantic_cache import SemanticSQLCache, get_semantic_cache
+from app.sql_cache import SQLCache, get_sql_cache
+
+
+class SpeculativePipeline:
+    """Вопрос -> локальные правила -> (валидация || генерация SQL) -> DataFrame, со статистикой сэкономленного времени."""
+
+    def __init__(
+        self,
+        validate: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        pre_validate: Optional[Callable[[str], Dict[str, Any]]] = None,
+        generator: Optional[TextToSQLGenerator] = None,
+        sql_cache: Optional[SQLCache] = None,
+        semantic_cache: Optional[SemanticSQLCache] = None,
+        max_workers: int = 2 * BOT_WORKERS,
+    ):
+        """
+        Args:
+            validate: Результат pre_validate -> {"accepted", "text", "reason", ...}; идёт
+                параллельно с генерацией (по умолчанию app.validation.cascade.get_cascade().decide)
+            pre_validate: Локальная проверка вопроса до любых LLM
+                (по умолчанию app.validation.pre_llm_validator.pre_llm_validate)
+            generator, sql_cache, semantic_cache: как в text2df
+            max_workers: Потоки пула; на одно сообщение нужно два
+        """
+        if validate is None:
+            from app.validation.cascade import get_cascade
+            validate = get_cascade().decide
+        if pre_validate is None:
+            from app.validation.pre_llm_validator import pre_llm_validate
+            pre_validate = pre_llm_validate
+        self.validate = validate
+        self.pre_validate = pre_validate
+        self.generator = get_generator() if generator is None else generator
+        self.sql_cache = get_sql_cache() if sql_cache is None else sql_cache
+        self.semantic_cache = get_semantic_cache() if semantic_cache is None else semantic_cache
+
+        # отдельный пул: вызывающий код сам обычно крутится в пуле бота
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "accepted": 0, "rejected": 0, "cancelled_generations": 0, "saved_seconds": 0.0}
+
+    def run(self, text_request: str, db_con) -> Dict[str, Any]:
+        """
+        Returns:
+            {"accepted", "reason", "validation", "sql", "df", "timings"}; для
+            отклонённых запросов sql и df всегда None.
+        """
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+
+        pre = self._timed(timings, "pre_validation_s", self.pre_validate, text_request)
+        if not pre["accepted"]:
+            timings["wall_s"] = time.perf_counter() - start
+            self._count(accepted=False)
+            return {"accepted": False, "reason": pre["reason"], "validation": pre,
+                    "sql": None, "df": None, "timings": timings}
+
+        cancel = threading.Event()
+        # отдельный словарь: отменённая генерация может дописать время уже после ответа
+        gen_timings: Dict[str, float] = {}
+
+        # у потока генерации свой курсор: одно соединение DuckDB нельзя делить между потоками
+        cursor = db_con.cursor()
+        generation = self._executor.submit(self._timed, gen_timings, "generation_s", find_or_generate_sql,
+                                           text_request, cursor, self.generator, self.sql_cache,
+                                           self.semantic_cache, cancel, False)
+        validation = self._executor.submit(self._timed, timings, "validation_s", self.validate, pre)
+
+        try:
+            verdict = validation.result()
+        except BaseException:
+            self._cancel(cancel, generation, cursor)
+            raise
+
+        if not verdict["accepted"]:
+            self._cancel(cancel, generation, cursor)
+            timings["wall_s"] = time.perf_counter() - start
+            self._count(accepted=False)
+            return {"accepted": False, "reason": verdict["reason"], "validation": verdict,
+                    "sql": None, "df": None, "timings": timings}
+
+        try:
+            sql_query, source = generation.result()
+        finally:
+            cursor.close()
+        timings.update(gen_timings)
+
+        timings["speculative_wall_s"] = time.perf_counter() - start
+        # сэкономлено относительно последовательного "сначала валидация, потом генерация"
+        timings["saved_s"] = max(0.0, timings["validation_s"] + timings["generation_s"] - timings["speculative_wall_s"])
+
+        df, sql_query = execute_with_feedback(text_request, sql_query, source, db_con,
+                                   self.generator, self.sql_cache, self.semantic_cache)
+        timings["wall_s"] = time.perf_counter() - start
+        self._count(accepted=True, saved=timings["saved_s"])
+        return {"accepted": True, "reason": None, "validation": verdict,
+                "sql": sql_query, "df": df, "timings": timings}
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _timed(timings: Dict[str, float], name: str, fn: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    def _cancel(self, cancel: threading.Event, generation: Future, cursor) -> None:
+        cancel.set()
+        with self._lock:
+            self._stats["cancelled_generations"] += 1
+
+        def _discard(future: Future) -> None:
+            # результат (или ошибка) отменённой генерации никому не нужен
+            if not future.cancelled():
+                future.exception()
+            cursor.close()
+
+        if not generation.cancel():
+            generation.add_done_callback(_discard)
+        else:
+            cursor.close()
+
+    def _count(self, accepted: bool, saved: float = 0.0) -> None:
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["accepted" if accepted else "rejected"] += 1
+            self._stats["saved_seconds"] += saved
+
+
+@lru_cache(maxsize=1)
+def get_pipeline() -> SpeculativePipeline:
+    """Общий на процесс спекулятивный пайплайн."""
+    return SpeculativePipeline()
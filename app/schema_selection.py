@@ -0,0 +1,151 @@
+import re
+from typing import Any, Dict, List, Set
+
+from app.validation.preprocessing.preprocessing import _norm, _tokenize
+
+# Колонки, без которых не обходится почти ни один аналитический запрос
+CORE_COLUMNS = {
+    'Vacancies': [
+        'vacancy_id', 'published_at', 'is_active', 'position', 'position_level', 'specialization',
+        'city', 'country', 'company_name', 'salary_display_from', 'salary_display_to', 'salary_currency',
+    ],
+}
+
+# Служебные колонки, которые попадают в промпт только при явном упоминании
+NOISY_PREFIXES = ('og_', 'recruiter_', 'company_logotype', 'url', 'company_url', 'description_html', 'analytics_id')
+
+STEM_LEN = 5
+
+# Пометки о языке значений ("на английском") описывают формат, а не смысл колонки
+_LANGUAGE_NOTE = re.compile(r"на (английском|русском)( языке)?", re.IGNORECASE)
+
+
+def _words(text: str) -> List[str]:
+    words = []
+    for tok in _tokenize(_norm(text).replace('ё', 'е')):
+        words.extend(tok.split('_'))
+    return words
+
+
+def _stems(text: str) -> Set[str]:
+    """Грубый стемминг: префикс слова, чтобы "зарплаты" совпадали с "зарплата"."""
+    return {w[:STEM_LEN] for w in _words(_LANGUAGE_NOTE.sub(' ', text)) if len(w) >= 4}
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов: слова и знаки пунктуации."""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+class SchemaSelector:
+    """
+    Отбирает из data/schema.yaml только таблицы и колонки, относящиеся к вопросу.
+
+    Колонка релевантна, если основы слов вопроса пересекаются с её именем,
+    описанием или значениями enum. Основы, встречающиеся в описаниях многих
+    колонок ("вакансии", "id"), неинформативны и не учитываются. Ключи
+    соединения (vacancy_id) и базовые колонки Vacancies сохраняются всегда.
+
+    Витрины агрегатов (rollup_of) добавляются целиком, если вопрос упоминает их
+    измерение (первую колонку), в том числе частотной основой вроде "компании";
+    в подсчёт стоп-основ они не входят, иначе их одинаковые колонки-метрики
+    сделали бы "зарплату" неинформативной.
+    """
+
+    def __init__(self, schema: Dict[str, Any], max_df: int = 4, fallback_table: str = 'Skills'):
+        """
+        Args:
+            schema: Схема из data/schema.yaml
+            max_df: Основа, встречающаяся у большего числа колонок, считается стоп-словом
+            fallback_table: Таблица для латинских слов, не совпавших ни с одной колонкой
+                (обычно это названия технологий: python, kafka)
+        """
+        self.schema = schema
+        self.fallback_table = fallback_table
+
+        descriptors = {}
+        self._known_words = set()
+        self._rollup_stems = {}
+        for table in schema['tables']:
+            name = table['table']
+            if 'rollup_of' in table:
+                dimension, spec = next(iter(table['columns'].items()))
+                self._rollup_stems[name] = _stems(f"{dimension} {spec.get('description', '')}")
+                continue
+            key = table.get('primary_key') or table.get('foreign_key')
+            descriptors[(name, None)] = _stems(f"{name} {table.get('description', '')}")
+            for column, spec in table['columns'].items():
+                if column == key:
+                    continue
+                enum = ' '.join(str(v) for v in spec.get('enum', []))
+                descriptor = f"{column} {spec.get('description', '')} {enum}"
+                descriptors[(name, column)] = _stems(descriptor)
+                self._known_words.update(w[:STEM_LEN] for w in _words(descriptor))
+
+        df = {}
+        for stems in descriptors.values():
+            for stem in stems:
+                df[stem] = df.get(stem, 0) + 1
+        self.stop_stems = {stem for stem, cnt in df.items() if cnt > max_df}
+        self._descriptors = {k: v - self.stop_stems for k, v in descriptors.items()}
+
+    def select(self, question: str) -> Dict[str, Any]:
+        """Схема того же формата, что и исходная, но только с нужными таблицами и колонками."""
+        raw = _stems(question)
+        q = raw - self.stop_stems
+        unmatched_latin = any(
+            re.match(r"[a-z]", w) and w[:STEM_LEN] not in self._known_words for w in _words(question)
+        )
+
+        tables = []
+        for table in self.schema['tables']:
+            name = table['table']
+            if 'rollup_of' in table:
+                if raw & self._rollup_stems[name]:
+                    tables.append(table)
+                continue
+            if 'foreign_key' in table:
+                # дочерняя таблица нужна целиком (ключ соединения + значение) или не нужна вовсе
+                relevant = any(q & stems for (t, _), stems in self._descriptors.items() if t == name)
+                if not relevant and not (unmatched_latin and name == self.fallback_table):
+                    continue
+                tables.append(table)
+                continue
+
+            keep = set(CORE_COLUMNS.get(name, []))
+            keep.add(table['primary_key'])
+            for column in table['columns']:
+                if column in keep or not (q & self._descriptors[(name, column)]):
+                    continue
+                if column.startswith(NOISY_PREFIXES) and column not in question.lower():
+                    continue
+                keep.add(column)
+
+            selected = dict(table)
+            selected['columns'] = {c: spec for c, spec in table['columns'].items() if c in keep}
+            tables.append(selected)
+
+        return {**self.schema, 'tables': tables}
+
+    @staticmethod
+    def render(schema: Dict[str, Any]) -> str:
+        """Компактное текстовое представление схемы для системного промпта."""
+        lines: List[str] = []
+        for table in schema['tables']:
+            if 'primary_key' in table:
+                key = f"PK {table['primary_key']}"
+            elif 'rollup_of' in table:
+                key = f"ROLLUP of {table['rollup_of']}"
+            else:
+                key = f"FK {table['foreign_key']} -> {table['parent']}.vacancy_id"
+            lines.append(f"{table['table']} ({key}): {table.get('description', '').strip()}")
+            for column, spec in table['columns'].items():
+                line = f"  {column}: {spec.get('type', '')}"
+                if spec.get('nullable'):
+                    line += "?"
+                if spec.get('description'):
+                    line += f" — {spec['description']}"
+                if spec.get('enum'):
+                    line += " [" + " | ".join(str(v) for v in spec['enum']) + "]"
+                lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,388 @@
+import argparse
+import math
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD
+from app.validation.preprocessing.preprocessing import _norm, _tokenize
+
+# Предел памяти под кэш "слово -> номера признаков": словарь вопросов почти конечен, но опечатки — нет
+_MAX_TOKENS = 1 << 18
+
+# После add_many хотя бы с таким числом новых вопросов хвосты постингов переносятся в массивы сразу
+_FLUSH_BATCH = 1_000
+
+
+# Слова, переворачивающие фильтр: "в москве" и "не в москве" почти совпадают по n-граммам
+NEGATIONS = {'не', 'без', 'кроме', 'исключая', 'нет', 'ни', 'not', 'without', 'except', 'excluding'}
+
+
+def _signature(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Числа и отрицания вопроса: у перефраза они должны совпадать точно."""
+    # "топ-10" и "топ-5" тоже почти совпадают по n-граммам, но SQL у них разный
+    tokens = _tokenize(text)
+    return tuple(sorted(t for t in tokens if t.isdigit())), tuple(sorted(t for t in tokens if t in NEGATIONS))
+
+
+class SemanticSQLCache:
+    """
+    Индекс похожих вопросов: находит ранее отвеченный перефразированный вопрос и отдаёт его SQL.
+
+    Вопрос -> токены _tokenize(_norm(...)) -> символьные 3-граммы + целые слова,
+    захэшированные в dim признаков, sublinear TF и L2-нормировка. Поиск идёт по
+    инвертированному индексу (признак -> массивы слотов и весов), поэтому стоимость
+    зависит от длины постингов признаков запроса, а не от размера индекса.
+    Очень частые признаки (df > max_df) пропускаются на первом проходе,
+    а top-k кандидатов переоцениваются точным косинусом.
+
+    Близость n-грамм не различает "в москве" / "не в москве" / "java в москве",
+    поэтому кандидат должен совпадать с вопросом по числам и отрицаниям, а если
+    задан entities — ещё и по множеству значений фильтров (EntityResolver).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        capacity: int = 100_000,
+        dim: int = 1 << 18,
+        max_df: float = 0.05,
+        min_skip_len: int = 1000,
+        entities: Optional[Callable[[str], FrozenSet[str]]] = None,
+    ):
+        """
+        Args:
+            threshold: Минимальный косинус для переиспользования SQL
+            capacity: Максимальное число вопросов, лишние вытесняются по давности использования
+            dim: Размер пространства хэшированных признаков
+            max_df: Доля записей, начиная с которой признак считается стоп-признаком
+            min_skip_len: Постинги не длиннее этого не пропускаются при любом max_df
+            entities: Вопрос -> значения из базы, по которым он фильтрует (EntityResolver.values);
+                можно передать и в get()/lookup(), если словарь зависит от соединения
+        """
+        self.threshold = threshold
+        self.capacity = capacity
+        self.dim = dim
+        self.max_df = max_df
+        self.min_skip_len = min_skip_len
+        self.entities = entities
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors: List[Dict[int, float]] = []
+        self._sql: List[str] = []
+        self._questions: List[str] = []
+        self._signatures: List[Tuple[Tuple[str, ...], Tuple[str, ...]]] = []
+        self._last_used = np.zeros(0, dtype=np.float64)
+        self._by_question: Dict[str, int] = {}
+
+        self._token_features: Dict[str, Tuple[int, ...]] = {}
+        # постинг = массивы с запасом (слоты, веса, длина) + хвост новых записей в списках:
+        # вставка — append в список, а в массив хвост дописывается при первом чтении
+        self._post_lists: Dict[int, Tuple[List[int], List[float]]] = {}
+        self._post_arrays: Dict[int, List] = {}
+        self._dirty = set()
+        self._scores = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._by_question)
+
+    def vectorize(self, text: str) -> Dict[int, float]:
+        counts: Dict[int, int] = {}
+        for tok in _tokenize(_norm(text)):
+            ids = self._token_features.get(tok)
+            if ids is None:
+                ids = self._features(tok)
+            for idx in ids:
+                counts[idx] = counts.get(idx, 0) + 1
+
+        vec = {idx: (1.0 + math.log(cnt) if cnt > 1 else 1.0) for idx, cnt in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+        return {k: w / norm for k, w in vec.items()}
+
+    def _features(self, tok: str) -> Tuple[int, ...]:
+        """Номера признаков слова: само слово и его символьные 3-граммы."""
+        padded = f" {tok} "
+        feats = [f"w:{tok}"] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+        ids = tuple(zlib.crc32(feat.encode('utf-8')) & (self.dim - 1) for feat in feats)
+        if len(self._token_features) < _MAX_TOKENS:
+            self._token_features[tok] = ids
+        return ids
+
+    def add(self, question: str, sql: str) -> None:
+        self.add_many([(question, sql)])
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        """Пакетное добавление пар (вопрос, SQL); повторный вопрос обновляет SQL."""
+        with self._lock:
+            now = time.time()
+            added = 0
+            for question, sql in items:
+                key = _norm(question)
+                slot = self._by_question.get(key)
+                if slot is not None:
+                    self._sql[slot] = sql
+                    self._last_used[slot] = now
+                    continue
+                self._append(key, question, sql, now)
+                added += 1
+
+            if len(self) > self.capacity:
+                # вытесняем пачкой, чтобы уплотнение индекса не шло на каждой вставке
+                self._evict(max(len(self) - self.capacity, self.capacity // 10))
+            if added >= _FLUSH_BATCH:
+                # после пакетной загрузки хвосты переносятся в массивы сразу, а не первыми lookup
+                for feat in list(self._dirty):
+                    self._postings(feat)
+
+    def lookup(
+        self,
+        question: str,
+        k: int = 1,
+        entities: Optional[Callable[[str], FrozenSet[str]]] = None,
+    ) -> List[Tuple[float, str]]:
+        """
+        top-k похожих вопросов: [(косинус, SQL)] по убыванию косинуса.
+
+        Кандидаты с другими числами, отрицаниями или значениями фильтров отбрасываются.
+        Фильтр по threshold не применяется — для этого есть get().
+        """
+        q = self.vectorize(question)
+        q_signature = _signature(question)
+        entities = entities or self.entities
+        q_entities = None
+
+        with self._lock:
+            if not self._vectors or not q:
+                return []
+
+            # в маленьком индексе max_df отбросил бы все общие признаки, поэтому
+            # короткие постинги (до min_skip_len) используются всегда
+            max_len = max(self.min_skip_len, int(self.max_df * len(self)))
+            parts_slots, parts_scores = [], []
+            for feat, w in q.items():
+                post = self._postings(feat)
+                if post is None or len(post[0]) > max_len:
+                    continue
+                parts_slots.append(post[0])
+                parts_scores.append(w * post[1])
+            if not parts_slots:
+                return []
+
+            # плотный аккумулятор на весь индекс, но читаются и обнуляются только задетые слоты
+            dense = self._scores
+            for post_slots, post_scores in zip(parts_slots, parts_scores):
+                dense[post_slots] += post_scores
+            touched = np.concatenate(parts_slots)
+            scores = dense[touched]
+
+            # слот встречается в touched не больше len(parts_slots) раз, так что
+            # top-(want * len(parts_slots)) вхождений содержит want лучших слотов
+            want = max(k * 4, 8)
+            take = min(len(touched), want * len(parts_slots))
+            cand = np.unique(touched[np.argpartition(scores, -take)[-take:]])
+            if len(cand) > want:
+                cand = cand[np.argpartition(dense[cand], -want)[-want:]]
+            dense[touched] = 0.0
+
+            result = []
+            for slot in cand:
+                vec = self._vectors[slot]
+                if self._signatures[slot] != q_signature:
+                    continue
+                exact = sum(w * vec.get(feat, 0.0) for feat, w in q.items())
+                result.append((exact, int(slot)))
+            result.sort(reverse=True)
+
+            if entities is not None:
+                # словарь дороже косинуса — проверяем только лучших кандидатов
+                kept = []
+                for score, slot in result:
+                    if len(kept) == k:
+                        break
+                    if q_entities is None:
+                        q_entities = entities(question)
+                    if entities(self._questions[slot]) == q_entities:
+                        kept.append((score, slot))
+                result = kept
+            result = result[:k]
+
+            now = time.time()
+            for _, slot in result:
+                self._last_used[slot] = now
+            return [(score, self._sql[slot]) for score, slot in result]
+
+    def get(self, question: str, entities: Optional[Callable[[str], FrozenSet[str]]] = None) -> Optional[str]:
+        """SQL ближайшего вопроса, если его косинус не ниже threshold."""
+        found = self.lookup(question, k=1, entities=entities)
+        hit = bool(found) and found[0][0] >= self.threshold
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found[0][1] if hit else None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            size, hits, misses = len(self), self.hits, self.misses
+        total = hits + misses
+        return {
+            "size": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+    def _append(self, key: str, question: str, sql: str, now: float) -> None:
+        slot = len(self._vectors)
+        vec = self.vectorize(question)
+        self._vectors.append(vec)
+        self._sql.append(sql)
+        self._questions.append(question)
+        self._signatures.append(_signature(question))
+        self._by_question[key] = slot
+
+        if slot >= len(self._last_used):
+            grow = max(1024, len(self._last_used))
+            self._last_used = np.concatenate([self._last_used, np.zeros(grow)])
+            self._scores = np.zeros(len(self._last_used), dtype=np.float32)
+        self._last_used[slot] = now
+
+        self._index(slot, vec)
+
+    def _index(self, slot: int, vec: Dict[int, float]) -> None:
+        post_lists = self._post_lists
+        for feat, w in vec.items():
+            pending = post_lists.get(feat)
+            if pending is None:
+                pending = post_lists[feat] = ([], [])
+            pending[0].append(slot)
+            pending[1].append(w)
+        self._dirty.update(vec)
+
+    def _postings(self, feat: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        post = self._post_arrays.get(feat)
+        if feat in self._dirty:
+            slots, weights = self._post_lists[feat]
+            if post is None:
+                post = self._post_arrays[feat] = [np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32), 0]
+            n, m = post[2], len(slots)
+            if n + m > len(post[0]):
+                size = max(2 * len(post[0]), n + m, 8)
+                post[0] = np.concatenate([post[0][:n], np.empty(size - n, dtype=np.int32)])
+                post[1] = np.concatenate([post[1][:n], np.empty(size - n, dtype=np.float32)])
+            post[0][n:n + m] = slots
+            post[1][n:n + m] = weights
+            post[2] = n + m
+            slots.clear()
+            weights.clear()
+            self._dirty.discard(feat)
+        if post is None:
+            return None
+        return post[0][:post[2]], post[1][:post[2]]
+
+    def _evict(self, count: int) -> None:
+        # вытесняем давно не использованные и сразу уплотняем индекс,
+        # чтобы в постингах не оставалось мёртвых слотов
+        n = len(self._vectors)
+        order = np.argsort(self._last_used[:n], kind='stable')
+        keep = np.sort(order[count:])
+
+        items = [
+            (self._vectors[s], self._sql[s], self._questions[s], self._signatures[s], self._last_used[s]) for s in keep
+        ]
+        keys = {slot: key for key, slot in self._by_question.items()}
+
+        self._vectors, self._sql, self._questions, self._signatures = [], [], [], []
+        self._by_question = {}
+        self._post_lists, self._post_arrays, self._dirty = {}, {}, set()
+
+        for new_slot, (old_slot, (vec, sql, question, signature, last_used)) in enumerate(zip(keep, items)):
+            self._vectors.append(vec)
+            self._sql.append(sql)
+            self._questions.append(question)
+            self._signatures.append(signature)
+            self._by_question[keys[old_slot]] = new_slot
+            self._last_used[new_slot] = last_used
+            self._index(new_slot, vec)
+
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> SemanticSQLCache:
+    """
+    Общий на процесс индекс похожих вопросов.
+
+    Прогревается из персистентного кэша SQL (app.sql_cache), чтобы переживать рестарт.
+    """
+    from app.generate_query import get_generator
+    from app.sql_cache import get_sql_cache
+
+    cache = SemanticSQLCache(threshold=SEMANTIC_CACHE_THRESHOLD, capacity=SEMANTIC_CACHE_SIZE)
+    generator = get_generator()
+    prefix = f"{generator.model}|{generator.schema_hash}|"
+    cache.add_many(
+        (key[len(prefix):], sql) for key, sql in get_sql_cache().items() if key.startswith(prefix)
+    )
+    return cache
+
+
+# Словарь синтетических вопросов для бенчмарка: ~10^5 различных комбинаций
+_BENCH_METRICS = ['средняя зарплата', 'медианная зарплата', 'количество вакансий', 'доля удаленных вакансий',
+                  'топ компаний по числу вакансий', 'максимальная зарплата', 'динамика вакансий']
+_BENCH_FILTERS = ['junior', 'middle', 'senior', 'lead', 'без опыта', 'с релокацией', 'на полный день']
+
+
+def _bench_questions(n: int, seed: int = 0) -> List[str]:
+    rnd = random.Random(seed)
+    cities = ['москве', 'санкт петербурге', 'казани', 'новосибирске', 'екатеринбурге'] + [f'городе {i}' for i in range(200)]
+    skills = ['java', 'python', 'go', 'sql', 'docker', 'kafka', 'react', 'kotlin'] + [f'навык{i}' for i in range(500)]
+    seen = set()
+    while len(seen) < n:
+        parts = [rnd.choice(_BENCH_METRICS), rnd.choice(skills)]
+        if rnd.random() < 0.5:
+            parts.append(rnd.choice(_BENCH_FILTERS))
+        if rnd.random() < 0.7:
+            parts.append('в ' + rnd.choice(cities))
+        if rnd.random() < 0.2:
+            parts.append(f'за {rnd.randint(2, 24)} месяцев')
+        seen.add(' '.join(parts))
+    return sorted(seen)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SemanticSQLCache on synthetic questions")
+    parser.add_argument("--size", type=int, default=100_000, help="Questions in the index")
+    parser.add_argument("--queries", type=int, default=2000, help="Timed lookups")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    questions = _bench_questions(args.size + args.queries)
+    indexed, probes = questions[:args.size], questions[args.size:]
+    random.Random(1).shuffle(probes)
+
+    cache = SemanticSQLCache(capacity=args.size)
+    start = time.perf_counter()
+    cache.add_many((q, f"-- {q}") for q in indexed)
+    elapsed = time.perf_counter() - start
+    print(f"add_many: {len(cache)} questions in {elapsed:.1f} s ({elapsed / len(cache) * 1e6:.0f} us/question)")
+
+    for q in probes[:100]:
+        cache.lookup(q, k=args.k)
+    timings = []
+    for q in probes:
+        start = time.perf_counter()
+        cache.lookup(q, k=args.k)
+        timings.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    print(f"lookup top-{args.k}: mean {np.mean(timings):.3f} ms, p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from app.config import SQL_CACHE_PATH, SQL_CACHE_SIZE, SQL_CACHE_TTL_SECONDS
+from app.validation.preprocessing.preprocessing import _norm
+
+log = logging.getLogger(__name__)
+
+
+class SQLCache:
+    """
+    Кэш "нормализованный вопрос -> провалидированный SQL".
+
+    LRU с ограничением по числу записей и TTL. Если задан path, содержимое
+    переживает перезапуск: файл перезаписывается атомарно после каждого изменения.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = 1000, ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Args:
+            path: JSON файл для персистентности (None — только в памяти)
+            max_size: Максимальное число записей, лишние вытесняются по LRU
+            ttl_seconds: Время жизни записи с момента сохранения
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def make_key(question: str, schema_hash: str, model: str) -> str:
+        """Ключ: модель + хэш схемы + вопрос, нормализованный как в pre-LLM валидаторе."""
+        return f"{model}|{schema_hash}|{_norm(question)}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, sql: str) -> None:
+        with self._lock:
+            self._entries[key] = (sql, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def items(self) -> List[Tuple[str, str]]:
+        """Непросроченные пары (ключ, SQL) в порядке LRU."""
+        now = time.time()
+        with self._lock:
+            return [(k, sql) for k, (sql, ts) in self._entries.items() if now - ts <= self.ttl_seconds]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("SQL cache %s is unreadable, starting empty: %s", self.path, e)
+            return
+
+        now = time.time()
+        for key, sql, saved_at in items[-self.max_size:]:
+            if now - saved_at <= self.ttl_seconds:
+                self._entries[key] = (sql, saved_at)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # порядок списка = порядок LRU, чтобы после рестарта вытеснение шло так же
+            json.dump([[k, sql, ts] for k, (sql, ts) in self._entries.items()], f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+@lru_cache(maxsize=1)
+def get_sql_cache() -> SQLCache:
+    """Общий на процесс кэш SQL с настройками из app.config."""
+    return SQLCache(path=SQL_CACHE_PATH, max_size=SQL_CACHE_SIZE, ttl_seconds=SQL_CACHE_TTL_SECONDS)
@@ -0,0 +1,292 @@
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Лексемы SQL: строки, идентификаторы в кавычках, комментарии, слова, всё остальное
+_TOKEN = re.compile(
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)"
+    r"|(?P<other>.)",
+    re.DOTALL,
+)
+
+# С чего может начинаться запрос только на чтение
+READ_STATEMENTS = {'select', 'with', 'from', 'values', 'table', 'describe', 'show', 'summarize'}
+
+# Ключевые слова, меняющие данные, схему или состояние сессии
+WRITE_KEYWORDS = {
+    'insert', 'update', 'delete', 'merge', 'create', 'alter', 'drop', 'truncate', 'replace',
+    'copy', 'attach', 'detach', 'export', 'import', 'install', 'load', 'pragma', 'set', 'reset',
+    'call', 'checkpoint', 'vacuum', 'grant', 'revoke', 'use',
+}
+
+# После этих слов в FROM-списке идёт уже не имя таблицы
+_CLAUSE_END = {
+    'where', 'group', 'order', 'limit', 'having', 'qualify', 'window', 'union', 'intersect', 'except',
+    'on', 'using', 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'positional', 'asof',
+    'anti', 'semi', 'lateral', 'offset', 'sample', 'pivot', 'unpivot',
+}
+
+_MISSING_COLUMN = re.compile(
+    r'Referenced column "(?P<a>[^"]+)" not found|does not have a column named "(?P<b>[^"]+)"'
+)
+_MISSING_TABLE = re.compile(r'Table with name (?P<name>\S+) does not exist')
+_CANDIDATES = re.compile(r'Candidate bindings:[ :]*(?P<list>[^\n]*)')
+
+
+class WriteQueryError(ValueError):
+    """Запрос пытается менять данные или схему."""
+
+
+def _tokens(sql: str) -> List[Tuple[str, str]]:
+    return [(m.lastgroup, m.group()) for m in _TOKEN.finditer(sql)]
+
+
+def _ident(kind: str, text: str) -> Optional[str]:
+    """Имя идентификатора в нижнем регистре (без кавычек) или None для не-идентификаторов."""
+    if kind == 'word':
+        return text.lower()
+    if kind == 'quoted':
+        return text[1:-1].replace('""', '"').lower()
+    return None
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Расстояние Дамерау-Левенштейна (перестановка соседних букв — одна правка)."""
+    prev2, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if prev2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _significant(tokens: List[Tuple[str, str]]) -> List[int]:
+    return [i for i, (kind, _) in enumerate(tokens) if kind not in ('space', 'comment')]
+
+
+class SQLValidator:
+    """
+    Локальная проверка сгенерированного SQL до обращения к LLM за исправлением.
+
+    1. Запросы, меняющие данные или схему, отклоняются сразу (WriteQueryError).
+    2. Имена таблиц в FROM/JOIN сверяются со схемой и CTE; почти совпадающее
+       имя ("Vacancie", "skils") однозначно заменяется на ближайшее.
+    3. EXPLAIN в DuckDB; ошибки биндера про неизвестную колонку/таблицу
+       чинятся так же — по кандидатам из текста ошибки и колонкам схемы.
+
+    Чинится только однозначное: не больше max_edits правок (1 на каждые 4 символа
+    имени) и единственный ближайший кандидат. Всё остальное уходит в LLM как раньше.
+    """
+
+    def __init__(self, schema: Dict[str, Any], max_edits: int = 2, max_repairs: int = 5):
+        """
+        Args:
+            schema: Схема из data/schema.yaml
+            max_edits: Максимум правок (расстояние Дамерау-Левенштейна) для автозамены имени
+            max_repairs: Максимум автозамен на один запрос
+        """
+        self.max_edits = max_edits
+        self.max_repairs = max_repairs
+        self.tables = {t['table'].lower(): t['table'] for t in schema['tables']}
+        self.columns: Dict[str, Set[str]] = {
+            t['table'].lower(): set(t['columns']) for t in schema['tables']
+        }
+        # retries_saved — запросы, которые после локальных замен прошли EXPLAIN без обращения к LLM
+        self.stats = {"checked": 0, "writes_rejected": 0, "retries_saved": 0, "repairs": 0, "passed_to_llm": 0}
+
+    def check_read_only(self, sql: str) -> None:
+        """
+        WriteQueryError, если запрос не начинается с чтения или содержит команду записи.
+
+        Команда — первое слово каждого оператора (после начала или ';') и основной
+        оператор после списка CTE в WITH; те же слова в других местах (AS set,
+        t.load, replace(...)) — алиасы, колонки и функции.
+        """
+        tokens = _tokens(sql)
+        statements: List[List[Tuple[str, str]]] = [[]]
+        for i in _significant(tokens):
+            kind, text = tokens[i]
+            if kind == 'other' and text == ';':
+                statements.append([])
+            elif text == '(' and not statements[-1]:
+                # (SELECT 1) UNION ALL (SELECT 2): оператор определяет первое слово после скобок
+                continue
+            elif kind == 'word' or text in '(),':
+                statements[-1].append((kind, text.lower()))
+        statements = [st for st in statements if st]
+
+        if not statements or statements[0][0][0] != 'word' or statements[0][0][1] not in READ_STATEMENTS:
+            first = statements[0][0][1] if statements else 'пустой запрос'
+            raise WriteQueryError(f"Разрешены только запросы на чтение (SELECT/WITH), получено: {first}")
+
+        for st in statements:
+            for command in self._commands(st):
+                if command in WRITE_KEYWORDS or command not in READ_STATEMENTS:
+                    raise WriteQueryError(f"Запрос изменяет данные или схему: {command.upper()}")
+
+    @staticmethod
+    def _commands(statement: List[Tuple[str, str]]) -> List[str]:
+        """Первое слово оператора и, для WITH, слово после списка CTE: name [(cols)] AS (...), ..."""
+        commands = [statement[0][1]]
+        if commands[0] != 'with':
+            return commands
+        depth = 0
+        for pos, (kind, text) in enumerate(statement):
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+                if depth == 0 and pos + 1 < len(statement):
+                    nxt_kind, nxt = statement[pos + 1]
+                    if nxt_kind == 'word' and nxt != 'as':
+                        commands.append(nxt)
+                        break
+        return commands
+
+    def validate(self, sql: str, con) -> Tuple[str, Optional[str], List[str]]:
+        """
+        Проверяет и по возможности чинит SQL.
+
+        Args:
+            sql: Сгенерированный запрос
+            con: Соединение DuckDB для EXPLAIN
+
+        Returns:
+            (sql, error, repairs): исправленный SQL, текст ошибки EXPLAIN (None если
+            запрос валиден) и список сделанных замен вида "old -> new"
+
+        Raises:
+            WriteQueryError: запрос меняет данные или схему
+        """
+        self.stats["checked"] += 1
+        try:
+            self.check_read_only(sql)
+        except WriteQueryError:
+            self.stats["writes_rejected"] += 1
+            raise
+
+        repairs: List[str] = []
+        sql = self._repair_tables(sql, repairs)
+
+        error = None
+        while True:
+            try:
+                con.execute(f"EXPLAIN {sql}")
+                error = None
+                break
+            except Exception as e:
+                error = str(e)
+            if len(repairs) >= self.max_repairs:
+                break
+            fixed = self._repair_from_error(sql, error, repairs)
+            if fixed is None:
+                break
+            sql = fixed
+
+        if repairs:
+            self.stats["repairs"] += len(repairs)
+            if error is None:
+                self.stats["retries_saved"] += 1
+        if error is not None:
+            self.stats["passed_to_llm"] += 1
+        return sql, error, repairs
+
+    def _closest(self, name: str, candidates: Set[str]) -> Optional[str]:
+        name = name.lower()
+        # "moscow_vacancies" -> "Vacancies" — уже не опечатка, а другое имя
+        limit = min(self.max_edits, max(1, len(name) // 4))
+        scored = sorted((edit_distance(name, c.lower()), c) for c in candidates)
+        if not scored or scored[0][0] > limit:
+            return None
+        if len(scored) > 1 and scored[1][0] == scored[0][0] and scored[1][1].lower() != scored[0][1].lower():
+            return None
+        return scored[0][1]
+
+    def _cte_names(self, tokens: List[Tuple[str, str]], sig: List[int]) -> Set[str]:
+        # name AS ( ... ) — определение CTE
+        names = set()
+        for a, b, c in zip(sig, sig[1:], sig[2:]):
+            name = _ident(*tokens[a])
+            if name and tokens[b][1].lower() == 'as' and tokens[c][1] == '(':
+                names.add(name)
+        return names
+
+    def _table_refs(self, tokens: List[Tuple[str, str]], sig: List[int]) -> List[int]:
+        """Индексы лексем с именами таблиц в FROM/JOIN (без подзапросов и табличных функций)."""
+        refs = []
+        expect = False
+        after_table = False
+        for pos, i in enumerate(sig):
+            kind, text = tokens[i]
+            low = text.lower()
+            if kind == 'word' and low in ('from', 'join'):
+                expect, after_table = True, False
+                continue
+            if expect:
+                expect = False
+                nxt = sig[pos + 1] if pos + 1 < len(sig) else None
+                if _ident(kind, text) and low not in _CLAUSE_END and not (nxt is not None and tokens[nxt][1] in ('(', '.')):
+                    refs.append(i)
+                    after_table = True
+                continue
+            if after_table:
+                if text == ',':
+                    expect = True
+                elif text in (')', ';') or (kind == 'word' and low in _CLAUSE_END | {'select'}):
+                    after_table = False
+        return refs
+
+    def _repair_tables(self, sql: str, repairs: List[str]) -> str:
+        tokens = _tokens(sql)
+        sig = _significant(tokens)
+        ctes = self._cte_names(tokens, sig)
+        known = set(self.tables) | ctes
+
+        changed = False
+        for i in self._table_refs(tokens, sig):
+            name = _ident(*tokens[i])
+            if name in known:
+                continue
+            best = self._closest(name, set(self.tables.values()) | ctes)
+            if best is None:
+                continue
+            repairs.append(f"{tokens[i][1]} -> {best}")
+            tokens[i] = ('word', best)
+            changed = True
+        return ''.join(text for _, text in tokens) if changed else sql
+
+    def _repair_from_error(self, sql: str, error: str, repairs: List[str]) -> Optional[str]:
+        """Исправленный SQL по ошибке биндера/каталога или None, если однозначной замены нет."""
+        tokens = _tokens(sql)
+        sig = _significant(tokens)
+
+        m = _MISSING_COLUMN.search(error)
+        if m:
+            missing = m.group('a') or m.group('b')
+            candidates = set(re.findall(r'"(?:[^".]+\.)?([^"]+)"', _CANDIDATES.search(error).group('list'))) \
+                if _CANDIDATES.search(error) else set()
+            for i in self._table_refs(tokens, sig):
+                candidates |= self.columns.get(_ident(*tokens[i]), set())
+        else:
+            m = _MISSING_TABLE.search(error)
+            if not m:
+                return None
+            missing = m.group('name').strip('"')
+            candidates = set(self.tables.values()) | self._cte_names(tokens, sig)
+
+        best = self._closest(missing, candidates)
+        if best is None or best.lower() == missing.lower():
+            return None
+
+        target = missing.lower()
+        for i, (kind, text) in enumerate(tokens):
+            if _ident(kind, text) == target:
+                tokens[i] = ('word', best)
+        repairs.append(f"{missing} -> {best}")
+        return ''.join(text for _, text in tokens)
@@ -1,5 +1,11 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
 from telegram import Update
+from telegram.constants import ChatAction
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     MessageHandler,
     CommandHandler,
@@ -7,8 +13,12 @@ from telegram.ext import (
     filters,
 )
 
+from app.config import BOT_WORKERS
 from app.handler import handle_message
 
+# Telegram гасит статус "печатает…" через ~5 секунд, поэтому обновляем его чаще
+TYPING_REFRESH_SECONDS = 4
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -26,18 +36,45 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def _keep_typing(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    while True:
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+        await asyncio.sleep(TYPING_REFRESH_SECONDS)
+
+
 async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text
 
-    answer = handle_message(user_text)
+    # Пайплайн синхронный и блокирующий (LLM, DuckDB, графики) — уводим его в пул,
+    # чтобы event loop продолжал обслуживать остальные чаты
+    typing = asyncio.create_task(_keep_typing(update, context))
+    try:
+        loop = asyncio.get_running_loop()
+        answer = await loop.run_in_executor(context.bot_data["executor"], handle_message, user_text)
+    finally:
+        typing.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await typing
 
     if answer["type"] == "image":
         with open(answer["image_path"], "rb") as photo:
             await update.message.reply_photo(photo=photo)
 
 
-def run_bot(token: str):
-    app = ApplicationBuilder().token(token).build()
+async def _shutdown_executor(app: Application):
+    app.bot_data["executor"].shutdown(wait=False, cancel_futures=True)
+
+
+def run_bot(token: str, workers: int = BOT_WORKERS):
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        # без этого PTB обрабатывает апдейты строго по одному
+        .concurrent_updates(True)
+        .post_shutdown(_shutdown_executor)
+        .build()
+    )
+    app.bot_data["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-worker")
 
     app.add_handler(CommandHandler("start", start))
 
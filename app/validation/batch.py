@@ -0,0 +1,169 @@
+"""
+Пакетный прогон pre-LLM валидатора по логу вопросов (JSONL).
+
+Пишет решения (accept/reject + причина) в JSONL в порядке входа и печатает
+пропускную способность и p50/p99 задержки одного запроса. Модель берётся из
+артефакта, пороги фиксируются флагами, поэтому повторный прогон на том же
+файле даёт те же решения; --max-p99-ms / --min-qps превращают прогон в гейт.
+
+    python -m app.validation.batch requests.jsonl --field body --out decisions.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .pre_llm_validator import get_nb_model, pre_llm_validate
+
+
+def iter_questions(path: str, field: str) -> Iterator[Tuple[int, Any, str]]:
+    """(номер строки, id записи, вопрос); пустые строки пропускаются."""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                yield lineno, None, record
+            else:
+                yield lineno, record.get("id", record.get("request_id")), str(record.get(field) or "")
+
+
+def _chunks(items: Iterator, size: int) -> Iterator[List]:
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_chunk(
+    chunk: List[Tuple[int, Any, str]],
+    decline_unsafe: float,
+    decline_out_of_domain: float,
+) -> List[Dict[str, Any]]:
+    """Валидирует пачку вопросов, у каждого решения — собственная задержка в мс."""
+    out = []
+    for lineno, record_id, question in chunk:
+        start = time.perf_counter()
+        verdict = pre_llm_validate(
+            question, decline_unsafe=decline_unsafe, decline_out_of_domain=decline_out_of_domain
+        )
+        latency_ms = (time.perf_counter() - start) * 1000
+        out.append({
+            "line": lineno,
+            "id": record_id,
+            "accepted": verdict["accepted"],
+            "reason": verdict["reason"],
+            "latency_ms": round(latency_ms, 4),
+        })
+    return out
+
+
+def run_batch(
+    path: str,
+    field: str = "text",
+    out_path: Optional[str] = None,
+    workers: int = 1,
+    chunk_size: int = 256,
+    decline_unsafe: float = 0.85,
+    decline_out_of_domain: float = 0.92,
+) -> Dict[str, Any]:
+    """
+    Прогоняет файл через валидатор и возвращает сводку.
+
+    При workers > 1 пачки обрабатываются в процессах; executor.map сохраняет
+    порядок, так что файл решений не зависит от числа воркеров.
+    """
+    get_nb_model()  # загрузка модели не должна попадать в задержку первого запроса
+
+    chunks = _chunks(iter_questions(path, field), chunk_size)
+    args = (decline_unsafe, decline_out_of_domain)
+
+    latencies: List[float] = []
+    accepted = 0
+    reasons: Dict[str, int] = {}
+    out = open(out_path, "w", encoding="utf-8") if out_path else None
+
+    start = time.perf_counter()
+    try:
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(validate_chunk, chunks, *[repeat(a) for a in args])
+        else:
+            executor = None
+            results = (validate_chunk(chunk, *args) for chunk in chunks)
+
+        for decisions in results:
+            for d in decisions:
+                latencies.append(d["latency_ms"])
+                if d["accepted"]:
+                    accepted += 1
+                else:
+                    kind = d["reason"].split("(")[0]
+                    reasons[kind] = reasons.get(kind, 0) + 1
+                if out:
+                    out.write(json.dumps(d, ensure_ascii=False) + "\n")
+        if executor:
+            executor.shutdown()
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - start
+
+    lat = np.asarray(latencies) if latencies else np.zeros(1)
+    return {
+        "total": len(latencies),
+        "accepted": accepted,
+        "rejected": len(latencies) - accepted,
+        "reasons": dict(sorted(reasons.items(), key=lambda kv: -kv[1])),
+        "elapsed_s": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a JSONL question log through pre_llm_validate")
+    parser.add_argument("path", help="JSONL: one object per line (or a bare JSON string)")
+    parser.add_argument("--field", default="text", help="field holding the question")
+    parser.add_argument("--out", default=None, help="write decisions JSONL here")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--decline-unsafe", type=float, default=0.85)
+    parser.add_argument("--decline-out-of-domain", type=float, default=0.92)
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="fail if p99 latency is above")
+    parser.add_argument("--min-qps", type=float, default=None, help="fail if throughput is below")
+    args = parser.parse_args()
+
+    summary = run_batch(
+        args.path,
+        field=args.field,
+        out_path=args.out,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        decline_unsafe=args.decline_unsafe,
+        decline_out_of_domain=args.decline_out_of_domain,
+    )
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    failed = []
+    if args.max_p99_ms is not None and summary["p99_ms"] > args.max_p99_ms:
+        failed.append(f"p99 {summary['p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.min_qps is not None and summary["qps"] < args.min_qps:
+        failed.append(f"qps {summary['qps']} < {args.min_qps}")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Каскад валидации: NB классификатор -> LLM валидатор только для неуверенных запросов.
+
+После pre-LLM слоя смотрим на P(domain):
+  - >= accept_above  — принимаем без LLM;
+  - <  reject_below  — отклоняем без LLM (по умолчанию 0, т.е. никогда);
+  - между ними       — решает llm_validate.
+
+Пороги подбираются по размеченному JSONL:
+    python -m app.validation.cascade calibrate labeled.jsonl --target-llm-rate 0.2
+"""
+import argparse
+import json
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import CASCADE_ACCEPT_ABOVE, CASCADE_REJECT_BELOW
+from .pre_llm_validator import pre_llm_validate
+
+
+class CascadeValidator:
+    """Политика каскада и счётчики сэкономленных вызовов LLM валидатора (потокобезопасно)."""
+
+    def __init__(
+        self,
+        accept_above: float = 0.98,
+        reject_below: float = 0.0,
+        llm_validate: Optional[Callable[[str], dict]] = None,
+    ):
+        """
+        Args:
+            accept_above: P(domain), начиная с которой LLM валидатор не вызывается
+            reject_below: P(domain), ниже которой запрос отклоняется без LLM
+            llm_validate: LLM валидатор (по умолчанию app.validation.llm_validator.llm_validate)
+        """
+        if reject_below > accept_above:
+            raise ValueError(f"reject_below {reject_below} > accept_above {accept_above}")
+        self.accept_above = accept_above
+        self.reject_below = reject_below
+        self._llm_validate = llm_validate
+
+        self._lock = threading.Lock()
+        self._counters = {"total": 0, "pre_rejected": 0, "auto_accepted": 0, "auto_rejected": 0, "llm_calls": 0}
+
+    def validate(self, query: str) -> Dict[str, Any]:
+        """Результат того же формата, что pre_llm_validate; layer — слой, принявший решение."""
+        return self.decide(pre_llm_validate(query))
+
+    def decide(self, pre: Dict[str, Any]) -> Dict[str, Any]:
+        """Решение каскада по уже готовому результату pre_llm_validate (см. app.pipeline)."""
+        if not pre["accepted"]:
+            self._count("pre_rejected")
+            return pre
+
+        p_domain = pre["proba"]["domain"]
+        if p_domain >= self.accept_above:
+            self._count("auto_accepted")
+            return {**pre, "layer": "cascade"}
+        if p_domain < self.reject_below:
+            self._count("auto_rejected")
+            return {**pre, "accepted": False, "reason": f"declined_cascade:low_domain(p={p_domain:.2f})", "layer": "cascade"}
+
+        self._count("llm_calls")
+        verdict = self._llm(pre["text"])
+        accepted = bool(verdict.get("is_relevant"))
+        return {
+            **pre,
+            "accepted": accepted,
+            "reason": None if accepted else f"declined_llm:{verdict.get('reason', '')}",
+            "layer": "llm",
+        }
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            c = dict(self._counters)
+        passed = c["total"] - c["pre_rejected"]
+        saved = c["auto_accepted"] + c["auto_rejected"]
+        c["llm_saved"] = saved
+        c["llm_saved_rate"] = saved / passed if passed else 0.0
+        return c
+
+    def _llm(self, text: str) -> dict:
+        if self._llm_validate is None:
+            from .llm_validator import llm_validate
+            self._llm_validate = llm_validate
+        return self._llm_validate(text)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters["total"] += 1
+            self._counters[name] += 1
+
+
+@lru_cache(maxsize=1)
+def get_cascade() -> CascadeValidator:
+    """Общий на процесс каскад с порогами из app.config."""
+    return CascadeValidator(accept_above=CASCADE_ACCEPT_ABOVE, reject_below=CASCADE_REJECT_BELOW)
+
+
+# -------------------------
+# калибровка
+# -------------------------
+
+def _is_relevant(label: Any) -> bool:
+    if isinstance(label, str):
+        return label.strip().lower() in ("domain", "true", "1", "relevant")
+    return bool(label)
+
+
+def load_labeled(path: str, field: str = "text", label_field: str = "label") -> List[Tuple[str, bool]]:
+    """JSONL с вопросом и меткой: bool / 0-1 / "domain"|"out_of_domain"|"unsafe"."""
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                out.append((str(record[field]), _is_relevant(record[label_field])))
+    return out
+
+
+def calibrate(
+    samples: List[Tuple[str, bool]],
+    target_llm_rate: float,
+    max_false_accept: Optional[float] = None,
+    max_false_reject: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Подбирает пороги так, чтобы до LLM доходила доля target_llm_rate запросов,
+    прошедших pre-LLM слой.
+
+    accept_above — квантиль P(domain): всё, что выше, принимается без LLM. Если
+    задан max_false_accept, порог поднимается, пока доля нерелевантных среди
+    принятых без LLM не станет не больше него (ограничение важнее цели по доле).
+    reject_below ставится только при max_false_reject > 0: наибольший порог, ниже
+    которого доля релевантных не превышает max_false_reject.
+    """
+    probs, labels = [], []
+    for text, relevant in samples:
+        pre = pre_llm_validate(text)
+        if pre["accepted"]:
+            probs.append(pre["proba"]["domain"])
+            labels.append(relevant)
+    if not probs:
+        raise ValueError("no labeled samples pass the pre-LLM layer")
+
+    order = np.argsort(probs, kind="stable")
+    p = np.asarray(probs)[order]
+    y = np.asarray(labels, dtype=bool)[order]
+    n = len(p)
+
+    # accept_above = p[i]: без LLM принимаются p[i:]
+    i = min(n, int(np.ceil(target_llm_rate * n)))
+    if max_false_accept is not None:
+        bad_tail = np.cumsum((~y)[::-1])[::-1]  # нерелевантных в p[i:]
+        while i < n and bad_tail[i] / (n - i) > max_false_accept:
+            i += 1
+    while 0 < i < n and p[i - 1] == p[i]:
+        i += 1  # порог не должен разрезать одинаковые вероятности
+    accept_above = float(p[i]) if i < n else float(np.nextafter(1.0, 2.0))
+
+    j = 0
+    if max_false_reject > 0:
+        good_head = np.cumsum(y)  # релевантных в p[:j+1]
+        while j < i and good_head[j] / (j + 1) <= max_false_reject:
+            j += 1
+        while j > 0 and p[j - 1] == p[j]:
+            j -= 1
+    reject_below = float(p[j]) if 0 < j < n else 0.0
+
+    skipped, rejected = y[i:], y[:j]
+    return {
+        "samples": len(samples),
+        "passed_pre_llm": n,
+        "accept_above": accept_above,
+        "reject_below": reject_below,
+        "llm_rate": (i - j) / n,
+        "false_accept_rate": float((~skipped).mean()) if len(skipped) else 0.0,
+        "false_reject_rate": float(rejected.mean()) if len(rejected) else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Validation cascade tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    cal = sub.add_parser("calibrate", help="pick cascade thresholds from labeled JSONL")
+    cal.add_argument("path")
+    cal.add_argument("--field", default="text")
+    cal.add_argument("--label-field", default="label")
+    cal.add_argument("--target-llm-rate", type=float, required=True, help="share of pre-LLM-accepted queries sent to the LLM")
+    cal.add_argument("--max-false-accept", type=float, default=None)
+    cal.add_argument("--max-false-reject", type=float, default=0.0)
+    args = parser.parse_args()
+
+    result = calibrate(
+        load_labeled(args.path, args.field, args.label_field),
+        target_llm_rate=args.target_llm_rate,
+        max_false_accept=args.max_false_accept,
+        max_false_reject=args.max_false_reject,
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"\n# app/config.py\nCASCADE_ACCEPT_ABOVE = {result['accept_above']!r}\nCASCADE_REJECT_BELOW = {result['reject_below']!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,28 @@
 # app/validation/pre_llm_validator.py
 
+from functools import lru_cache
 from typing import Dict, Any
 
-from .preprocessing.preprocessing import build_synthetic_model, validate_query_v2
+from .preprocessing.artifact import load_or_train
+from .preprocessing.preprocessing import validate_query_with_proba
 
-_NB_MODEL = build_synthetic_model()
 
+@lru_cache(maxsize=1)
+def get_nb_model() -> Dict[str, Any]:
+    # модель грузится при первом запросе, а не при импорте пакета
+    return load_or_train()
 
-def pre_llm_validate(query: str) -> Dict[str, Any]:
-    text, accepted, reason = validate_query_v2(
+
+def pre_llm_validate(
+    query: str,
+    decline_unsafe: float = 0.85,
+    decline_out_of_domain: float = 0.92,
+) -> Dict[str, Any]:
+    text, accepted, reason, proba = validate_query_with_proba(
         query=query,
-        model=_NB_MODEL,
-        decline_unsafe=0.85,
-        decline_out_of_domain=0.92,
+        model=get_nb_model(),
+        decline_unsafe=decline_unsafe,
+        decline_out_of_domain=decline_out_of_domain,
         hard_rules=True,
     )
 
@@ -20,5 +30,6 @@ def pre_llm_validate(query: str) -> Dict[str, Any]:
         "accepted": accepted,
         "text": text,
         "reason": reason,
+        "proba": proba,
         "layer": "pre_llm",
     }
@@ -0,0 +1,85 @@
+"""
+Сериализованная скомпилированная NB модель pre-llm валидатора.
+
+Артефакт — каталог с плоскими .npy массивами (loglik, log_priors, vocab) и meta.json.
+Массивы читаются через mmap, поэтому загрузка не зависит от размера словаря и
+несколько процессов делят одни страницы page cache.
+
+Обучение — отдельной командой:
+    python -m app.validation.preprocessing.artifact [--out DIR] [--seed 123]
+"""
+import argparse
+import json
+import logging
+import os
+from typing import Any, Dict
+
+import numpy as np
+
+from .preprocessing import build_synthetic_model, compile_nb
+
+log = logging.getLogger(__name__)
+
+# Менять при любом изменении токенизации, обучения или формата артефакта
+ARTIFACT_VERSION = 1
+
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), "nb_model")
+DEFAULT_SEED = 123
+
+
+def save_compiled(compiled: Dict[str, Any], path: str = DEFAULT_ARTIFACT_DIR, seed: int = DEFAULT_SEED) -> None:
+    os.makedirs(path, exist_ok=True)
+
+    vocab_tokens = sorted(compiled["vocab"], key=compiled["vocab"].get)
+    np.save(os.path.join(path, "vocab.npy"), np.array(vocab_tokens, dtype=np.str_))
+    np.save(os.path.join(path, "loglik.npy"), np.ascontiguousarray(compiled["loglik"]))
+    np.save(os.path.join(path, "log_priors.npy"), compiled["log_priors"])
+
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": ARTIFACT_VERSION, "labels": compiled["labels"], "seed": seed}, f, ensure_ascii=False, indent=2)
+
+
+def load_compiled(path: str = DEFAULT_ARTIFACT_DIR) -> Dict[str, Any]:
+    """
+    Загружает артефакт; ValueError если версия не совпадает с ARTIFACT_VERSION.
+    """
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"stale nb artifact: version {meta.get('version')} != {ARTIFACT_VERSION}")
+
+    vocab_tokens = np.load(os.path.join(path, "vocab.npy"), mmap_mode="r")
+    return {
+        "labels": meta["labels"],
+        "vocab": {str(t): i for i, t in enumerate(vocab_tokens)},
+        "loglik": np.load(os.path.join(path, "loglik.npy"), mmap_mode="r"),
+        "log_priors": np.load(os.path.join(path, "log_priors.npy")),
+    }
+
+
+def train_compiled(seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    return compile_nb(build_synthetic_model(seed=seed))
+
+
+def load_or_train(path: str = DEFAULT_ARTIFACT_DIR) -> Dict[str, Any]:
+    """Артефакт с диска, а если его нет или он устарел — обучение на лету (без записи на диск)."""
+    try:
+        return load_compiled(path)
+    except (OSError, ValueError) as e:
+        log.warning("NB artifact unavailable (%s), training synthetic model in-process", e)
+        return train_compiled()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the synthetic NB model and save the compiled artifact")
+    parser.add_argument("--out", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    compiled = train_compiled(seed=args.seed)
+    save_compiled(compiled, args.out, seed=args.seed)
+    print(f"saved nb artifact v{ARTIFACT_VERSION} to {args.out}: {len(compiled['vocab'])} tokens, labels {compiled['labels']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import re
 import math
 from collections import Counter
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from .rules import RuleEngine, default_rules
 
 
 # -------------------------
@@ -71,6 +75,79 @@ def predict_proba(model: Dict[str, Any], text: str) -> Dict[str, float]:
     z = sum(exps.values()) or 1.0
     return {k: exps[k] / z for k in exps}
 
+def compile_nb(model: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Компилирует модель train_nb в табличную форму.
+
+    vocab: токен -> индекс колонки; loglik: матрица (labels x vocab+1) log P(t|y),
+    последняя колонка — для токенов вне словаря; log_priors: log P(y).
+    Значения считаются тем же math.log, что и в predict_proba, поэтому результаты совпадают побитово.
+    """
+    labels = model["labels"]
+    alpha = float(model["alpha"])
+    V = int(model["vocab_size"])
+
+    vocab_tokens = sorted({t for y in labels for t in model["tok_cnt"][y]})
+    vocab = {t: i for i, t in enumerate(vocab_tokens)}
+
+    loglik = np.empty((len(labels), len(vocab_tokens) + 1), dtype=np.float64)
+    for li, y in enumerate(labels):
+        tok_cnt = model["tok_cnt"][y]
+        denom = int(model["tot_tok"][y]) + alpha * V
+        for t, i in vocab.items():
+            loglik[li, i] = math.log((tok_cnt.get(t, 0) + alpha) / denom)
+        loglik[li, -1] = math.log(alpha / denom)
+
+    log_priors = np.array([math.log(model["priors"].get(y, 1e-12)) for y in labels], dtype=np.float64)
+
+    return {
+        "labels": labels,
+        "vocab": vocab,
+        "loglik": loglik,
+        "log_priors": log_priors,
+    }
+
+def predict_proba_batch(compiled: Dict[str, Any], texts: Sequence[str]) -> np.ndarray:
+    """
+    Вероятности классов для пачки текстов: матрица (len(texts) x len(labels)),
+    колонки в порядке compiled["labels"].
+
+    Логарифмы правдоподобия собираются одной операцией над матрицей вкладов токенов.
+    Накопление идёт cumsum в том же порядке, что и цикл predict_proba
+    (prior, затем токены в порядке первого появления), поэтому числа совпадают.
+    """
+    vocab = compiled["vocab"]
+    oov = len(vocab)
+    n_labels = len(compiled["labels"])
+
+    rows = [Counter(_tokenize(_norm(text))) for text in texts]
+    width = max((len(x) for x in rows), default=0)
+    idx = np.full((len(rows), width), oov, dtype=np.int64)
+    cnt = np.zeros((len(rows), width), dtype=np.float64)
+    for r, x in enumerate(rows):
+        for c, (t, k) in enumerate(x.items()):
+            idx[r, c] = vocab.get(t, oov)
+            cnt[r, c] = k
+
+    contrib = np.empty((len(rows), width + 1, n_labels), dtype=np.float64)
+    contrib[:, 0, :] = compiled["log_priors"]
+    contrib[:, 1:, :] = cnt[:, :, None] * compiled["loglik"].T[idx]
+    logp = np.cumsum(contrib, axis=1)[:, -1, :]
+
+    # softmax построчно через math.exp — как в predict_proba
+    out = np.empty_like(logp)
+    for r, row in enumerate(logp.tolist()):
+        m = max(row)
+        exps = [math.exp(v - m) for v in row]
+        z = sum(exps) or 1.0
+        out[r] = [e / z for e in exps]
+    return out
+
+def predict_proba_compiled(compiled: Dict[str, Any], text: str) -> Dict[str, float]:
+    """predict_proba для скомпилированной модели: {label: proba}."""
+    proba = predict_proba_batch(compiled, [text])[0]
+    return {y: float(p) for y, p in zip(compiled["labels"], proba)}
+
 def build_synthetic_model(seed: int = 123) -> Dict[str, Any]:
     import random
     rng = random.Random(seed)
@@ -150,7 +227,8 @@ def validate_query_v2(
     model: Dict[str, Any],
     decline_unsafe: float = 0.85,
     decline_out_of_domain: float = 0.92,
-    hard_rules: bool = True
+    hard_rules: bool = True,
+    rules: Optional[RuleEngine] = None
 ) -> Tuple[str, bool, Optional[str]]:
     """
     output:
@@ -158,65 +236,56 @@ def validate_query_v2(
       2) accepted: bool
       3) reason: str|None (why declined). reasons are confidence-based where possible.
 
+    rules: compiled hard-rules (default: rules.yaml next to this module)
+
     policy:
       - decline only clearly bad (hard safety) OR very confident unsafe/out_of_domain (classifier)
       - accept everything else
     """
+    text, accepted, reason, _ = validate_query_with_proba(
+        query, model, decline_unsafe, decline_out_of_domain, hard_rules, rules
+    )
+    return text, accepted, reason
+
+def validate_query_with_proba(
+    query: str,
+    model: Dict[str, Any],
+    decline_unsafe: float = 0.85,
+    decline_out_of_domain: float = 0.92,
+    hard_rules: bool = True,
+    rules: Optional[RuleEngine] = None
+) -> Tuple[str, bool, Optional[str], Optional[Dict[str, float]]]:
+    """
+    validate_query_v2 + 4) proba: {label: proba} классификатора,
+    None если запрос отклонён до классификатора (пустой, длинный, hard-rules).
+    """
     text = _clean(str(query) if query is not None else "")
     if not text:
-        return "", False, "empty_query"
+        return "", False, "empty_query", None
     if len(text) > 4000:
-        return text[:4000].rstrip(), False, "too_long"
+        return text[:4000].rstrip(), False, "too_long", None
 
     low = text.lower()
     norm = _norm(text)
-    toks = _tokenize(text)
 
     if hard_rules:
-        # robust injection/tool abuse
-        inj_phrases = [
-            r"\bигнорируй\b.*\b(инструкц|правил)\b",
-            r"\b(system|систем)\b.*\b(prompt|промпт|instruction)\b",
-            r"\bпокажи\b.*\b(промпт|инструкц)\b",
-            r"\bdump\b.*\b(db|database|баз)\b",
-            r"\b(drop|truncate|delete)\b",
-        ]
-        if any(re.search(p, norm) for p in inj_phrases):
-            return text, False, "declined_hard:prompt_injection_or_tool_abuse"
-
-        # bullying/toxicity (minimal)
-        toxic_stems = ["идиот", "дурак", "туп", "ублюд", "мраз", "ненавиж", "заткн"]
-        if any(t.startswith(st) for t in toks for st in toxic_stems):
-            return text, False, "declined_hard:bullying_or_toxicity"
-
-        # pii: email always
-        if re.search(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", text):
-            return text, False, "declined_hard:pii_email"
-
-        # pii: phone only with marker
-        phone_markers = ["тел", "телефон", "phone", "whatsapp", "ватсап", "telegram", "tg", "контакт", "связ", "позвони", "звони"]
-        has_phone_marker = any(m in low for m in phone_markers)
-        phone_like = bool(
-            re.search(r"(\+7|\b8)\s*[\(\-\s]?\d{3}[\)\-\s]?\d{3}[\-\s]?\d{2}[\-\s]?\d{2}", text)
-            or re.search(r"\+\d{1,3}[\s\-\(\)]*\d{2,4}[\s\-\)]*\d{2,4}[\s\-]*\d{2,4}", text)
-            or re.search(r"\b\d[\d\-\s\(\)]{10,}\b", text)
-        )
-        if has_phone_marker and phone_like:
-            return text, False, "declined_hard:pii_phone"
-
-        if re.search(r"\banalytics_id\b\s*[:=]\s*[\w-]+", low):
-            return text, False, "declined_hard:pii_analytics_id"
-
-    proba = predict_proba(model, text)
+        reason = (rules or default_rules()).check(low, norm)
+        if reason is not None:
+            return text, False, reason, None
+
+    if "loglik" in model:
+        proba = predict_proba_compiled(model, text)
+    else:
+        proba = predict_proba(model, text)
     label = max(proba, key=proba.get)
     conf = float(proba[label])
 
     if label == "unsafe" and conf >= decline_unsafe:
-        return text, False, f"declined_model:unsafe(conf={conf:.2f})"
+        return text, False, f"declined_model:unsafe(conf={conf:.2f})", proba
     if label == "out_of_domain" and conf >= decline_out_of_domain:
-        return text, False, f"declined_model:out_of_domain(conf={conf:.2f})"
+        return text, False, f"declined_model:out_of_domain(conf={conf:.2f})", proba
 
-    return text, True, None
+    return text, True, None, proba
 
 
 # -------------------------
@@ -0,0 +1,84 @@
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import yaml
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "rules.yaml")
+
+# буквы, из которых _tokenize собирает токены: основа "в начале токена" = не после такой буквы
+_TOKEN_LETTER = "a-zа-яё"
+
+
+def _alternation(patterns) -> str:
+    return "|".join(f"(?:{p})" for p in patterns)
+
+
+class RuleEngine:
+    """
+    Hard-rules pre-llm валидатора, скомпилированные один раз.
+
+    Инъекции проверяются одной объединённой регуляркой по norm(text).
+    Остальные правила (токсичные основы, email, телефон + маркер, analytics_id)
+    собраны в один сканер с lookahead-альтернативами: за один проход по тексту
+    он отмечает, какие правила сработали, затем причина выбирается по приоритету.
+    При совпадении двух правил в одной позиции фиксируется более приоритетное —
+    оно и так решающее.
+    """
+
+    def __init__(self, rules: Dict[str, Any]):
+        self.rules = rules
+
+        self._injection = re.compile(_alternation(rules["prompt_injection"]["patterns"]))
+
+        stems = "|".join(re.escape(s) for s in sorted(rules["toxicity"]["stems"], key=len, reverse=True))
+        markers = "|".join(re.escape(m) for m in sorted(rules["pii_phone"]["markers"], key=len, reverse=True))
+        parts = [
+            ("toxicity", f"(?<![{_TOKEN_LETTER}])(?:{stems})"),
+            ("pii_email", _alternation(rules["pii_email"]["patterns"])),
+            ("pii_phone", _alternation(rules["pii_phone"]["patterns"])),
+            ("pii_analytics_id", _alternation(rules["pii_analytics_id"]["patterns"])),
+            ("phone_marker", f"(?:{markers})"),
+        ]
+        self._names = [name for name, _ in parts]
+        self._scanner = re.compile("(?=" + "|".join(f"(?P<{name}>{p})" for name, p in parts) + ")")
+
+    def check(self, low: str, norm: str) -> Optional[str]:
+        """
+        :param low: text.lower()
+        :param norm: _norm(text)
+        :return: reason первого по приоритету сработавшего правила или None
+        """
+        if self._injection.search(norm):
+            return self.rules["prompt_injection"]["reason"]
+
+        found = set()
+        for m in self._scanner.finditer(low):
+            groups = m.groupdict()
+            for name in self._names:
+                if groups[name] is not None:
+                    found.add(name)
+                    break
+            if "toxicity" in found:
+                break
+
+        if "toxicity" in found:
+            return self.rules["toxicity"]["reason"]
+        if "pii_email" in found:
+            return self.rules["pii_email"]["reason"]
+        if "pii_phone" in found and "phone_marker" in found:
+            return self.rules["pii_phone"]["reason"]
+        if "pii_analytics_id" in found:
+            return self.rules["pii_analytics_id"]["reason"]
+        return None
+
+
+def load_rules(path: str = DEFAULT_RULES_PATH) -> RuleEngine:
+    with open(path, "r", encoding="utf-8") as f:
+        return RuleEngine(yaml.safe_load(f))
+
+
+@lru_cache(maxsize=1)
+def default_rules() -> RuleEngine:
+    return load_rules()
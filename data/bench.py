@@ -0,0 +1,391 @@
+"""
+Бенчмарки слоя данных.
+
+    python -m data.bench pool --workers 1,2,4,8
+    python -m data.bench pool --db data/vacancies.snapshot.duckdb --queries 400
+    python -m data.bench processes --processes 1,2,4
+    python -m data.bench rollups
+    python -m data.bench layout
+    python -m data.bench search
+    python -m data.bench skills
+
+Без --db данные генерируются в памяти (--rows вакансий), чтобы прогон
+был воспроизводим и не зависел от выгрузки vacancies.json.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+
+from data.layout import optimize_layout
+from data.pool import ConnectionPool
+from data.rollups import build_rollups
+from data.search import build_search_index
+from data.skill_index import build_skill_index
+from data.workers import make_process_pool, run_query
+
+# Типичные аналитические запросы генератора: агрегаты по вакансиям и навыкам
+POOL_QUERIES = [
+    "SELECT city, COUNT(*) AS n FROM Vacancies GROUP BY city ORDER BY n DESC LIMIT 10",
+    "SELECT position_level, AVG(salary_display_from) AS s FROM Vacancies "
+    "WHERE salary_display_from IS NOT NULL GROUP BY position_level",
+    "SELECT s.skill, COUNT(DISTINCT v.vacancy_id) AS n FROM Skills s JOIN Vacancies v USING (vacancy_id) "
+    "WHERE v.city = 'Москва' GROUP BY s.skill ORDER BY n DESC LIMIT 20",
+    "SELECT specialization, MEDIAN(salary_display_to) AS m FROM Vacancies GROUP BY specialization",
+]
+
+
+def make_synthetic(con: duckdb.DuckDBPyConnection, rows: int, seed: int = 7) -> None:
+    """Таблицы Vacancies и Skills с распределениями, похожими на реальную выгрузку."""
+    con.execute(f"SELECT setseed({seed / 100})")
+    con.execute(f"""
+        CREATE OR REPLACE TABLE Vacancies AS
+        SELECT
+            range AS vacancy_id,
+            (['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Берлин'])[1 + (hash(range) % 6)::INT] AS city,
+            (['junior', 'middle', 'senior', 'lead', 'c_level'])[1 + (hash(range * 3) % 5)::INT] AS position_level,
+            (['backend', 'frontend', 'data', 'devops', 'qa', 'mobile', 'ml'])[1 + (hash(range * 7) % 7)::INT] AS specialization,
+            CASE WHEN random() < 0.6 THEN 50000 + (random() * 400000)::INT END AS salary_display_from,
+            CASE WHEN random() < 0.6 THEN 100000 + (random() * 500000)::INT END AS salary_display_to,
+            (['₽', '₽', '₽', '$', '€'])[1 + (hash(range * 11) % 5)::INT] AS salary_currency,
+            random() < 0.7 AS is_active,
+            'company_' || (hash(range * 13) % 2000)::VARCHAR AS company_name,
+            repeat('описание вакансии ', 40) AS description,
+            strftime(DATE '2024-01-01' + (hash(range * 17) % 365)::INT, '%Y-%m-%d') AS published_at
+        FROM range({rows})
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE Skills AS
+        SELECT range % {rows} AS vacancy_id, 'skill_' || (hash(range) % 400)::VARCHAR AS skill
+        FROM range({rows * 5})
+    """)
+
+
+def bench_pool(args) -> None:
+    if args.db:
+        pool = ConnectionPool(args.db, size=max(args.workers), threads=args.threads, read_only=True)
+    else:
+        root = duckdb.connect()
+        make_synthetic(root, args.rows)
+        pool = ConnectionPool(root, size=max(args.workers), threads=args.threads)
+
+    def run_one(i: int) -> None:
+        with pool.connection() as con:
+            con.execute(POOL_QUERIES[i % len(POOL_QUERIES)]).fetchall()
+
+    for i in range(len(POOL_QUERIES)):
+        run_one(i)  # прогрев: первый проход читает данные с диска
+
+    base = None
+    print(f"{'workers':>7} {'qps':>9} {'speedup':>8} {'efficiency':>10}")
+    for workers in args.workers:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            start = time.perf_counter()
+            list(ex.map(run_one, range(args.queries)))
+            elapsed = time.perf_counter() - start
+        qps = args.queries / elapsed
+        base = base or qps
+        print(f"{workers:>7} {qps:>9.1f} {qps / base:>8.2f} {qps / base / workers * 100:>9.0f}%")
+    print(pool.stats())
+    pool.close()
+
+
+def _worker_memory(_: int = 0) -> dict:
+    """Память процесса-воркера из /proc (Linux): приватная (anon) и страницы файлов (file)."""
+    fields = {"pid": os.getpid()}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                fields[key] = int(value.split()[0]) // 1024
+    return fields
+
+
+def bench_processes(args) -> None:
+    tmp_dir = None
+    db_path = args.db
+    if db_path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "bench.duckdb")
+        with duckdb.connect(db_path) as con:
+            make_synthetic(con, args.rows)
+    print(f"snapshot: {db_path} ({os.path.getsize(db_path) / 2**20:.0f} MB)")
+
+    print(f"{'procs':>5} {'qps':>9} {'speedup':>8} {'anon MB/proc':>13} {'file MB/proc':>13}")
+    base = None
+    for processes in args.processes:
+        with make_process_pool(db_path, processes=processes, threads_per_process=1) as pool:
+            list(pool.map(run_query, POOL_QUERIES * processes))  # прогрев каждого процесса
+            start = time.perf_counter()
+            list(pool.map(run_query, [POOL_QUERIES[i % len(POOL_QUERIES)] for i in range(args.queries)]))
+            elapsed = time.perf_counter() - start
+            # по несколько вызовов на процесс, чтобы задеть каждый воркер
+            memory = list({m["pid"]: m for m in pool.map(_worker_memory, range(processes * 8))}.values())
+        qps = args.queries / elapsed
+        base = base or qps
+        anon = sum(m.get("RssAnon", 0) for m in memory) / len(memory)
+        file_ = sum(m.get("RssFile", 0) for m in memory) / len(memory)
+        print(f"{processes:>5} {qps:>9.1f} {qps / base:>8.2f} {anon:>13.0f} {file_:>13.0f}")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+# Один и тот же вопрос: SQL по базовым таблицам и SQL по витрине
+ROLLUP_QUERIES = [
+    (
+        "SELECT city, COUNT(*) AS n, AVG(salary_display_from) AS s FROM Vacancies "
+        "WHERE salary_currency = '₽' GROUP BY city ORDER BY n DESC",
+        "SELECT city, vacancies_count AS n, avg_salary_from AS s FROM rollup_by_city "
+        "WHERE salary_currency = '₽' ORDER BY n DESC",
+    ),
+    (
+        "SELECT position_level, MEDIAN(salary_display_to) AS m FROM Vacancies "
+        "WHERE salary_currency = '₽' GROUP BY position_level ORDER BY position_level",
+        "SELECT position_level, median_salary_to AS m FROM rollup_by_position_level "
+        "WHERE salary_currency = '₽' ORDER BY position_level",
+    ),
+    (
+        "SELECT s.skill, COUNT(DISTINCT v.vacancy_id) AS n FROM Vacancies v "
+        "JOIN (SELECT DISTINCT vacancy_id, skill FROM Skills) s USING (vacancy_id) "
+        "WHERE v.salary_currency = '$' GROUP BY s.skill ORDER BY n DESC, s.skill LIMIT 20",
+        "SELECT skill, vacancies_count AS n FROM rollup_by_skill "
+        "WHERE salary_currency = '$' ORDER BY n DESC, skill LIMIT 20",
+    ),
+    (
+        "SELECT company_name, COUNT(*) FILTER (WHERE is_active) AS n FROM Vacancies "
+        "GROUP BY company_name ORDER BY n DESC, company_name LIMIT 10",
+        "SELECT company_name, SUM(active_vacancies_count) AS n FROM rollup_by_company "
+        "GROUP BY company_name ORDER BY n DESC, company_name LIMIT 10",
+    ),
+]
+
+
+def _median_ms(con, sql: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def bench_rollups(args) -> None:
+    con = duckdb.connect(args.db, read_only=True) if args.db else duckdb.connect()
+    if not args.db:
+        make_synthetic(con, args.rows)
+        start = time.perf_counter()
+        sizes = build_rollups(con)
+        print(f"build_rollups: {(time.perf_counter() - start) * 1000:.0f} ms, rows {sizes}")
+    con.execute(f"SET threads = {args.threads}")
+
+    print(f"{'query':>5} {'base ms':>9} {'rollup ms':>10} {'speedup':>8}  same result")
+    for i, (base_sql, rollup_sql) in enumerate(ROLLUP_QUERIES, 1):
+        same = con.execute(base_sql).fetchall() == con.execute(rollup_sql).fetchall()
+        base = _median_ms(con, base_sql, args.repeat)
+        rollup = _median_ms(con, rollup_sql, args.repeat)
+        print(f"{i:>5} {base:>9.2f} {rollup:>10.2f} {base / rollup:>7.1f}x  {same}")
+
+
+# Сканы по ENUM-колонкам, фильтр по дате, соединения Skills -> Vacancies и выборка по vacancy_id
+LAYOUT_QUERIES = [
+    ("group", "SELECT city, position_level, salary_currency, COUNT(*) AS n, AVG(salary_display_to) AS s "
+              "FROM Vacancies GROUP BY ALL ORDER BY ALL"),
+    ("scan", "SELECT city, COUNT(*) AS n FROM Vacancies WHERE position_level = 'senior' GROUP BY city ORDER BY city"),
+    ("scan", "SELECT salary_currency, specialization, AVG(salary_display_from) AS s FROM Vacancies "
+             "WHERE city IN ('Москва', 'Казань') GROUP BY ALL ORDER BY ALL"),
+    ("date", "SELECT COUNT(*) FROM Vacancies WHERE published_at >= '2024-06-01' AND published_at < '2024-06-08'"),
+    ("join", "SELECT s.skill, COUNT(*) AS n FROM Skills s JOIN Vacancies v USING (vacancy_id) "
+             "WHERE v.published_at >= '2024-06-01' AND v.published_at < '2024-06-08' "
+             "GROUP BY s.skill ORDER BY n DESC, s.skill LIMIT 10"),
+    ("join", "SELECT v.position_level, COUNT(DISTINCT v.vacancy_id) AS n FROM Vacancies v JOIN Skills s USING (vacancy_id) "
+             "WHERE s.skill = 'skill_7' GROUP BY ALL ORDER BY ALL"),
+    ("point", "SELECT skill FROM Skills WHERE vacancy_id = 12345 ORDER BY skill"),
+]
+
+
+def _rounded(rows):
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+
+
+def bench_layout(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain_path = os.path.join(tmp_dir, "plain.duckdb")
+        layout_path = os.path.join(tmp_dir, "layout.duckdb")
+
+        con = duckdb.connect(plain_path)
+        con.execute(f"SET threads = {args.threads}")
+        make_synthetic(con, args.rows)
+        con.execute("CHECKPOINT")
+        before = [(_median_ms(con, sql, args.repeat), con.execute(sql).fetchall()) for _, sql in LAYOUT_QUERIES]
+        con.close()
+
+        # как в build_snapshot: сырые таблицы подключаются и переписываются в новый файл
+        con = duckdb.connect(layout_path)
+        con.execute(f"SET threads = {args.threads}")
+        con.execute(f"ATTACH '{plain_path}' AS plain (READ_ONLY)")
+        start = time.perf_counter()
+        converted = optimize_layout(con, source="plain")
+        con.execute("DETACH plain")
+        con.execute("CHECKPOINT")
+        print(f"optimize_layout: {(time.perf_counter() - start) * 1000:.0f} ms, ENUM columns {converted}")
+        print(f"file size: {os.path.getsize(plain_path) / 2**20:.1f} MB -> {os.path.getsize(layout_path) / 2**20:.1f} MB")
+
+        print(f"{'query':>5} {'kind':>5} {'plain ms':>9} {'layout ms':>10} {'speedup':>8}  same result")
+        for i, ((kind, sql), (plain_ms, plain_rows)) in enumerate(zip(LAYOUT_QUERIES, before), 1):
+            layout_ms = _median_ms(con, sql, args.repeat)
+            same = _rounded(con.execute(sql).fetchall()) == _rounded(plain_rows)
+            print(f"{i:>5} {kind:>5} {plain_ms:>9.2f} {layout_ms:>10.2f} {plain_ms / layout_ms:>7.1f}x  {same}")
+        con.close()
+
+
+# Ключевые слова поиска; остальной текст описаний — случайные слова из большого словаря
+SEARCH_KEYWORDS = ['python', 'java', 'golang', 'kafka', 'postgresql', 'kubernetes', 'react', 'typescript', 'docker', 'spark']
+
+# Один и тот же поиск: ILIKE по описанию и полнотекстовый индекс
+SEARCH_QUERIES = [
+    ("SELECT COUNT(*) FROM Vacancies WHERE description ILIKE '%kafka%' OR position ILIKE '%kafka%'",
+     "SELECT COUNT(*) FROM match_vacancies('kafka')"),
+    ("SELECT COUNT(*) FROM Vacancies WHERE (description ILIKE '%python%' OR position ILIKE '%python%') "
+     "AND (description ILIKE '%postgresql%' OR position ILIKE '%postgresql%')",
+     "SELECT COUNT(*) FROM match_vacancies('python postgresql')"),
+    ("SELECT COUNT(*) FROM Vacancies WHERE description ILIKE '%docker%' OR position ILIKE '%docker%' "
+     "OR description ILIKE '%kubernetes%' OR position ILIKE '%kubernetes%'",
+     "SELECT COUNT(*) FROM search_vacancies('docker kubernetes')"),
+]
+
+
+def bench_search(args) -> None:
+    con = duckdb.connect()
+    con.execute(f"SET threads = {args.threads}")
+    make_synthetic(con, args.rows)
+    con.execute(f"""
+        CREATE TEMP TABLE _words AS
+        SELECT list(w) AS words FROM (
+            SELECT substr(md5(range::VARCHAR), 1, 8) AS w FROM range({args.vocabulary}) UNION ALL SELECT unnest(?)
+        )
+    """, [SEARCH_KEYWORDS])
+    con.execute(f"""
+        CREATE OR REPLACE TABLE Vacancies AS
+        WITH d AS (
+            SELECT r.range AS vacancy_id,
+                   string_agg(words[1 + (hash(r.range * 1000 + i.range) % len(words))::INT], ' ') AS description
+            FROM range({args.rows}) r, range({args.words}) i, _words
+            GROUP BY 1
+        )
+        SELECT v.* REPLACE (d.description AS description),
+               (['Python developer', 'Java developer', 'Data engineer', 'QA engineer', 'DevOps engineer'])
+                   [1 + (hash(v.vacancy_id * 19) % 5)::INT] AS position
+        FROM Vacancies v JOIN d USING (vacancy_id)
+    """)
+    size = con.execute("SELECT SUM(length(description)) FROM Vacancies").fetchone()[0]
+    start = time.perf_counter()
+    postings = build_search_index(con)
+    print(f"build_search_index: {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{postings:,} postings over {size / 2**20:.0f} MB of text")
+
+    print(f"{'query':>5} {'ILIKE ms':>9} {'index ms':>9} {'speedup':>8} {'ILIKE rows':>11} {'index rows':>11}")
+    for i, (ilike_sql, fts_sql) in enumerate(SEARCH_QUERIES, 1):
+        ilike = _median_ms(con, ilike_sql, args.repeat)
+        fts = _median_ms(con, fts_sql, args.repeat)
+        ilike_rows = con.execute(ilike_sql).fetchone()[0]
+        fts_rows = con.execute(fts_sql).fetchone()[0]
+        print(f"{i:>5} {ilike:>9.2f} {fts:>9.2f} {ilike / fts:>7.1f}x {ilike_rows:>11} {fts_rows:>11}")
+
+
+# Один и тот же вопрос: подзапросы к Skills на каждый навык и битмап-индекс
+SKILL_QUERIES = [
+    ("AND",
+     "SELECT COUNT(*) FROM Vacancies WHERE vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_1') "
+     "AND vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_2') "
+     "AND vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_3')",
+     "SELECT COUNT(*) FROM vacancies_with_skills(['skill_1', 'skill_2', 'skill_3'])"),
+    ("OR",
+     "SELECT COUNT(*) FROM Vacancies WHERE vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_1') "
+     "OR vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_2')",
+     "SELECT COUNT(*) FROM vacancies_with_skills([], any_of := ['skill_1', 'skill_2'])"),
+    ("NOT",
+     "SELECT COUNT(*) FROM Vacancies WHERE vacancy_id IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_1') "
+     "AND vacancy_id NOT IN (SELECT vacancy_id FROM Skills WHERE skill ILIKE 'skill_2')",
+     "SELECT COUNT(*) FROM vacancies_with_skills(['skill_1'], none_of := ['skill_2'])"),
+    ("pairs",
+     "SELECT s2.skill, COUNT(DISTINCT s2.vacancy_id) AS n FROM Skills s1 JOIN Skills s2 USING (vacancy_id) "
+     "WHERE s1.skill ILIKE 'skill_1' AND s2.skill NOT ILIKE 'skill_1' GROUP BY 1 ORDER BY n DESC, 1 LIMIT 10",
+     "SELECT skill, vacancies_count FROM skill_cooccurrence('skill_1') LIMIT 10"),
+]
+
+
+def bench_skills(args) -> None:
+    con = duckdb.connect()
+    con.execute(f"SET threads = {args.threads}")
+    make_synthetic(con, args.rows)
+    start = time.perf_counter()
+    skills = build_skill_index(con)
+    size = con.execute("SELECT SUM(octet_length(bits)) FROM skill_index.bitmaps").fetchone()[0]
+    pairs = con.execute("SELECT COUNT(*) FROM skill_index.pairs").fetchone()[0]
+    print(f"build_skill_index: {(time.perf_counter() - start) * 1000:.0f} ms, {skills} skills, "
+          f"{size / 2**20:.1f} MB of bitmaps, {pairs:,} skill pairs")
+
+    print(f"{'query':>5} {'Skills ms':>10} {'index ms':>9} {'speedup':>8}  same result")
+    for kind, skills_sql, index_sql in SKILL_QUERIES:
+        base = _median_ms(con, skills_sql, args.repeat)
+        index = _median_ms(con, index_sql, args.repeat)
+        same = con.execute(skills_sql).fetchall() == con.execute(index_sql).fetchall()
+        print(f"{kind:>5} {base:>10.2f} {index:>9.2f} {base / index:>7.1f}x  {same}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Data layer benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("pool", help="concurrent query throughput through ConnectionPool")
+    p.add_argument("--db", default=None, help="DuckDB file (default: synthetic in-memory data)")
+    p.add_argument("--rows", type=int, default=200_000, help="synthetic vacancies")
+    p.add_argument("--workers", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8])
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--threads", type=int, default=1, help="DuckDB threads (1 = one core per query)")
+    p.set_defaults(func=bench_pool)
+
+    p = sub.add_parser("processes", help="read-only snapshot served by a process pool")
+    p.add_argument("--db", default=None, help="DuckDB snapshot (default: synthetic file in a temp dir)")
+    p.add_argument("--rows", type=int, default=200_000, help="synthetic vacancies")
+    p.add_argument("--processes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+    p.add_argument("--queries", type=int, default=200)
+    p.set_defaults(func=bench_processes)
+
+    p = sub.add_parser("rollups", help="aggregate queries on base tables vs rollup tables")
+    p.add_argument("--db", default=None, help="snapshot with rollups (default: synthetic in-memory data)")
+    p.add_argument("--rows", type=int, default=200_000, help="synthetic vacancies")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--threads", type=int, default=1)
+    p.set_defaults(func=bench_rollups)
+
+    p = sub.add_parser("layout", help="plain VARCHAR/unsorted tables vs ENUM columns and sorted tables")
+    p.add_argument("--rows", type=int, default=500_000, help="synthetic vacancies")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--threads", type=int, default=1)
+    p.set_defaults(func=bench_layout)
+
+    p = sub.add_parser("search", help="ILIKE scans vs the full-text index")
+    p.add_argument("--rows", type=int, default=100_000, help="synthetic vacancies")
+    p.add_argument("--words", type=int, default=150, help="words per description")
+    p.add_argument("--vocabulary", type=int, default=5_000, help="distinct filler words")
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--threads", type=int, default=1)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("skills", help="per-skill subqueries on Skills vs the skill bitmap index")
+    p.add_argument("--rows", type=int, default=200_000, help="synthetic vacancies")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--threads", type=int, default=1)
+    p.set_defaults(func=bench_skills)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
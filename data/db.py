@@ -1,54 +1,398 @@
+import fcntl
+import hashlib
 import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
 import pandas as pd
 import duckdb
 
-def get_db_con(data_path):
-    with open(data_path, 'r') as f:
-        _json = json.load(f)
-    
+from data.guard import QueryGuard
+from data.ingest import append_frame, finalize_tables, iter_record_chunks, prepare_columns
+from data.layout import optimize_layout, widen_enums
+from data.result_cache import ResultCache
+from data.rollups import build_rollups, rollup_groups, update_rollups
+from data.search import build_search_index, update_search_index
+from data.skill_index import build_skill_index, update_skill_index
+
+log = logging.getLogger(__name__)
+
+multiple_choise_columns = {
+    'locations': {'column_name': 'location', 'table_name': 'Locations'},
+    'stack': {'column_name': 'skill', 'table_name': 'Skills'},
+    'breadcrumbs': {'column_name': 'breadcrumb', 'table_name': 'Breadcrumbs'},
+    'specializations': {'column_name': 'specialization', 'table_name': 'Specializations'},
+    'relocation_options': {'column_name': 'relocation_option', 'table_name': 'RelocationOptions'},
+    'display_locations': {'column_name': 'display_location', 'table_name': 'DisplayLocation', 'process_as_table': True}
+}
+
+# Общий кэш результатов execute_query, ключ — (канонический SQL, data_version)
+result_cache = ResultCache()
+
+# Служебные метаданные снапшота живут в отдельной схеме, чтобы не попадать в SHOW TABLES
+META_SCHEMA = 'meta'
+
+# Версия содержимого снапшота (набор таблиц и витрин); при изменении снапшот пересобирается
+SNAPSHOT_FORMAT = '6'
+
+
+def _has_value(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns:
+        return pd.Series(False, index=df.index)
+    return ~df[column].isna()
+
+
+def normalize_vacancies(_json) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """
+    Превращает сырой JSON вакансий в основную таблицу и дочерние таблицы multiple choice колонок.
+
+    Работает как на полном файле, так и на отдельном чанке записей: колонки,
+    которых нет в чанке, просто пропускаются.
+
+    :param _json: Список записей из vacancies.json
+    :return: (Vacancies DataFrame, {имя таблицы: DataFrame})
+    """
     raw_df = pd.json_normalize(_json, sep='_').drop(columns=['id'])
     raw_df.columns = raw_df.columns.str.replace('data_', '')
-    
-    raw_df['is_one_day_offer_available'] = ~raw_df['one_day_offer_content_version'].isna()
-    raw_df['is_one_day_offer_v3_available'] = ~raw_df['one_day_offer_content_v3_date'].isna()
-    
-    raw_df = raw_df.drop(columns=['english_level', 'one_day_offer_content', 'one_day_offer_content_v3', 'is_my', 'application', 'is_form_my_company'])
+
+    raw_df['is_one_day_offer_available'] = _has_value(raw_df, 'one_day_offer_content_version')
+    raw_df['is_one_day_offer_v3_available'] = _has_value(raw_df, 'one_day_offer_content_v3_date')
+
+    raw_df = raw_df.drop(columns=['english_level', 'one_day_offer_content', 'one_day_offer_content_v3', 'is_my', 'application', 'is_form_my_company'], errors='ignore')
     raw_df = raw_df.drop(columns=raw_df.columns[raw_df.columns.str.contains(r'^one\_day\_offer.*', regex=True)])
-    
-    multiple_choise_columns = {
-        'locations': {'column_name': 'location', 'table_name': 'Locations'}, 
-        'stack': {'column_name': 'skill', 'table_name': 'Skills'}, 
-        'breadcrumbs': {'column_name': 'breadcrumb', 'table_name': 'Breadcrumbs'}, 
-        'specializations': {'column_name': 'specialization', 'table_name': 'Specializations'}, 
-        'relocation_options': {'column_name': 'relocation_option', 'table_name': 'RelocationOptions'}, 
-        'display_locations': {'column_name': 'display_location', 'table_name': 'DisplayLocation', 'process_as_table': True}
-    }
-    
+
     external_tables = {}
     for column, params in multiple_choise_columns.items():
+        if column not in raw_df.columns:
+            continue
         feature_link = raw_df.set_index('id')[column].explode().dropna().rename(params['column_name'])
         if params.get('process_as_table', False):
-            feature_link = pd.DataFrame(feature_link.to_dict()).T
+            # каждый элемент — dict с одинаковыми ключами, разворачиваем в колонки за один проход
+            feature_link = pd.DataFrame(feature_link.tolist(), index=feature_link.index)
         feature_link.index.name = 'vacancy_id'
         external_tables[params['table_name']] = feature_link.reset_index()
-    
+
     raw_df = (
         raw_df
-        .drop(columns=multiple_choise_columns.keys())
+        .drop(columns=multiple_choise_columns.keys(), errors='ignore')
         .rename(columns={'id': 'vacancy_id'})
     )
-    
-    # Подключение к in-memory базе (или укажите путь к файлу: 'my_database.duckdb')
-    con = duckdb.connect("data/vacancies.duckdb")
-    
-    # Регистрация основного DataFrame (замените 'main_df' на ваше имя)
-    con.register('Vacancies', raw_df)
-    
-    # Регистрация 6 небольших датасетов (замените имена на ваши)
-    for name, _df in external_tables.items():
-        con.register(name, _df)
-    
-    # Например средние зарплаты вакансий из топ 100 по попурярности позиций Москвы
-    return con
-def execute_query(con, query):
-    return con.execute(query).df()
+    return raw_df, external_tables
+
+
+def default_snapshot_path(data_path: str) -> str:
+    """Путь к снапшоту рядом с исходным файлом: data/vacancies.json -> data/vacancies.snapshot.duckdb"""
+    return os.path.splitext(data_path)[0] + '.snapshot.duckdb'
+
+
+def source_digest(data_path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 исходного файла, читается кусками без загрузки в память целиком."""
+    digest = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_digest(snapshot_path: str) -> Optional[str]:
+    """
+    Хэш источника, из которого собран снапшот, или None если снапшота нет, он битый
+    или собран другой версией формата (SNAPSHOT_FORMAT).
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        con = duckdb.connect(snapshot_path, read_only=True)
+    except duckdb.Error:
+        return None
+    try:
+        meta = dict(con.execute(
+            f"SELECT key, value FROM {META_SCHEMA}.snapshot WHERE key IN ('source_digest', 'format')"
+        ).fetchall())
+    except duckdb.Error:
+        meta = {}
+    finally:
+        con.close()
+    if meta.get('format', '1') != SNAPSHOT_FORMAT:
+        return None
+    return meta.get('source_digest')
+
+
+def _load_full(con, data_path: str) -> None:
+    with open(data_path, 'r') as f:
+        _json = json.load(f)
+    raw_df, external_tables = normalize_vacancies(_json)
+    del _json
+
+    tables = {'Vacancies': raw_df, **external_tables}
+    for name, _df in tables.items():
+        con.register('_frame', _df)
+        con.execute(f'CREATE TABLE "{name}" AS SELECT * FROM _frame')
+        con.unregister('_frame')
+
+
+def _load_streaming(con, data_path: str, chunk_size: int) -> None:
+    null_columns = {}
+    for records in iter_record_chunks(data_path, chunk_size):
+        raw_df, external_tables = normalize_vacancies(records)
+        tables = {'Vacancies': raw_df, **external_tables}
+        for name, _df in tables.items():
+            append_frame(con, name, _df, null_columns.setdefault(name, {}))
+
+    table_columns = {'Vacancies': {'vacancy_id': 'BIGINT'}}
+    for params in multiple_choise_columns.values():
+        table_columns[params['table_name']] = {'vacancy_id': 'BIGINT', params['column_name']: 'VARCHAR'}
+    finalize_tables(con, table_columns, null_columns)
+
+
+def build_snapshot(
+    data_path: str,
+    snapshot_path: Optional[str] = None,
+    digest: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+) -> str:
+    """
+    Собирает колоночный снапшот: Vacancies и 6 дочерних таблиц как нативные таблицы DuckDB
+    (ENUM-колонки и сортировка — data/layout.py), витрины агрегатов (data/rollups.py)
+    полнотекстовый индекс по описаниям вакансий (data/search.py) и битмап-индекс
+    навыков (data/skill_index.py).
+
+    Файл пишется во временный путь и атомарно подменяется, поэтому читатели
+    никогда не видят наполовину записанный снапшот.
+
+    :param chunk_size: Если задан, JSON читается потоково по chunk_size записей
+        и пишется в таблицы инкрементально — пиковая память не зависит от размера файла
+    :return: Путь к снапшоту
+    """
+    snapshot_path = snapshot_path or default_snapshot_path(data_path)
+    digest = digest or source_digest(data_path)
+
+    log.info("🧱 Building DuckDB snapshot %s", snapshot_path)
+    tmp_path = snapshot_path + '.tmp'
+    # сырые таблицы грузятся в отдельный файл и переписываются в снапшот уже в итоговом
+    # виде — иначе в снапшоте остались бы свободные блоки от исходных таблиц
+    staging_path = snapshot_path + '.staging'
+    for path in (tmp_path, tmp_path + '.wal', staging_path, staging_path + '.wal'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    staging = duckdb.connect(staging_path)
+    try:
+        if chunk_size:
+            _load_streaming(staging, data_path, chunk_size)
+        else:
+            _load_full(staging, data_path)
+    finally:
+        staging.close()
+
+    con = duckdb.connect(tmp_path)
+    try:
+        con.execute("ATTACH '{}' AS staging (READ_ONLY)".format(staging_path.replace("'", "''")))
+        optimize_layout(con, source='staging')
+        con.execute("DETACH staging")
+        build_rollups(con)
+        build_search_index(con)
+        build_skill_index(con)
+
+        con.execute(f"CREATE SCHEMA {META_SCHEMA}")
+        con.execute(f"CREATE TABLE {META_SCHEMA}.snapshot (key VARCHAR PRIMARY KEY, value VARCHAR)")
+        con.execute(
+            f"INSERT INTO {META_SCHEMA}.snapshot VALUES "
+            "('source_digest', ?), ('source_path', ?), ('data_version', '0'), ('format', ?)",
+            [digest, os.path.abspath(data_path), SNAPSHOT_FORMAT],
+        )
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+        os.remove(staging_path)
+
+    os.replace(tmp_path, snapshot_path)
+    return snapshot_path
+
+
+@contextmanager
+def _build_lock(snapshot_path: str) -> Iterator[None]:
+    """Межпроцессная блокировка сборки: N процессов, стартующих разом, соберут снапшот один раз."""
+    with open(snapshot_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_db_con(
+    data_path,
+    snapshot_path: Optional[str] = None,
+    rebuild: bool = False,
+    chunk_size: Optional[int] = None,
+    read_only: bool = False,
+):
+    """
+    Открывает снапшот базы вакансий, пересобирая его только если изменился исходный JSON.
+
+    :param data_path: Путь к vacancies.json
+    :param snapshot_path: Путь к файлу снапшота (по умолчанию рядом с data_path)
+    :param rebuild: Принудительно пересобрать снапшот
+    :param chunk_size: Потоковая сборка снапшота по chunk_size записей (см. build_snapshot)
+    :param read_only: Открыть снапшот только на чтение. Так его могут одновременно открыть
+        несколько процессов (см. data/workers.py) без копии таблиц в памяти каждого.
+        apply_delta на таком соединении недоступен.
+    """
+    snapshot_path = snapshot_path or default_snapshot_path(data_path)
+    digest = source_digest(data_path)
+
+    if rebuild or snapshot_digest(snapshot_path) != digest:
+        with _build_lock(snapshot_path):
+            # пока ждали блокировку, снапшот мог собрать соседний процесс
+            if rebuild or snapshot_digest(snapshot_path) != digest:
+                build_snapshot(data_path, snapshot_path, digest=digest, chunk_size=chunk_size)
+                result_cache.clear()
+    else:
+        log.info("♻️ Reusing DuckDB snapshot %s", snapshot_path)
+
+    return duckdb.connect(snapshot_path, read_only=read_only)
+
+
+def data_version(con) -> str:
+    """
+    Токен версии данных для ключей кэшей.
+
+    Меняется при пересборке снапшота (другой хэш источника) и при каждой применённой дельте.
+    """
+    meta = dict(con.execute(
+        f"SELECT key, value FROM {META_SCHEMA}.snapshot WHERE key IN ('source_digest', 'data_version')"
+    ).fetchall())
+    return f"{meta['source_digest'][:12]}:{meta.get('data_version', '0')}"
+
+
+def _vacancy_tables():
+    return ['Vacancies'] + [params['table_name'] for params in multiple_choise_columns.values()]
+
+
+def _delta_frames(delta_path: str, chunk_size: int) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """(таблица, DataFrame) для всех апсертов дельты — предварительные проходы prepare_columns и widen_enums."""
+    for records in iter_record_chunks(delta_path, chunk_size):
+        upserts = [r for r in records if not r.get('deleted')]
+        if upserts:
+            raw_df, external_tables = normalize_vacancies(upserts)
+            yield from {'Vacancies': raw_df, **external_tables}.items()
+
+
+def apply_delta(con, delta_path: str, chunk_size: int = 1000) -> Dict[str, object]:
+    """
+    Применяет дельту вакансий к открытому снапшоту без полной пересборки.
+
+    Формат дельты совпадает с vacancies.json. Запись с "deleted": true на верхнем
+    уровне удаляет вакансию data.id, любая другая запись заменяет вакансию целиком
+    (строку в Vacancies и все её строки в дочерних таблицах). Истёкшие вакансии
+    приходят обычным апсертом с is_active = false.
+
+    Стоимость пропорциональна размеру дельты: разбирается только она, а по
+    основным таблицам идёт лишь удаление по vacancy_id. Новые значения ENUM-колонок
+    (например, новый уровень позиции) расширяют тип колонки. Витрины rollup_by_*,
+    поисковый индекс и индекс навыков обновляются в той же транзакции и только для
+    затронутых вакансий: в витринах пересчитываются группы (город, навык, ...), в которые
+    они входили до дельты или входят после (data/rollups.py, data/search.py, data/skill_index.py).
+
+    :return: {'upserted': ..., 'deleted': ..., 'data_version': ...}
+    """
+    upserted = deleted = 0
+    tables = _vacancy_tables()
+    touched_ids = []
+    groups: Dict[str, set] = {}
+
+    con.begin()
+    try:
+        # все ALTER — до первого DELETE/INSERT: иначе DuckDB не закоммитит транзакцию
+        for name, frame in _delta_frames(delta_path, chunk_size):
+            prepare_columns(con, name, frame)
+        widen_enums(con, _delta_frames(delta_path, chunk_size))
+        for records in iter_record_chunks(delta_path, chunk_size):
+            deletes = [r['data']['id'] for r in records if r.get('deleted')]
+            upserts = [r for r in records if not r.get('deleted')]
+
+            touched = pd.DataFrame({'vacancy_id': deletes + [r['data']['id'] for r in upserts]})
+            touched_ids.extend(touched['vacancy_id'])
+            con.register('_touched', touched)
+            # группы витрин до и после замены строк: только их пересчитает update_rollups
+            for name, keys in rollup_groups(con, '_touched').items():
+                groups.setdefault(name, set()).update(keys)
+            for name in tables:
+                con.execute(f'DELETE FROM "{name}" WHERE vacancy_id IN (SELECT vacancy_id FROM _touched)')
+
+            if upserts:
+                raw_df, external_tables = normalize_vacancies(upserts)
+                for name, _df in {'Vacancies': raw_df, **external_tables}.items():
+                    append_frame(con, name, _df, {})
+                for name, keys in rollup_groups(con, '_touched').items():
+                    groups.setdefault(name, set()).update(keys)
+            con.unregister('_touched')
+
+            upserted += len(upserts)
+            deleted += len(deletes)
+
+        # витрины и поисковый индекс меняются в той же транзакции, что и данные
+        update_search_index(con, touched_ids)
+        update_skill_index(con, touched_ids)
+        update_rollups(con, groups)
+        con.execute(
+            f"UPDATE {META_SCHEMA}.snapshot SET value = CAST(CAST(value AS BIGINT) + 1 AS VARCHAR) "
+            "WHERE key = 'data_version'"
+        )
+        con.commit()
+    except Exception:
+        try:
+            con.rollback()
+        except duckdb.TransactionException:
+            # неудавшийся COMMIT уже откатил транзакцию — важна исходная ошибка
+            pass
+        raise
+
+    result_cache.clear()
+    version = data_version(con)
+    log.info("🔁 Delta applied: %s upserted, %s deleted, data version %s", upserted, deleted, version)
+    return {'upserted': upserted, 'deleted': deleted, 'data_version': version}
+
+
+def execute_query(con, query, use_cache: bool = True, guard: Optional[QueryGuard] = None):
+    """
+    Выполняет запрос и возвращает DataFrame.
+
+    Результаты SELECT/WITH запросов кэшируются в result_cache с привязкой к data_version
+    и лимитам guard, поэтому повтор того же SQL на неизменных данных не доходит до DuckDB.
+    С guard запрос выполняется под защитой (таймаут, лимит строк, проверка плана)
+    и может бросить data.guard.QueryGuardError.
+    """
+    cacheable = use_cache and re.match(r"\s*(select|with)\b", query, re.IGNORECASE) is not None
+    version = None
+    if cacheable:
+        try:
+            version = data_version(con)
+        except duckdb.Error:
+            # соединение без метаданных снапшота — кэшировать не на что завязаться
+            cacheable = False
+        else:
+            # результат под guard обрезан и прошёл проверку плана — у него своя запись
+            if guard is not None:
+                version = f"{version}|{guard.cache_tag}"
+
+    if cacheable:
+        cached = result_cache.get(query, version)
+        if cached is not None:
+            return cached
+
+    df = guard.execute(con, query) if guard is not None else con.execute(query).df()
+    # ENUM-колонки снапшота приходят как pandas Categorical — отдаём обычные строки, как раньше
+    for column in df.columns[df.dtypes == 'category']:
+        df[column] = df[column].astype(object)
+    if cacheable:
+        try:
+            result_cache.put(query, version, df)
+        except Exception as e:
+            # запрос уже выполнен — сбой кэша не должен его ронять
+            log.warning("⚠️ Result not cached: %s", e)
+    return df
@@ -0,0 +1,142 @@
+import json
+import threading
+from typing import Any, Dict
+
+import duckdb
+import pandas as pd
+
+# Операторы, у которых DuckDB не пишет оценку строк: считаем её как произведение входов
+_PRODUCT_OPERATORS = {'CROSS_PRODUCT', 'NESTED_LOOP_JOIN', 'BLOCKWISE_NL_JOIN'}
+
+
+class QueryGuardError(RuntimeError):
+    """
+    Запрос остановлен защитой: kind — "timeout" или "explosive_plan".
+
+    Текст ошибки пригоден как feedback для LLM в цикле исправления SQL.
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+class QueryGuard:
+    """
+    Защищённое выполнение сгенерированного SQL.
+
+    - план (EXPLAIN FORMAT JSON) проверяется до выполнения: декартово произведение
+      или соединение с оценкой больше max_plan_rows строк отклоняется;
+    - запрос оборачивается в LIMIT max_rows + 1: лишняя строка означает, что результат
+      обрезан (df.attrs["truncated"]);
+    - по истечении timeout_seconds соединение прерывается через con.interrupt().
+
+    memory_limit и threads в DuckDB — настройки всего экземпляра базы, а не запроса:
+    их задают ConnectionPool и init_worker при открытии базы (data/pool.py, data/workers.py).
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: float = 15.0,
+        max_rows: int = 10_000,
+        max_plan_rows: float = 5e7,
+    ):
+        """
+        Args:
+            timeout_seconds: Бюджет времени на один запрос
+            max_rows: Максимум строк в результате
+            max_plan_rows: Максимальная оценка строк на любом узле плана
+        """
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_plan_rows = max_plan_rows
+        self.events = {"timeouts": 0, "explosive_plans": 0, "truncated": 0}
+        self._lock = threading.Lock()
+
+    def check_plan(self, con, sql: str) -> None:
+        """QueryGuardError, если по плану запрос породит взрывное число строк."""
+        plan = json.loads(con.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()[0][1])
+        for node in plan:
+            rows, operator = self._estimate(node)
+            if operator is not None:
+                self._count("explosive_plans")
+                raise QueryGuardError(
+                    "explosive_plan",
+                    f"Запрос слишком тяжёлый: {operator} даёт ~{rows:,.0f} строк (лимит {self.max_plan_rows:,.0f}). "
+                    "Убери декартово произведение, добавь условие соединения по vacancy_id или агрегируй раньше.",
+                )
+
+    @property
+    def cache_tag(self) -> str:
+        """Лимиты, от которых зависит результат: часть ключа result_cache."""
+        return f"guard:{self.max_rows}:{self.max_plan_rows:g}"
+
+    def limit(self, sql: str) -> str:
+        return f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n) AS guarded LIMIT {self.max_rows + 1}"
+
+    def execute(self, con, sql: str) -> pd.DataFrame:
+        """Проверка плана, лимит строк и выполнение с таймаутом."""
+        self.check_plan(con, sql)
+
+        # таймер может сработать между концом запроса и cancel(): interrupt() тогда прервал бы
+        # следующий запрос на этом соединении, поэтому прерываем только пока этот ещё выполняется
+        running = [True]
+        running_lock = threading.Lock()
+
+        def interrupt() -> None:
+            with running_lock:
+                if running[0]:
+                    con.interrupt()
+
+        timer = threading.Timer(self.timeout_seconds, interrupt)
+        timer.daemon = True
+        timer.start()
+        try:
+            df = con.execute(self.limit(sql)).df()
+        except duckdb.InterruptException:
+            self._count("timeouts")
+            raise QueryGuardError(
+                "timeout",
+                f"Запрос выполнялся дольше {self.timeout_seconds:g} с и был прерван. "
+                "Упрости запрос: меньше соединений, фильтры до агрегации.",
+            )
+        finally:
+            with running_lock:
+                running[0] = False
+            timer.cancel()
+
+        df.attrs["truncated"] = len(df) > self.max_rows
+        if df.attrs["truncated"]:
+            self._count("truncated")
+            df = df.iloc[:self.max_rows]
+        return df
+
+    def _estimate(self, node: Dict[str, Any]):
+        """(оценка строк узла, оператор-нарушитель или None) — обход плана снизу вверх."""
+        child_rows = []
+        for child in node.get("children", []):
+            rows, offender = self._estimate(child)
+            if offender is not None:
+                return rows, offender
+            child_rows.append(rows)
+
+        name = node.get("name", "")
+        info = node.get("extra_info")
+        estimate = info.get("Estimated Cardinality") if isinstance(info, dict) else None
+        if estimate is not None:
+            rows = float(estimate)
+        elif name in _PRODUCT_OPERATORS:
+            rows = 1.0
+            for r in child_rows:
+                rows *= r
+        else:
+            rows = max(child_rows, default=0.0)
+
+        # большие сканы ограничены самими данными; взрываются только соединения
+        if rows > self.max_plan_rows and (name in _PRODUCT_OPERATORS or 'JOIN' in name):
+            return rows, name
+        return rows, None
+
+    def _count(self, event: str) -> None:
+        with self._lock:
+            self.events[event] += 1
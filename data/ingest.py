@@ -0,0 +1,182 @@
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+# Целочисленные колонки, которые можно безопасно расширить до DOUBLE,
+# если в следующем чанке пришли дробные значения или NaN
+_INTEGER_TYPES = {'TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT'}
+_WIDEN_TO_DOUBLE = _INTEGER_TYPES | {'FLOAT'}
+_NUMERIC_TYPES = _WIDEN_TO_DOUBLE | {'DOUBLE'}
+
+
+def iter_json_array(path: str, buffer_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Итерирует элементы JSON массива верхнего уровня, не загружая файл целиком.
+
+    Держит в памяти только текущий буфер и одну разбираемую запись.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        started = False
+
+        while True:
+            # пропускаем пробелы и разделители, подчитывая файл по необходимости
+            while True:
+                while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+                    pos += 1
+                if pos < len(buf):
+                    break
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    raise ValueError(f"Unexpected end of JSON array in {path}")
+                buf, pos = chunk, 0
+
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f"{path} is not a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            yield obj
+            pos = end
+
+
+def iter_record_chunks(path: str, chunk_size: int) -> Iterator[List[Any]]:
+    """Группирует записи из iter_json_array в списки по chunk_size штук."""
+    chunk = []
+    for record in iter_json_array(path):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _table_columns(con, table_name: str) -> Dict[str, str]:
+    rows = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = 'main' AND table_name = ? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    return dict(rows)
+
+
+def _widened_type(table_type: str, chunk_type: str) -> Optional[str]:
+    """
+    Тип, до которого нужно расширить колонку таблицы под значения чанка, или None.
+
+    Числа расширяются до DOUBLE, любое другое расхождение — до VARCHAR: так же
+    pandas сводит колонку со смешанными значениями ("100" и "100k") при загрузке
+    файла целиком, и потоковая сборка даёт ту же схему.
+    """
+    if table_type == chunk_type or table_type == 'VARCHAR':
+        return None
+    if table_type.startswith('ENUM('):
+        # новые значения ENUM-колонок добавляет data.layout.widen_enums
+        return None
+    if table_type in _NUMERIC_TYPES and chunk_type in _NUMERIC_TYPES:
+        return 'DOUBLE' if table_type in _WIDEN_TO_DOUBLE and chunk_type == 'DOUBLE' else None
+    return 'VARCHAR'
+
+
+def _align_columns(con, table_name: str, chunk_types: Dict[str, str], filled: List[str]) -> None:
+    """Добавляет в таблицу колонки чанка, которых в ней нет, и расширяет типы колонок (_widened_type)."""
+    table_columns = _table_columns(con, table_name)
+    for column in filled:
+        chunk_type = chunk_types[column]
+        table_type = table_columns.get(column)
+        if table_type is None:
+            con.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {chunk_type}')
+            continue
+        widened = _widened_type(table_type, chunk_type)
+        if widened is not None:
+            con.execute(f'ALTER TABLE "{table_name}" ALTER COLUMN "{column}" TYPE {widened}')
+
+
+def prepare_columns(con, table_name: str, frame: pd.DataFrame) -> None:
+    """
+    Подгоняет схему существующей таблицы под DataFrame без вставки строк.
+
+    apply_delta вызывает её для всех чанков дельты до любых DELETE/INSERT: DuckDB
+    не даёт закоммитить транзакцию, в которой таблицу меняли ALTER после DML.
+    """
+    if frame.empty or not _table_columns(con, table_name):
+        return
+    con.register('_chunk', frame)
+    try:
+        chunk_types = dict(
+            (row[0], row[1]) for row in con.execute("DESCRIBE SELECT * FROM _chunk").fetchall()
+        )
+    finally:
+        con.unregister('_chunk')
+    _align_columns(con, table_name, chunk_types, [c for c in frame.columns if frame[c].notna().any()])
+
+
+def append_frame(con, table_name: str, frame: pd.DataFrame, null_columns: Dict[str, str]) -> None:
+    """
+    Дописывает DataFrame в таблицу DuckDB, создавая её и недостающие колонки на лету.
+
+    Колонки, полностью пустые в текущем чанке, не участвуют в выводе типов —
+    их тип берётся из первого чанка, где они заполнены. Такие колонки
+    запоминаются в null_columns, чтобы finalize_tables досоздал их в конце.
+
+    :param null_columns: Накопитель {колонка: тип} для колонок, пустых во всех чанках
+    """
+    if frame.empty:
+        return
+
+    con.register('_chunk', frame)
+    try:
+        chunk_types = dict(
+            (row[0], row[1]) for row in con.execute("DESCRIBE SELECT * FROM _chunk").fetchall()
+        )
+        filled = [c for c in frame.columns if frame[c].notna().any()]
+        for column in frame.columns:
+            if column not in filled:
+                null_columns.setdefault(column, chunk_types[column])
+
+        select_list = ', '.join(f'"{c}"' for c in filled)
+
+        if not _table_columns(con, table_name):
+            con.execute(f'CREATE TABLE "{table_name}" AS SELECT {select_list} FROM _chunk')
+            return
+
+        _align_columns(con, table_name, chunk_types, filled)
+        con.execute(f'INSERT INTO "{table_name}" BY NAME SELECT {select_list} FROM _chunk')
+    finally:
+        con.unregister('_chunk')
+
+
+def finalize_tables(con, table_columns: Dict[str, Dict[str, str]], null_columns: Dict[str, Dict[str, str]]) -> None:
+    """
+    Досоздаёт таблицы и колонки, которые ни разу не получили данных при потоковой загрузке.
+
+    :param table_columns: {таблица: {колонка: тип}} — минимальная схема для пустых таблиц
+    :param null_columns: {таблица: {колонка: тип}} колонок, пустых во всех чанках
+    """
+    for table_name, columns in table_columns.items():
+        existing = _table_columns(con, table_name)
+        if not existing:
+            ddl = ', '.join(f'"{c}" {column_type}' for c, column_type in columns.items())
+            con.execute(f'CREATE TABLE "{table_name}" ({ddl})')
+            existing = _table_columns(con, table_name)
+        for column, column_type in null_columns.get(table_name, {}).items():
+            if column not in existing:
+                con.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {column_type}')
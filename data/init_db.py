@@ -1,13 +1,23 @@
 import logging
+from typing import Optional
+
 from data.db import get_db_con
 
 log = logging.getLogger(__name__)
 
 
-def init_db(data_path: str = "data/vacancies.json"):
-    log.info("📦 Loading data into in-memory DuckDB")
+def init_db(
+    data_path: str = "data/vacancies.json",
+    snapshot_path: Optional[str] = None,
+    rebuild: bool = False,
+    chunk_size: Optional[int] = None,
+    read_only: bool = False,
+):
+    log.info("📦 Loading data into DuckDB snapshot")
 
-    con = get_db_con(data_path)
+    con = get_db_con(
+        data_path, snapshot_path=snapshot_path, rebuild=rebuild, chunk_size=chunk_size, read_only=read_only
+    )
 
     tables = con.execute("SHOW TABLES").fetchall()
     log.info("📊 Tables loaded: %s", [t[0] for t in tables])
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import yaml
+
+log = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.yaml')
+
+# ENUM получают только колонки с enum в схеме. city/country, навыки и специализации
+# остаются VARCHAR: их фильтруют по литералам (city = 'Москва', ILIKE), а сравнение
+# ENUM со строкой DuckDB выполняет через CAST каждой строки в VARCHAR.
+# Больше MAX_ENUM_VALUES значений — колонка тоже остаётся VARCHAR (это уже не словарь, а свободный текст)
+MAX_ENUM_VALUES = 1_000
+
+# Порядок строк: Vacancies по дате публикации (отсечение по зонмапам при фильтре по дате),
+# дочерние таблицы по vacancy_id: строки одной вакансии лежат рядом, и выборка по
+# vacancy_id читает одну группу строк по зонмапам — ART-индексы DuckDB для таких
+# запросов планировщик не выбирает, а файл они увеличивают в разы
+SORT_KEYS = {'Vacancies': ['published_at', 'vacancy_id']}
+DEFAULT_SORT_KEY = ['vacancy_id']
+
+
+def enum_columns(schema_path: str = SCHEMA_PATH) -> Dict[str, Dict[str, List[str]]]:
+    """{таблица: {колонка: объявленные значения}} для строковых enum из схемы."""
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        schema = yaml.safe_load(f)
+
+    result: Dict[str, Dict[str, List[str]]] = {}
+    for table in schema['tables']:
+        if table.get('rollup_of'):
+            continue
+        columns = {
+            column: [str(v) for v in spec['enum']]
+            for column, spec in table['columns'].items()
+            if spec.get('type') == 'string' and spec.get('enum')
+        }
+        if columns:
+            result[table['table']] = columns
+    return result
+
+
+def _enum_type_name(table: str, column: str, values: List[str]) -> str:
+    # имя зависит от значений: расширенный тип создаётся рядом со старым, а не поверх него
+    digest = hashlib.sha1('\x00'.join(values).encode('utf-8')).hexdigest()[:8]
+    return f'enum_{table}_{column}_{digest}'.lower()
+
+
+def _create_enum(con, table: str, column: str, values: List[str]) -> str:
+    name = _enum_type_name(table, column, values)
+    literals = ', '.join("'" + v.replace("'", "''") + "'" for v in values)
+    con.execute(f'CREATE TYPE "{name}" AS ENUM ({literals})')
+    return name
+
+
+def _drop_stale_enums(con, table: str, column: str, keep: str) -> None:
+    prefix = f'enum_{table}_{column}_'.lower()
+    for (name,) in con.execute(
+        "SELECT type_name FROM duckdb_types() WHERE logical_type = 'ENUM' AND starts_with(type_name, ?)",
+        [prefix],
+    ).fetchall():
+        if name != keep:
+            con.execute(f'DROP TYPE "{name}"')
+
+
+def _table_types(con, table: str, catalog: Optional[str] = None) -> Dict[str, str]:
+    return dict(con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_catalog = coalesce(?, current_database()) AND table_schema = 'main' AND table_name = ? "
+        "ORDER BY ordinal_position",
+        [catalog, table],
+    ).fetchall())
+
+
+def optimize_layout(
+    con,
+    schema_path: str = SCHEMA_PATH,
+    tables: Optional[Iterable[str]] = None,
+    source: Optional[str] = None,
+) -> Dict[str, List[str]]:
+    """
+    Переписывает загруженные таблицы в физически удобный для запросов вид.
+
+    - строковые колонки с enum из схемы становятся ENUM:
+      значения — объявленные в схеме плюс реально встреченные, отсортированные
+      по байтам, поэтому ORDER BY / MIN / MAX дают тот же результат, что и на VARCHAR;
+    - строки сортируются по SORT_KEYS, что даёт компактные зонмапы для фильтров
+      по дате и по vacancy_id.
+
+    :param tables: Какие таблицы обрабатывать (по умолчанию все таблицы базы)
+    :param source: Каталог (ATTACH) с исходными таблицами: таблицы создаются в текущей
+        базе сразу в итоговом виде. Без source таблицы переписываются на месте, и место
+        исходных остаётся в файле свободными блоками.
+    :return: {таблица: колонки, ставшие ENUM}
+    """
+    declared = enum_columns(schema_path)
+    existing = {row[0] for row in con.execute(
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_catalog = coalesce(?, current_database()) AND table_schema = 'main'",
+        [source],
+    ).fetchall()}
+
+    converted = {}
+    for table in tables or sorted(existing, key=lambda t: (t != 'Vacancies', t)):
+        if table not in existing:
+            continue
+        types = _table_types(con, table, source)
+        relation = f'{source}."{table}"' if source else f'"{table}"'
+        replace, enums = [], []
+        for column, values in declared.get(table, {}).items():
+            if types.get(column) != 'VARCHAR':
+                continue
+            observed = [row[0] for row in con.execute(
+                f'SELECT DISTINCT "{column}" FROM {relation} WHERE "{column}" IS NOT NULL'
+            ).fetchall()]
+            # sorted() по кодовым точкам совпадает с побайтовым сравнением UTF-8 строк в DuckDB
+            all_values = sorted(set(values) | set(observed))
+            if len(all_values) > MAX_ENUM_VALUES:
+                log.info("%s.%s has %d distinct values, kept as VARCHAR", table, column, len(all_values))
+                continue
+            type_name = _create_enum(con, table, column, all_values)
+            replace.append(f'CAST("{column}" AS "{type_name}") AS "{column}"')
+            enums.append(column)
+
+        sort_key = [c for c in SORT_KEYS.get(table, DEFAULT_SORT_KEY) if c in types]
+        select = 'SELECT *' + (f' REPLACE ({", ".join(replace)})' if replace else '')
+        order = ' ORDER BY ' + ', '.join(f'"{c}"' for c in sort_key) if sort_key else ''
+        if source:
+            con.execute(f'CREATE TABLE "{table}" AS {select} FROM {relation}{order}')
+        else:
+            con.execute(f'CREATE TABLE "_{table}_layout" AS {select} FROM {relation}{order}')
+            con.execute(f'DROP TABLE "{table}"')
+            con.execute(f'ALTER TABLE "_{table}_layout" RENAME TO "{table}"')
+        converted[table] = enums
+    return converted
+
+
+def widen_enums(con, frames: Iterable[Tuple[str, pd.DataFrame]]) -> Dict[str, List[str]]:
+    """
+    Добавляет в ENUM-колонки значения, которых ещё нет в типе.
+
+    Вызывается из apply_delta до изменения строк: без этого вставка нового значения
+    (например, уровня позиции) упала бы с ошибкой приведения к ENUM. DuckDB не меняет тип
+    колонки после DML над той же таблицей в транзакции, поэтому сначала собираются
+    значения из всех чанков дельты, а затем каждая колонка один раз переводится на
+    расширенный тип.
+
+    :param frames: Пары (таблица, DataFrame) — нормализованные чанки дельты
+    :return: {таблица: колонки, тип которых был расширен}
+    """
+    enum_types: Dict[str, Dict[str, str]] = {}
+    incoming: Dict[str, Dict[str, set]] = {}
+    for table, frame in frames:
+        if table not in enum_types:
+            enum_types[table] = {c: t for c, t in _table_types(con, table).items() if t.startswith('ENUM(')}
+        for column in enum_types[table]:
+            if column in frame.columns:
+                incoming.setdefault(table, {}).setdefault(column, set()).update(frame[column].dropna().astype(str))
+
+    widened: Dict[str, List[str]] = {}
+    for table, columns in incoming.items():
+        for column, values in columns.items():
+            current = con.execute(f'SELECT enum_range(ANY_VALUE("{column}")) FROM "{table}"').fetchone()[0]
+            new = values - set(current)
+            if not new:
+                continue
+
+            type_name = _create_enum(con, table, column, sorted(set(current) | new))
+            con.execute(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE "{type_name}"')
+            _drop_stale_enums(con, table, column, keep=type_name)
+            log.info("%s.%s enum widened with %s", table, column, sorted(new))
+            widened.setdefault(table, []).append(column)
+    return widened
@@ -0,0 +1,115 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
+
+import duckdb
+
+
+class ConnectionPool:
+    """
+    Пул курсоров DuckDB над одной базой (файл снапшота или :memory:).
+
+    Курсор DuckDB — отдельное соединение к той же базе: запросы на разных курсорах
+    выполняются параллельно (GIL отпускается на время запроса), а данные и буферный
+    кэш общие. Одно соединение из нескольких потоков использовать нельзя, поэтому
+    каждый поток берёт курсор через checkout() / connection() и возвращает его.
+
+    threads и memory_limit в DuckDB — настройки всего экземпляра базы, а не курсора:
+    пул выставляет их один раз при создании. Для N воркеров обычно нужно
+    threads ≈ ядра / N, чтобы параллельные запросы не делили одни и те же ядра.
+    """
+
+    def __init__(
+        self,
+        database: Union[str, duckdb.DuckDBPyConnection] = ':memory:',
+        size: int = 4,
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None,
+        read_only: bool = False,
+    ):
+        """
+        Args:
+            database: Путь к файлу базы или уже открытое соединение (пул его не закрывает)
+            size: Число курсоров в пуле (= максимум одновременных запросов)
+            threads: SET threads для базы (None — не трогать)
+            memory_limit: SET memory_limit для базы (None — не трогать)
+            read_only: Открыть файл только на чтение (только если database — путь)
+        """
+        if isinstance(database, str):
+            self._root = duckdb.connect(database, read_only=read_only)
+            self._owns_root = True
+        else:
+            self._root = database
+            self._owns_root = False
+
+        if threads is not None:
+            self._root.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            self._root.execute(f"SET memory_limit = '{memory_limit}'")
+
+        self.size = size
+        self._idle: "queue.LifoQueue[duckdb.DuckDBPyConnection]" = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._root.cursor())
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"checkouts": 0, "waits": 0}
+
+    @property
+    def root(self) -> duckdb.DuckDBPyConnection:
+        """Исходное соединение — для служебных операций (apply_delta, пересборка витрин)."""
+        return self._root
+
+    def checkout(self, timeout: Optional[float] = None) -> duckdb.DuckDBPyConnection:
+        """
+        Свободный курсор; если все заняты — ждём до timeout секунд.
+
+        Raises:
+            TimeoutError: свободный курсор не появился за timeout
+        """
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        try:
+            cursor = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._stats["waits"] += 1
+            try:
+                cursor = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no free DuckDB cursor in {timeout} s (pool size {self.size})")
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return cursor
+
+    def checkin(self, cursor: duckdb.DuckDBPyConnection) -> None:
+        if self._closed:
+            cursor.close()
+            return
+        self._idle.put(cursor)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[duckdb.DuckDBPyConnection]:
+        """with pool.connection() as con: ... — курсор возвращается в пул и при исключении."""
+        cursor = self.checkout(timeout)
+        try:
+            yield cursor
+        finally:
+            self.checkin(cursor)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": self.size, "idle": self._idle.qsize(), **self._stats}
+
+    def close(self) -> None:
+        """Закрывает свободные курсоры; занятые закроются при возврате."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._owns_root:
+            self._root.close()
@@ -0,0 +1,136 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+# Строки в кавычках, комментарии, пробелы и всё остальное — в порядке приоритета
+_SQL_TOKEN = re.compile(
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<ident>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<line_comment>--[^\n]*)"
+    r"|(?P<block_comment>/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>[^'\"\s/-]+|[/-])",
+    re.DOTALL,
+)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Приводит SQL к каноническому виду для ключа кэша.
+
+    Убирает комментарии и лишние пробелы, переводит в нижний регистр всё
+    вне кавычек (идентификаторы DuckDB регистронезависимы) и отбрасывает
+    завершающую точку с запятой. Литералы и идентификаторы в кавычках не трогаются.
+    """
+    parts = []
+    for m in _SQL_TOKEN.finditer(sql):
+        kind = m.lastgroup
+        if kind in ('line_comment', 'block_comment', 'space'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        elif kind == 'other':
+            parts.append(m.group().lower())
+        else:
+            parts.append(m.group())
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def _compact(frame: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, object]]:
+    """Строковые колонки с повторами хранятся как категории (коды + словарь)."""
+    compact = frame.copy()
+    dtypes = {}
+    for column in frame.columns:
+        series = frame[column]
+        is_text = series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+        if not is_text or not len(series):
+            continue
+        try:
+            repeated = series.nunique(dropna=True) <= len(series) // 2
+        except TypeError:
+            # LIST/STRUCT колонки приходят массивами и словарями — их не сжать в категории
+            continue
+        if repeated:
+            dtypes[column] = series.dtype
+            compact[column] = series.astype('category')
+    return compact, dtypes
+
+
+def _restore(compact: pd.DataFrame, dtypes: Dict[str, object]) -> pd.DataFrame:
+    frame = compact.copy()
+    for column, dtype in dtypes.items():
+        frame[column] = frame[column].astype(dtype)
+    return frame
+
+
+class ResultCache:
+    """
+    LRU кэш результатов запросов с ограничением по суммарному размеру в байтах.
+
+    Ключ — (канонический SQL, версия данных), поэтому перезагрузка базы или
+    применённая дельта сами делают старые записи недостижимыми; clear()
+    освобождает память сразу.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_entry_bytes: Optional[int] = None):
+        """
+        Args:
+            max_bytes: Лимит суммарного размера закэшированных результатов
+            max_entry_bytes: Результаты больше этого размера не кэшируются (по умолчанию max_bytes // 4)
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[pd.DataFrame, Dict[str, object], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sql: str, version: str) -> Optional[pd.DataFrame]:
+        key = (canonicalize_sql(sql), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _restore(entry[0], entry[1])
+
+    def put(self, sql: str, version: str, frame: pd.DataFrame) -> None:
+        try:
+            compact, dtypes = _compact(frame)
+        except (TypeError, ValueError):
+            # кэш — оптимизация: результат, который не удалось сжать, хранится как есть
+            compact, dtypes = frame.copy(), {}
+        nbytes = int(compact.memory_usage(deep=True, index=True).sum())
+        if nbytes > self.max_entry_bytes:
+            return
+
+        key = (canonicalize_sql(sql), version)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self._entries[key] = (compact, dtypes, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
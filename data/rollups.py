@@ -0,0 +1,144 @@
+import logging
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Витрина -> (колонка-измерение, выражение, источник строк). Имя колонки совпадает
+# с исходной, чтобы запросы к витрине выглядели так же, как к Vacancies/Skills.
+# Измерения хранятся как VARCHAR: витрина не зависит от ENUM-типов базовых таблиц,
+# которые apply_delta может расширять (data/layout.py).
+ROLLUPS = {
+    'rollup_by_city': ('city', 'v.city', 'Vacancies v'),
+    'rollup_by_position_level': ('position_level', 'v.position_level', 'Vacancies v'),
+    'rollup_by_specialization': ('specialization', 'v.specialization', 'Vacancies v'),
+    'rollup_by_company': ('company_name', 'v.company_name', 'Vacancies v'),
+    # пары (vacancy_id, skill) уникальны, иначе средние считались бы с весами
+    'rollup_by_skill': (
+        'skill', 's.skill',
+        'Vacancies v JOIN (SELECT DISTINCT vacancy_id, skill FROM Skills) s ON s.vacancy_id = v.vacancy_id',
+    ),
+}
+
+# Колонки Vacancies, без которых витрины не собрать
+_REQUIRED = {'vacancy_id', 'is_active', 'salary_display_from', 'salary_display_to', 'salary_currency'}
+
+_ROLLUP_SELECT = """
+SELECT
+    CAST({expr} AS VARCHAR) AS {column},
+    CAST(v.salary_currency AS VARCHAR) AS salary_currency,
+    COUNT(DISTINCT v.vacancy_id) AS vacancies_count,
+    COUNT(DISTINCT v.vacancy_id) FILTER (WHERE TRY_CAST(v.is_active AS BOOLEAN)) AS active_vacancies_count,
+    COUNT(TRY_CAST(v.salary_display_from AS DOUBLE)) AS salary_from_count,
+    AVG(TRY_CAST(v.salary_display_from AS DOUBLE)) AS avg_salary_from,
+    MEDIAN(TRY_CAST(v.salary_display_from AS DOUBLE)) AS median_salary_from,
+    COUNT(TRY_CAST(v.salary_display_to AS DOUBLE)) AS salary_to_count,
+    AVG(TRY_CAST(v.salary_display_to AS DOUBLE)) AS avg_salary_to,
+    MEDIAN(TRY_CAST(v.salary_display_to AS DOUBLE)) AS median_salary_to
+FROM {source}
+{where}
+GROUP BY ALL
+"""
+
+_ROLLUP_SQL = 'CREATE OR REPLACE TABLE "{name}" AS' + _ROLLUP_SELECT + 'ORDER BY vacancies_count DESC'
+
+# Строка витрины (или значение измерения) входит в группы из _rollup_keys; NULL — тоже группа
+_IN_GROUPS = "EXISTS (SELECT 1 FROM _rollup_keys k WHERE CAST(k.key AS VARCHAR) IS NOT DISTINCT FROM {value})"
+
+
+def _columns(con, table: str) -> set:
+    return {row[0] for row in con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'main' AND table_name = ?",
+        [table],
+    ).fetchall()}
+
+
+def _applicable(con, names: Optional[List[str]] = None) -> List[str]:
+    """Витрины из names (по умолчанию все), для которых в базе есть нужные колонки."""
+    vacancy_columns = _columns(con, 'Vacancies')
+    missing = _REQUIRED - vacancy_columns
+    if missing:
+        log.warning("⚠️ Rollups skipped, Vacancies has no columns %s", sorted(missing))
+        return []
+
+    result = []
+    for name in names or ROLLUPS:
+        column, expr, source = ROLLUPS[name]
+        if source == 'Vacancies v' and column not in vacancy_columns:
+            continue
+        if 'Skills' in source and column not in _columns(con, 'Skills'):
+            continue
+        result.append(name)
+    return result
+
+
+def build_rollups(con, names: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    (Пере)собирает витрины агрегатов по Vacancies: число вакансий и средние/медианные
+    зарплаты в разрезе измерения и валюты.
+
+    Вызывается при сборке снапшота; apply_delta пересчитывает только затронутые
+    группы (update_rollups).
+
+    :return: {витрина: число строк}
+    """
+    sizes = {}
+    for name in _applicable(con, names):
+        column, expr, source = ROLLUPS[name]
+        con.execute(_ROLLUP_SQL.format(name=name, column=column, expr=expr, source=source, where=''))
+        sizes[name] = con.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+    return sizes
+
+
+def rollup_groups(con, vacancy_ids: str) -> Dict[str, Set[Optional[str]]]:
+    """
+    Группы витрин (значения измерения), в которые сейчас входят вакансии.
+
+    apply_delta вызывает её до удаления строк дельты и после вставки новых:
+    объединение — все группы, чьи агрегаты дельта могла изменить.
+
+    :param vacancy_ids: Таблица или зарегистрированный DataFrame с колонкой vacancy_id
+    """
+    groups = {}
+    for name in _applicable(con):
+        column, expr, source = ROLLUPS[name]
+        groups[name] = {row[0] for row in con.execute(
+            f"SELECT DISTINCT CAST({expr} AS VARCHAR) FROM {source} "
+            f"WHERE v.vacancy_id IN (SELECT vacancy_id FROM {vacancy_ids})"
+        ).fetchall()}
+    return groups
+
+
+def update_rollups(con, groups: Dict[str, Set[Optional[str]]]) -> Dict[str, int]:
+    """
+    Пересчитывает в витринах только группы из rollup_groups.
+
+    Медианы не складываются из частей, поэтому группа считается заново по всем
+    своим строкам, но остальные группы не трогаются: дельта с парой городов
+    пересчитывает две строки rollup_by_city, а не всю витрину. Витрина, которой
+    ещё нет в базе, собирается целиком.
+
+    :return: {витрина: число пересчитанных групп}
+    """
+    changed = [name for name, keys in groups.items() if keys]
+    if not changed:
+        return {}
+
+    updated = {}
+    for name in _applicable(con, changed):
+        column, expr, source = ROLLUPS[name]
+        if not _columns(con, name):
+            build_rollups(con, [name])
+            continue
+
+        keys = pd.DataFrame({'key': list(groups[name])}, dtype=object)
+        con.register('_rollup_keys', keys)
+        try:
+            con.execute(f'DELETE FROM "{name}" WHERE ' + _IN_GROUPS.format(value=f'"{column}"'))
+            where = 'WHERE ' + _IN_GROUPS.format(value=f'CAST({expr} AS VARCHAR)')
+            con.execute(f'INSERT INTO "{name}"' + _ROLLUP_SELECT.format(column=column, expr=expr, source=source, where=where))
+        finally:
+            con.unregister('_rollup_keys')
+        updated[name] = len(keys)
+    return updated
@@ -0,0 +1,227 @@
+import logging
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Служебные таблицы индекса живут в отдельной схеме, как метаданные снапшота
+FTS_SCHEMA = 'fts'
+
+# Текстовые поля вакансии и их вес в частоте терма: совпадение в названии
+# должности значит больше, чем упоминание в длинном описании
+FIELDS = {
+    'position': 3,
+    'stack_description': 2,
+    'short_description': 1,
+    'description': 1,
+}
+
+# Грубый стемминг префиксом (как в app/schema_selection.py): "разработчика" и
+# "разработчик", "postgres" и "postgresql" дают один терм; одинаково для русского и английского
+STEM_LEN = 5
+
+# Слова, числа и названия вроде c++ / c# / 1с; ё приводится к е до разбора
+TOKEN_PATTERN = r"[a-zа-я0-9]+[+#]*"
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _terms_sql(text: str) -> str:
+    """SQL-выражение: список термов текста (тот же разбор при индексации и в запросе)."""
+    return (
+        f"list_transform(regexp_extract_all(replace(lower({text}), 'ё', 'е'), '{TOKEN_PATTERN}'), "
+        f"tok -> left(tok, {STEM_LEN}))"
+    )
+
+
+def _strip_html(expr: str) -> str:
+    return f"regexp_replace(CAST({expr} AS VARCHAR), '<[^>]+>', ' ', 'g')"
+
+
+def _fields(con) -> Dict[str, int]:
+    columns = {row[0] for row in con.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = 'Vacancies'"
+    ).fetchall()}
+    return {column: weight for column, weight in FIELDS.items() if column in columns}
+
+
+def _postings_sql(fields: Dict[str, int], where: str = '') -> str:
+    """(term, vacancy_id, tf) для вакансий, проходящих where; tf — с весами полей."""
+    parts = [
+        f"SELECT vacancy_id, {weight} AS weight, {_terms_sql(_strip_html(column))} AS terms "
+        f"FROM Vacancies WHERE {column} IS NOT NULL {where}"
+        for column, weight in fields.items()
+    ]
+    return f"""
+        SELECT term, vacancy_id, SUM(weight)::INTEGER AS tf
+        FROM (SELECT vacancy_id, weight, unnest(terms) AS term FROM ({' UNION ALL '.join(parts)}))
+        GROUP BY ALL
+    """
+
+
+def _create_macros(con) -> None:
+    # Макросы хранятся в снапшоте и доступны генератору SQL с любого соединения, в том числе read-only
+    con.execute(f"""
+        CREATE OR REPLACE MACRO search_vacancies(query) AS TABLE
+        WITH q AS (SELECT DISTINCT unnest({_terms_sql('query')}) AS term),
+        stats AS (SELECT n_docs, avg_len FROM {FTS_SCHEMA}.stats)
+        SELECT
+            p.vacancy_id,
+            SUM(
+                ln(1 + (stats.n_docs - t.df + 0.5) / (t.df + 0.5))
+                * p.tf * ({BM25_K1} + 1)
+                / (p.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * d.len / stats.avg_len))
+            ) AS score,
+            COUNT(*) AS matched_terms,
+            (SELECT COUNT(*) FROM q) AS query_terms
+        FROM q
+        JOIN {FTS_SCHEMA}.terms t USING (term)
+        JOIN {FTS_SCHEMA}.postings p USING (term)
+        JOIN {FTS_SCHEMA}.docs d ON d.vacancy_id = p.vacancy_id
+        CROSS JOIN stats
+        GROUP BY p.vacancy_id
+        ORDER BY score DESC, p.vacancy_id
+    """)
+    con.execute("""
+        CREATE OR REPLACE MACRO match_vacancies(query) AS TABLE
+        SELECT vacancy_id FROM search_vacancies(query) WHERE matched_terms = query_terms
+    """)
+
+
+def _refresh_stats(con, terms: Optional[str] = None) -> None:
+    """Пересчитывает df термов (всех или из подзапроса terms) и общую статистику коллекции."""
+    where = f"WHERE term IN ({terms})" if terms else ''
+    if terms:
+        con.execute(f"DELETE FROM {FTS_SCHEMA}.terms {where}")
+    con.execute(f"""
+        INSERT INTO {FTS_SCHEMA}.terms
+        SELECT term, COUNT(*) AS df FROM {FTS_SCHEMA}.postings {where} GROUP BY term
+    """)
+    con.execute(f"DELETE FROM {FTS_SCHEMA}.stats")
+    con.execute(f"""
+        INSERT INTO {FTS_SCHEMA}.stats
+        SELECT COUNT(*), coalesce(AVG(len), 1) FROM {FTS_SCHEMA}.docs
+    """)
+
+
+def build_search_index(con) -> int:
+    """
+    Строит полнотекстовый индекс по текстовым полям Vacancies (FIELDS) и SQL-макросы поиска.
+
+    Индекс — обычные таблицы DuckDB в схеме fts:
+    - postings(term, vacancy_id, tf): отсортированы по терму, поэтому поиск читает
+      только группы строк нужных термов (зонмапы), а не весь текст;
+    - terms(term, df), docs(vacancy_id, len), stats(n_docs, avg_len) — для BM25.
+
+    Макросы для запросов (описаны в промпте генератора):
+    - search_vacancies('python django') — (vacancy_id, score, matched_terms, query_terms),
+      ранжирование BM25, достаточно совпадения любого слова;
+    - match_vacancies('python django') — vacancy_id, где встречаются все слова.
+
+    :return: Число записей в postings
+    """
+    fields = _fields(con)
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {FTS_SCHEMA}")
+    for table in ('postings', 'terms', 'docs', 'stats'):
+        con.execute(f"DROP TABLE IF EXISTS {FTS_SCHEMA}.{table}")
+
+    if fields:
+        con.execute(f"CREATE TABLE {FTS_SCHEMA}.postings AS {_postings_sql(fields)} ORDER BY term, vacancy_id")
+    else:
+        log.warning("⚠️ Vacancies has no text columns %s, search index is empty", sorted(FIELDS))
+        con.execute(f"CREATE TABLE {FTS_SCHEMA}.postings (term VARCHAR, vacancy_id BIGINT, tf INTEGER)")
+    con.execute(f"""
+        CREATE TABLE {FTS_SCHEMA}.docs AS
+        SELECT vacancy_id, SUM(tf)::INTEGER AS len FROM {FTS_SCHEMA}.postings GROUP BY vacancy_id
+    """)
+    con.execute(f"CREATE TABLE {FTS_SCHEMA}.terms (term VARCHAR, df BIGINT)")
+    con.execute(f"CREATE TABLE {FTS_SCHEMA}.stats (n_docs BIGINT, avg_len DOUBLE)")
+    _refresh_stats(con)
+    _create_macros(con)
+    return con.execute(f"SELECT COUNT(*) FROM {FTS_SCHEMA}.postings").fetchone()[0]
+
+
+def update_search_index(con, vacancy_ids: Iterable[int]) -> None:
+    """
+    Переиндексирует вакансии после apply_delta: удаляет их postings и строит заново
+    по текущим строкам Vacancies (удалённых вакансий там уже нет).
+
+    df пересчитывается только для затронутых термов, поэтому стоимость
+    пропорциональна дельте, а не коллекции.
+    """
+    touched = pd.DataFrame({'vacancy_id': list(vacancy_ids)})
+    if touched.empty:
+        return
+    con.register('_fts_touched', touched)
+    try:
+        ids = "(SELECT vacancy_id FROM _fts_touched)"
+        affected = f"SELECT DISTINCT term FROM {FTS_SCHEMA}.postings WHERE vacancy_id IN {ids}"
+        con.execute(f"CREATE TEMP TABLE _fts_affected AS {affected}")
+
+        con.execute(f"DELETE FROM {FTS_SCHEMA}.postings WHERE vacancy_id IN {ids}")
+        con.execute(f"DELETE FROM {FTS_SCHEMA}.docs WHERE vacancy_id IN {ids}")
+        fields = _fields(con)
+        if fields:
+            con.execute(f"""
+                INSERT INTO {FTS_SCHEMA}.postings
+                {_postings_sql(fields, where=f'AND vacancy_id IN {ids}')}
+            """)
+        con.execute(f"""
+            INSERT INTO {FTS_SCHEMA}.docs
+            SELECT vacancy_id, SUM(tf)::INTEGER FROM {FTS_SCHEMA}.postings
+            WHERE vacancy_id IN {ids} GROUP BY vacancy_id
+        """)
+        con.execute(f"INSERT INTO _fts_affected {affected}")
+        _refresh_stats(con, terms="SELECT term FROM _fts_affected")
+        con.execute("DROP TABLE _fts_affected")
+    finally:
+        con.unregister('_fts_touched')
+
+
+def has_search_index(con) -> bool:
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_functions() WHERE function_name = 'search_vacancies'"
+    ).fetchone()[0] > 0
+
+
+def search_vacancies(con, query: str, limit: int = 20, match_all: bool = False) -> pd.DataFrame:
+    """
+    Поиск вакансий по ключевым словам с ранжированием BM25.
+
+    Без индекса в базе (соединение не к снапшоту) откатывается на ILIKE по тем же
+    полям: полный просмотр текста, а вместо BM25 — число совпавших слов.
+
+    :param match_all: Только вакансии, где встречаются все слова запроса
+    :return: DataFrame (vacancy_id, position, score), лучшие сначала
+    """
+    if has_search_index(con):
+        condition = "WHERE s.matched_terms = s.query_terms" if match_all else ''
+        return con.execute(f"""
+            SELECT s.vacancy_id, v.position, s.score
+            FROM search_vacancies(?) s JOIN Vacancies v USING (vacancy_id)
+            {condition}
+            ORDER BY s.score DESC, s.vacancy_id
+            LIMIT {int(limit)}
+        """, [query]).df()
+
+    words = query.split()
+    fields = _fields(con)
+    if not words or not fields:
+        return pd.DataFrame({'vacancy_id': [], 'position': [], 'score': []})
+    per_word = [
+        '(' + ' OR '.join(f'{column} ILIKE ?' for column in fields) + ')'
+        for _ in words
+    ]
+    params = [f'%{w}%' for w in words for _ in fields]
+    score = ' + '.join(f'CAST({p} AS INTEGER)' for p in per_word)
+    where = (' AND ' if match_all else ' OR ').join(per_word)
+    return con.execute(f"""
+        SELECT vacancy_id, position, ({score})::DOUBLE AS score
+        FROM Vacancies WHERE {where}
+        ORDER BY score DESC, vacancy_id
+        LIMIT {int(limit)}
+    """, params + params).df()
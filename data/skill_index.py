@@ -0,0 +1,229 @@
+import logging
+import math
+from typing import Iterable, List
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Таблицы индекса живут в отдельной схеме, как метаданные снапшота и поисковый индекс
+SKILL_INDEX_SCHEMA = 'skill_index'
+
+# Запас длины битмапа под новые вакансии из дельт: пока он не исчерпан,
+# apply_delta обновляет только биты затронутых вакансий
+CAPACITY_HEADROOM = 1.25
+
+
+def _normalize_sql(expr: str) -> str:
+    """Нормализация названия навыка: регистр, ё, пробелы ("  PostgreSQL " -> "postgresql")."""
+    return f"regexp_replace(trim(replace(lower({expr}), 'ё', 'е')), '\\s+', ' ', 'g')"
+
+
+def _create_macros(con) -> None:
+    # Макросы хранятся в снапшоте и доступны генератору SQL с любого соединения
+    s = SKILL_INDEX_SCHEMA
+    con.execute(f"CREATE OR REPLACE MACRO normalize_skill(skill) AS {_normalize_sql('skill')}")
+    con.execute(f"""
+        CREATE OR REPLACE MACRO vacancies_with_skills(all_of, any_of := NULL, none_of := NULL) AS TABLE
+        WITH
+        req AS (
+            SELECT
+                list_distinct(list_transform(coalesce(all_of, []::VARCHAR[]), x -> normalize_skill(x))) AS a,
+                list_distinct(list_transform(coalesce(any_of, []::VARCHAR[]), x -> normalize_skill(x))) AS o,
+                list_distinct(list_transform(coalesce(none_of, []::VARCHAR[]), x -> normalize_skill(x))) AS n
+        ),
+        a AS (SELECT bit_and(bits) AS bits, COUNT(*) AS found FROM {s}.bitmaps, req WHERE list_contains(req.a, skill)),
+        o AS (SELECT bit_or(bits) AS bits FROM {s}.bitmaps, req WHERE list_contains(req.o, skill)),
+        n AS (SELECT bit_or(bits) AS bits FROM {s}.bitmaps, req WHERE list_contains(req.n, skill)),
+        result AS (
+            SELECT
+                m.alive
+                -- неизвестный навык в all_of даёт пустой результат, а не игнорируется
+                & CASE WHEN len(req.a) = 0 THEN m.alive WHEN a.found = len(req.a) THEN a.bits ELSE m.alive & ~m.alive END
+                & CASE WHEN len(req.o) = 0 THEN m.alive ELSE coalesce(o.bits, m.alive & ~m.alive) END
+                & ~coalesce(n.bits, m.alive & ~m.alive) AS bits
+            FROM {s}.meta m, req, a, o, n
+        )
+        SELECT v.vacancy_id FROM {s}.vacancies v, result WHERE get_bit(result.bits, v.ord) = 1
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE MACRO skill_cooccurrence(skill_name) AS TABLE
+        SELECT other_skill AS skill, vacancies_count FROM {s}.pairs
+        WHERE skill = normalize_skill(skill_name)
+        ORDER BY vacancies_count DESC, other_skill
+    """)
+
+
+def _rows_sql(where: str = '') -> str:
+    """Уникальные пары (нормализованный навык, vacancy_id, ord) для вакансий из индекса."""
+    return f"""
+        SELECT DISTINCT {_normalize_sql('s.skill')} AS skill, v.vacancy_id, v.ord
+        FROM Skills s JOIN {SKILL_INDEX_SCHEMA}.vacancies v USING (vacancy_id)
+        WHERE s.skill IS NOT NULL AND trim(s.skill) <> '' {where}
+    """
+
+
+def _bitmaps_sql(rows: str, capacity: int) -> str:
+    return f"SELECT skill, bitstring_agg(ord, 0, {capacity - 1}) AS bits FROM {rows} GROUP BY skill"
+
+
+def _pairs_sql(rows: str, sign: int = 1) -> str:
+    return f"""
+        SELECT a.skill, b.skill AS other_skill, {sign} * COUNT(*) AS vacancies_count
+        FROM {rows} a JOIN {rows} b USING (vacancy_id)
+        WHERE a.skill <> b.skill
+        GROUP BY ALL
+    """
+
+
+def build_skill_index(con) -> int:
+    """
+    Строит битмап-индекс навыков: для каждого нормализованного навыка — битовая
+    строка DuckDB (BIT), где бит ord выставлен, если навык есть у вакансии с этим
+    порядковым номером.
+
+    Таблицы в схеме skill_index:
+    - vacancies(vacancy_id, ord) — порядковые номера вакансий в битмапах;
+    - bitmaps(skill, bits) — битмапы навыков одинаковой длины (capacity);
+    - pairs(skill, other_skill, vacancies_count) — число вакансий с обоими навыками;
+    - meta(capacity, next_ord, alive) — длина битмапов, следующий свободный номер
+      и битмап живых вакансий.
+
+    AND/OR/NOT над битмапами выполняются побитово, без просмотра Skills.
+    Макросы для запросов (описаны в промпте генератора):
+    - vacancies_with_skills(['python', 'kafka'], any_of := [...], none_of := [...]) — vacancy_id;
+    - skill_cooccurrence('go') — (skill, vacancies_count): с какими навыками он встречается чаще всего.
+
+    :return: Число навыков в индексе
+    """
+    s = SKILL_INDEX_SCHEMA
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {s}")
+    for table in ('vacancies', 'bitmaps', 'pairs', 'meta'):
+        con.execute(f"DROP TABLE IF EXISTS {s}.{table}")
+
+    con.execute(f"""
+        CREATE TABLE {s}.vacancies AS
+        SELECT vacancy_id, (row_number() OVER (ORDER BY vacancy_id) - 1)::INTEGER AS ord
+        FROM (SELECT DISTINCT vacancy_id FROM Vacancies)
+    """)
+    count = con.execute(f"SELECT COUNT(*) FROM {s}.vacancies").fetchone()[0]
+    capacity = max(64, math.ceil(count * CAPACITY_HEADROOM))
+
+    con.execute(f"CREATE TEMP TABLE _skill_rows AS {_rows_sql()}")
+    con.execute(f"CREATE TABLE {s}.bitmaps AS {_bitmaps_sql('_skill_rows', capacity)} ORDER BY skill")
+    con.execute(f"CREATE TABLE {s}.pairs AS {_pairs_sql('_skill_rows')} ORDER BY skill, vacancies_count DESC")
+    con.execute("DROP TABLE _skill_rows")
+    con.execute(f"""
+        CREATE TABLE {s}.meta AS
+        SELECT {capacity} AS capacity, {count} AS next_ord,
+               coalesce(
+                   (SELECT bitstring_agg(ord, 0, {capacity - 1}) FROM {s}.vacancies),
+                   bitstring(''::VARCHAR, {capacity})
+               ) AS alive
+    """)
+    _create_macros(con)
+    return con.execute(f"SELECT COUNT(*) FROM {s}.bitmaps").fetchone()[0]
+
+
+def update_skill_index(con, vacancy_ids: Iterable[int]) -> None:
+    """
+    Обновляет индекс после apply_delta для затронутых вакансий.
+
+    Их биты снимаются во всех битмапах одной маской и выставляются заново по
+    текущим строкам Skills только этих вакансий; счётчики пар уменьшаются на
+    старые пары навыков этих вакансий и увеличиваются на новые. Новые вакансии
+    получают следующие свободные номера; если номера упираются в capacity,
+    индекс пересобирается целиком с новым запасом.
+    """
+    touched = pd.DataFrame({'vacancy_id': sorted(set(vacancy_ids))})
+    if touched.empty:
+        return
+    s = SKILL_INDEX_SCHEMA
+    con.register('_skill_touched', touched)
+    try:
+        capacity, next_ord = con.execute(f"SELECT capacity, next_ord FROM {s}.meta").fetchone()
+        ids = "(SELECT vacancy_id FROM _skill_touched)"
+        added = f"""
+            SELECT DISTINCT vacancy_id FROM Vacancies
+            WHERE vacancy_id IN {ids} AND vacancy_id NOT IN (SELECT vacancy_id FROM {s}.vacancies)
+        """
+        added_count = con.execute(f"SELECT COUNT(*) FROM ({added})").fetchone()[0]
+        if next_ord + added_count > capacity:
+            log.info("Skill index capacity %s exceeded, rebuilding", capacity)
+            build_skill_index(con)
+            return
+
+        zero = f"bitstring(''::VARCHAR, {capacity})"
+        mask = f"SELECT coalesce(bitstring_agg(ord, 0, {capacity - 1}), {zero}) AS bits FROM {s}.vacancies WHERE vacancy_id IN {ids}"
+        con.execute(f"CREATE TEMP TABLE _skill_old AS {mask}")
+        # навыки затронутых вакансий до дельты: Skills уже изменена, но биты ещё старые
+        con.execute(f"""
+            CREATE TEMP TABLE _skill_old_rows AS
+            SELECT b.skill, v.vacancy_id, v.ord FROM {s}.bitmaps b, {s}.vacancies v
+            WHERE v.vacancy_id IN {ids} AND get_bit(b.bits, v.ord) = 1
+        """)
+
+        # удалённые вакансии теряют номер, новые получают следующие
+        con.execute(f"""
+            DELETE FROM {s}.vacancies
+            WHERE vacancy_id IN {ids} AND vacancy_id NOT IN (SELECT vacancy_id FROM Vacancies)
+        """)
+        con.execute(f"""
+            INSERT INTO {s}.vacancies
+            SELECT vacancy_id, ({next_ord} + row_number() OVER (ORDER BY vacancy_id) - 1)::INTEGER FROM ({added})
+        """)
+        con.execute(f"CREATE TEMP TABLE _skill_now AS {mask}")
+        con.execute(f"CREATE TEMP TABLE _skill_rows AS {_rows_sql(f'AND s.vacancy_id IN {ids}')}")
+        con.execute(f"CREATE TEMP TABLE _skill_new AS {_bitmaps_sql('_skill_rows', capacity)}")
+
+        old = "(SELECT bits FROM _skill_old)"
+        con.execute(f"UPDATE {s}.bitmaps SET bits = bits & ~{old} WHERE bit_count(bits & {old}) > 0")
+        con.execute(f"UPDATE {s}.bitmaps b SET bits = b.bits | n.bits FROM _skill_new n WHERE b.skill = n.skill")
+        con.execute(f"INSERT INTO {s}.bitmaps SELECT * FROM _skill_new WHERE skill NOT IN (SELECT skill FROM {s}.bitmaps)")
+        con.execute(f"DELETE FROM {s}.bitmaps WHERE bit_count(bits) = 0")
+
+        con.execute(f"""
+            CREATE TEMP TABLE _skill_pairs AS
+            SELECT skill, other_skill, SUM(vacancies_count) AS vacancies_count FROM (
+                {_pairs_sql('_skill_rows')} UNION ALL {_pairs_sql('_skill_old_rows', sign=-1)}
+            )
+            GROUP BY ALL HAVING SUM(vacancies_count) <> 0
+        """)
+        con.execute(f"""
+            UPDATE {s}.pairs p SET vacancies_count = p.vacancies_count + d.vacancies_count
+            FROM _skill_pairs d WHERE p.skill = d.skill AND p.other_skill = d.other_skill
+        """)
+        con.execute(f"""
+            INSERT INTO {s}.pairs
+            SELECT d.* FROM _skill_pairs d ANTI JOIN {s}.pairs p USING (skill, other_skill)
+        """)
+        con.execute(f"DELETE FROM {s}.pairs WHERE vacancies_count <= 0")
+
+        con.execute(f"""
+            UPDATE {s}.meta SET
+                next_ord = next_ord + {added_count},
+                alive = (alive & ~{old}) | (SELECT bits FROM _skill_now)
+        """)
+        for table in ('_skill_old', '_skill_old_rows', '_skill_now', '_skill_rows', '_skill_new', '_skill_pairs'):
+            con.execute(f"DROP TABLE {table}")
+    finally:
+        con.unregister('_skill_touched')
+
+
+def vacancies_with_skills(
+    con,
+    all_of: Iterable[str] = (),
+    any_of: Iterable[str] = (),
+    none_of: Iterable[str] = (),
+) -> List[int]:
+    """vacancy_id вакансий со всеми навыками all_of, хотя бы одним из any_of и без none_of."""
+    rows = con.execute(
+        "SELECT vacancy_id FROM vacancies_with_skills(?, any_of := ?, none_of := ?) ORDER BY vacancy_id",
+        [list(all_of), list(any_of) or None, list(none_of) or None],
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def skill_cooccurrence(con, skill: str, limit: int = 20) -> pd.DataFrame:
+    """Навыки, чаще всего встречающиеся в вакансиях вместе со skill: (skill, vacancies_count)."""
+    return con.execute(f"SELECT * FROM skill_cooccurrence(?) LIMIT {int(limit)}", [skill]).df()
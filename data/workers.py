@@ -0,0 +1,63 @@
+"""
+Обслуживание запросов несколькими процессами над одним снапшотом.
+
+Снапшот собирается один раз (get_db_con / init_db), а каждый процесс пула
+открывает его read_only. Файл в page cache ОС общий, а у процесса свои только
+буферы DuckDB — сжатые колоночные блоки горячих данных, ограниченные memory_limit,
+а не полная копия таблиц в pandas.
+
+    pool = make_process_pool("data/vacancies.snapshot.duckdb", processes=4)
+    df = pool.submit(run_query, "SELECT city, COUNT(*) FROM Vacancies GROUP BY city").result()
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import duckdb
+
+from data.db import execute_query
+
+# Соединение процесса-воркера, открывается в init_worker
+_con: Optional[duckdb.DuckDBPyConnection] = None
+
+
+def init_worker(snapshot_path: str, threads: Optional[int] = 1, memory_limit: Optional[str] = None) -> None:
+    """initializer для ProcessPoolExecutor: открывает снапшот только на чтение."""
+    global _con
+    _con = duckdb.connect(snapshot_path, read_only=True)
+    if threads is not None:
+        _con.execute(f"SET threads = {int(threads)}")
+    if memory_limit is not None:
+        _con.execute(f"SET memory_limit = '{memory_limit}'")
+
+
+def worker_con() -> duckdb.DuckDBPyConnection:
+    if _con is None:
+        raise RuntimeError("worker is not initialized: use make_process_pool or init_worker")
+    return _con
+
+
+def run_query(sql: str):
+    """Выполняет SQL в процессе-воркере (с кэшем результатов этого процесса)."""
+    return execute_query(worker_con(), sql)
+
+
+def make_process_pool(
+    snapshot_path: str,
+    processes: Optional[int] = None,
+    threads_per_process: Optional[int] = 1,
+    memory_limit: Optional[str] = None,
+) -> ProcessPoolExecutor:
+    """
+    Пул процессов над готовым снапшотом.
+
+    По умолчанию процессов столько же, сколько ядер, и у каждого один поток DuckDB,
+    чтобы процессы не делили ядра между собой.
+    """
+    if not os.path.exists(snapshot_path):
+        raise FileNotFoundError(f"snapshot {snapshot_path} not found: build it with data.init_db.init_db first")
+    return ProcessPoolExecutor(
+        max_workers=processes or os.cpu_count() or 1,
+        initializer=init_worker,
+        initargs=(snapshot_path, threads_per_process, memory_limit),
+    )
@@ -0,0 +1,14 @@
+from app.entity_resolution import EntityResolver
+
+
+def test_free_text_columns_get_ilike_hints():
+    resolver = EntityResolver({
+        ('Vacancies', 'city'): [('Москва', 5)],
+        ('Vacancies', 'position'): [('Python разработчик', 3)],
+        ('Vacancies', 'company_name'): [('Яндекс', 2)],
+    })
+    hints = resolver.hints('python разработчика в мск в яндексе')
+    assert "Vacancies.city = 'Москва'" in hints
+    assert "Vacancies.position ILIKE '%Python разработчик%'" in hints
+    assert "Vacancies.company_name ILIKE '%Яндекс%'" in hints
+    assert "position =" not in hints
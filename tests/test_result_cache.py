@@ -0,0 +1,12 @@
+import numpy as np
+import pandas as pd
+
+from data.result_cache import ResultCache
+
+
+def test_list_columns_are_cached_uncompacted():
+    cache = ResultCache()
+    frame = pd.DataFrame({'vacancy_id': [1, 2], 'skills': [np.array(['java']), np.array(['go', 'sql'])]})
+    cache.put('SELECT vacancy_id, list(skill) FROM Skills GROUP BY vacancy_id', 'v1', frame)
+    cached = cache.get('select vacancy_id, list(skill) from Skills group by vacancy_id', 'v1')
+    assert list(cached['skills'][1]) == ['go', 'sql']
@@ -0,0 +1,49 @@
+from app.entity_resolution import EntityResolver
+from app.semantic_cache import SemanticSQLCache
+
+JAVA_MOSCOW = "SELECT AVG(salary_from) FROM Vacancies v JOIN Skills s USING (vacancy_id) WHERE s.skill = 'Java' AND v.city = 'Москва'"
+MOSCOW = "SELECT COUNT(*) FROM Vacancies WHERE city = 'Москва'"
+
+
+def resolver():
+    return EntityResolver({
+        ('Vacancies', 'city'): [('Москва', 100), ('Санкт-Петербург', 50)],
+        ('Skills', 'skill'): [('Java', 30), ('Python', 40)],
+    })
+
+
+def test_paraphrase_hits():
+    cache = SemanticSQLCache(threshold=0.9, entities=resolver().values)
+    cache.add("средняя зарплата java в москве", JAVA_MOSCOW)
+    assert cache.get("Средняя зарплата Java в Москве?") == JAVA_MOSCOW
+
+
+def test_negation_misses():
+    cache = SemanticSQLCache(threshold=0.9)
+    cache.add("средняя зарплата java в москве", JAVA_MOSCOW)
+    cache.add("количество вакансий в Москве", MOSCOW)
+    assert cache.get("средняя зарплата java не в москве") is None
+    assert cache.get("количество вакансий не в Москве") is None
+
+
+def test_different_filters_miss():
+    cache = SemanticSQLCache(threshold=0.9, entities=resolver().values)
+    cache.add("средняя зарплата java в москве", JAVA_MOSCOW)
+    assert cache.get("средняя зарплата в москве") is None
+    assert cache.get("средняя зарплата python в москве") is None
+
+
+def test_entities_passed_to_get():
+    cache = SemanticSQLCache(threshold=0.9)
+    cache.add("средняя зарплата java в москве", JAVA_MOSCOW)
+    assert cache.get("средняя зарплата в москве", entities=resolver().values) is None
+
+
+def test_paraphrase_hits_in_small_index():
+    # в маленьком индексе признаки, общие для пары вопросов, не считаются стоп-признаками
+    cache = SemanticSQLCache(threshold=0.9)
+    cache.add("средняя зарплата java в москве", JAVA_MOSCOW)
+    cache.add("количество вакансий в москве", MOSCOW)
+    for city in ("казани", "перми", "самаре"):
+        cache.add(f"средняя зарплата java в {city}", MOSCOW)
+    assert cache.get("зарплата средняя java в москве") == JAVA_MOSCOW
@@ -0,0 +1,34 @@
+import pytest
+
+from app.sql_validator import SQLValidator, WriteQueryError
+
+SCHEMA = {'tables': [{'table': 'Vacancies', 'columns': ['vacancy_id', 'city']}]}
+
+
+@pytest.mark.parametrize('sql', [
+    'SELECT count(*) AS set FROM Vacancies',
+    'SELECT city AS load FROM Vacancies',
+    'SELECT city use, count(*) AS call FROM Vacancies GROUP BY city',
+    'SELECT replace(city, \'а\', \'б\') AS copy FROM Vacancies v WHERE v.reset IS NULL',
+    'SELECT "update" FROM Vacancies',
+    'WITH c(x) AS (SELECT 1), d AS (SELECT 2) SELECT * FROM c, d;',
+    '(SELECT 1) UNION ALL (SELECT 2)',
+    '((SELECT city FROM Vacancies)) ORDER BY 1',
+    '(WITH c AS (SELECT 1) SELECT * FROM c)',
+])
+def test_write_words_as_aliases_are_read_only(sql):
+    SQLValidator(SCHEMA).check_read_only(sql)
+
+
+@pytest.mark.parametrize('sql', [
+    'INSERT INTO Vacancies VALUES (1)',
+    'SELECT 1; DROP TABLE Vacancies',
+    'SELECT 1; SET threads = 1',
+    'WITH c AS (SELECT 1) INSERT INTO Vacancies SELECT * FROM c',
+    '(DELETE FROM Vacancies)',
+    'SELECT 1; (UPDATE Vacancies SET city = NULL)',
+    '',
+])
+def test_write_statements_are_rejected(sql):
+    with pytest.raises(WriteQueryError):
+        SQLValidator(SCHEMA).check_read_only(sql)